@@ -14,6 +14,7 @@
 # limitations under the License.
 from libcloud.types import Provider
 from libcloud.providers import get_driver
+from libcloud.multi import MultiDriver
 
 EC2 = get_driver(Provider.EC2_US_EAST)
 Slicehost = get_driver(Provider.SLICEHOST)
@@ -23,12 +24,16 @@ drivers = [ EC2('access key id', 'secret key'),
             Slicehost('api key'), 
             Rackspace('username', 'api key') ]
 
-nodes = [ driver.list_nodes() for driver in drivers ]
+# list the nodes of all providers at once, waiting at most 30 seconds
+nodes = MultiDriver(drivers, timeout=30).list_nodes()
 
 print nodes
 # [ <Node: provider=Amazon, status=RUNNING, name=bob, ip=1.2.3.4.5>,
 # <Node: provider=Slicehost, status=REBOOT, name=korine, ip=6.7.8.9.10>, ... ]
 
+# providers that failed or were too slow are left out, with their error
+print nodes.errors
+
 # grab the node named "test"
 node = filter(lambda x: x.name == 'test', nodes)[0]
 
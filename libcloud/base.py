@@ -27,14 +27,21 @@ from libcloud.interface import INodeFactory, INode
 from libcloud.interface import INodeSizeFactory, INodeSize
 from libcloud.interface import INodeImageFactory, INodeImage
 from libcloud.types import NodeState
-from libcloud.ssh import SSHClient
+from libcloud.ssh import SSHClient, SSH_CONNECT_ERRORS, wait_for_ssh
+from libcloud.pool import WorkerPool, DEFAULT_POOL_SIZE
+from libcloud.operations import Result, get_scheduler
+from libcloud.watcher import StateWatcher
 import time
+import threading
 import hashlib
 import StringIO
 import os
 import socket
 from pipes import quote as pquote
 
+DEPLOY_TIMEOUT = 60 * 15
+DEPLOY_POLICIES = ('continue', 'abort', 'replace')
+
 
 class Node(object):
     """
@@ -74,6 +81,133 @@ class Node(object):
                    self.driver.name))
 
 
+def _as_list(value):
+    # Most drivers hand out lists of IPs, some a single address or None.
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class NodeCollection(list):
+    """
+    A list of L{Node} objects with constant time lookups.
+
+    Behaves exactly like a C{list}, so it can be returned from
+    L{NodeDriver.list_nodes}.  Hash indexes on uuid, id, name and IP
+    address are built on the first lookup and dropped whenever the
+    collection is modified.
+    """
+
+    def __init__(self, nodes=None):
+        list.__init__(self, nodes or [])
+        self._indexes = None
+
+    def _invalidate(self):
+        self._indexes = None
+
+    def _uuid(self, node):
+        return node.uuid
+
+    def _build_indexes(self):
+        uuids, ids, names, ips = {}, {}, {}, {}
+        for node in self:
+            uuids[self._uuid(node)] = node
+            ids[node.id] = node
+            names.setdefault(node.name, []).append(node)
+            # Subclasses may hold images, sizes or locations, without IPs
+            for ip in (_as_list(getattr(node, 'public_ip', None))
+                       + _as_list(getattr(node, 'private_ip', None))):
+                if ip:
+                    ips[ip] = node
+        self._indexes = {'uuid': uuids, 'id': ids, 'name': names, 'ip': ips}
+        return self._indexes
+
+    def _index(self, key):
+        indexes = self._indexes
+        if indexes is None:
+            indexes = self._build_indexes()
+        return indexes[key]
+
+    def by_uuid(self, uuid):
+        """
+        @return: The L{Node} with the given uuid, or C{None}
+        """
+        return self._index('uuid').get(uuid)
+
+    def by_id(self, id):
+        """
+        @return: The L{Node} with the given provider id, or C{None}
+        """
+        return self._index('id').get(id)
+
+    def by_name(self, name):
+        """
+        Names are not unique on every provider, so this returns a list.
+
+        @return: C{list} of L{Node} objects with the given name
+        """
+        return list(self._index('name').get(name, []))
+
+    def by_ip(self, ip):
+        """
+        @return: The L{Node} owning the given public or private IP, or C{None}
+        """
+        return self._index('ip').get(ip)
+
+    def where(self, **kwargs):
+        """
+        Filter nodes on attribute equality, e.g. C{where(state=RUNNING)}.
+
+        @return: A new L{NodeCollection}
+        """
+        items = kwargs.items()
+        return NodeCollection([n for n in self
+                               if all([getattr(n, k) == v
+                                       for k, v in items])])
+
+    def append(self, node):
+        self._invalidate()
+        list.append(self, node)
+
+    def extend(self, nodes):
+        self._invalidate()
+        list.extend(self, nodes)
+
+    def insert(self, index, node):
+        self._invalidate()
+        list.insert(self, index, node)
+
+    def remove(self, node):
+        self._invalidate()
+        list.remove(self, node)
+
+    def pop(self, *args):
+        self._invalidate()
+        return list.pop(self, *args)
+
+    def __setitem__(self, index, node):
+        self._invalidate()
+        list.__setitem__(self, index, node)
+
+    def __delitem__(self, index):
+        self._invalidate()
+        list.__delitem__(self, index)
+
+    def __setslice__(self, i, j, nodes):
+        self._invalidate()
+        list.__setslice__(self, i, j, nodes)
+
+    def __delslice__(self, i, j):
+        self._invalidate()
+        list.__delslice__(self, i, j)
+
+    def __iadd__(self, nodes):
+        self._invalidate()
+        return list.__iadd__(self, nodes)
+
+
 class NodeSize(object):
     """
     A Base NodeSize class to derive from.
@@ -338,7 +472,7 @@ class ConnectionKey(object):
         @type port: C{int}
         @param port: Optional port to override our default
 
-        @returns: A connection
+        @returns: A connection, which is also kept in C{self.connection}
         """
         host = host or self.host
         port = port or self.port[self.secure]
@@ -351,6 +485,7 @@ class ConnectionKey(object):
         #connection = self.conn_classes[False]("127.0.0.1", 8080)
 
         self.connection = connection
+        return connection
 
     def _user_agent(self):
       return 'libcloud/%s (%s)%s' % (
@@ -408,13 +543,20 @@ class ConnectionKey(object):
         if data != '':
             data = self.encode_data(data)
         url = '?'.join((action, urllib.urlencode(params)))
-        
+        return self._send(method, url, data, headers)
+
+    def _send(self, method, url, body, headers):
+        """
+        Send a fully prepared request and wrap the reply in I{responseCls}.
+        """
         # Removed terrible hack...this a less-bad hack that doesn't execute a
         # request twice, but it's still a hack.
-        self.connect()
-        self.connection.request(method=method, url=url, body=data,
-                                headers=headers)
-        response = self.responseCls(self.connection.getresponse())
+        # Keep our own reference, so threads sharing this object don't read
+        # each other's responses.
+        connection = self.connect()
+        connection.request(method=method, url=url, body=body,
+                           headers=headers)
+        response = self.responseCls(connection.getresponse())
         response.connection = self
         return response
 
@@ -459,6 +601,26 @@ class ConnectionUserAndKey(ConnectionKey):
         self.user_id = user_id
 
 
+class _DeployPhases(object):
+    """
+    Limits how many nodes of a L{NodeDriver.deploy_nodes} call are in each
+    phase, and stops them between phases once C{aborted} is set.
+    """
+
+    def __init__(self, limits):
+        self.aborted = False
+        self.semaphores = dict([(name, threading.BoundedSemaphore(limit))
+                                for name, limit in limits.items()])
+
+    def run(self, name, func):
+        self.semaphores[name].acquire()
+        try:
+            if self.aborted:
+                raise Exception("Deployment aborted after an earlier failure")
+            return func()
+        finally:
+            self.semaphores[name].release()
+
 class NodeDriver(object):
     """
     A base NodeDriver class to derive from
@@ -477,9 +639,24 @@ class NodeDriver(object):
               for nodes.
             - password: Supports L{NodeAuthPassword} as an authentication
               method for nodes.
+            - userdata: Runs deployments from userdata at boot, see
+              L{deploy_node}.
+            - personality: Writes the files of file-only deployments at
+              boot, see L{deploy_node}.
     """
     NODE_STATE_MAP = {}
 
+    bulk_concurrency = DEFAULT_POOL_SIZE
+    """Number of threads used by bulk operations without a native API."""
+    rate_limit = None
+    """Minimum seconds between two calls started by a bulk operation."""
+    operation_scheduler = None
+    """L{OperationScheduler} for async operations, C{None} for the shared one."""
+    get_nodes_is_batched = True
+    """Whether L{get_nodes} fetches any number of nodes in one request."""
+
+    _state_watcher = None
+
     def __init__(self, key, secret=None, secure=True):
         """
         @keyword    key:    API key or username to used
@@ -495,6 +672,7 @@ class NodeDriver(object):
         self.key = key
         self.secret = secret
         self.secure = secure
+        self._state_watcher_lock = threading.Lock()
         if self.secret:
           self.connection = self.connectionCls(key, secret, secure)
         else:
@@ -529,6 +707,25 @@ class NodeDriver(object):
         raise NotImplementedError, \
             'create_node not implemented for this driver'
 
+    def create_node_async(self, **kwargs):
+        """
+        Start creating a node and return without waiting for it.
+
+        Takes the same arguments as L{create_node}.  Drivers that can,
+        return as soon as the provider has accepted the node and finish
+        the remaining steps on the operation scheduler; the default
+        runs all of L{create_node} there.
+
+        @return: L{OperationHandle} whose C{wait()} returns the new L{Node}
+        """
+        def operation():
+            yield Result(self.create_node(**kwargs))
+        return self._start_operation(operation())
+
+    def _start_operation(self, operation):
+        scheduler = self.operation_scheduler or get_scheduler()
+        return scheduler.start(operation)
+
     def destroy_node(self, node):
         """Destroy a node.
 
@@ -548,14 +745,121 @@ class NodeDriver(object):
         raise NotImplementedError, \
             'reboot_node not implemented for this driver'
 
+    def create_nodes(self, specs, concurrency=None, **kwargs):
+        """
+        Create many nodes.
+
+        @param      specs:  Either the number of identical nodes to create,
+                            or a C{list} of C{dict}s of L{create_node}
+                            keyword arguments, each overriding C{kwargs}.
+                            When a count is given, C{-1}, C{-2}, ... is
+                            appended to C{name}.
+        @type       specs:  C{int} or C{list}
+
+        @keyword    concurrency: Number of threads to use
+        @type       concurrency: C{int}
+
+        @return: C{list} holding, for each node, the new L{Node} or the
+                 exception raised while creating it
+        """
+        return self._bulk(lambda args: self.create_node(**args),
+                          self._expand_specs(specs, kwargs), concurrency)
+
+    def _expand_specs(self, specs, kwargs):
+        # Turns a count or a list of overrides into one dict of keyword
+        # arguments per node.
+        if isinstance(specs, (int, long)):
+            count = specs
+            specs = []
+            for i in range(count):
+                spec = {}
+                if count > 1 and 'name' in kwargs:
+                    spec['name'] = '%s-%d' % (kwargs['name'], i + 1)
+                specs.append(spec)
+
+        expanded = []
+        for spec in specs:
+            args = dict(kwargs)
+            args.update(spec)
+            expanded.append(args)
+        return expanded
+
+    def destroy_nodes(self, nodes, concurrency=None):
+        """
+        Destroy many nodes.
+
+        Drivers with a batch API override this, otherwise L{destroy_node}
+        is called from a bounded pool of threads.
+
+        @return: C{list} holding, for each node, the result of
+                 L{destroy_node} or the exception it raised
+        """
+        return self._bulk(self.destroy_node, nodes, concurrency)
+
+    def reboot_nodes(self, nodes, concurrency=None):
+        """
+        Reboot many nodes.
+
+        @return: C{list} holding, for each node, the result of
+                 L{reboot_node} or the exception it raised
+        """
+        return self._bulk(self.reboot_node, nodes, concurrency)
+
+    def _bulk(self, func, items, concurrency=None):
+        pool = WorkerPool(concurrency or self.bulk_concurrency,
+                          self.rate_limit)
+        return pool.map(func, items)
+
     def list_nodes(self):
         """
         List all nodes
-        @return: C{list} of L{Node} objects
+        @return: L{NodeCollection} (a C{list}) of L{Node} objects
         """
         raise NotImplementedError, \
             'list_nodes not implemented for this driver'
 
+    def get_node(self, node_id):
+        """
+        Get a single node by its provider id.
+
+        @return: L{Node}, or C{None} if the node does not exist
+        """
+        nodes = self.get_nodes([node_id])
+        if not nodes:
+            return None
+        return nodes[0]
+
+    def get_nodes(self, node_ids):
+        """
+        Get several nodes by their provider ids.
+
+        Drivers whose API can fetch individual nodes override this; the
+        default falls back to an indexed scan of L{list_nodes}.  Ids that
+        do not exist are left out of the result.
+
+        @return: L{NodeCollection} of L{Node} objects, in C{node_ids} order
+        """
+        listing = self.list_nodes()
+        if not isinstance(listing, NodeCollection):
+            listing = NodeCollection(listing)
+        return NodeCollection([node for node in
+                               [listing.by_id(i) for i in node_ids]
+                               if node is not None])
+
+    @property
+    def state_watcher(self):
+        """
+        L{StateWatcher} shared by everything waiting on this driver's nodes.
+        """
+        if self._state_watcher is None:
+            self._state_watcher_lock.acquire()
+            try:
+                if self._state_watcher is None:
+                    self._state_watcher = StateWatcher(self)
+            finally:
+                self._state_watcher_lock.release()
+        return self._state_watcher
+
     def list_images(self, location=None):
         """
         List images on a provider
@@ -581,12 +885,152 @@ class NodeDriver(object):
             'list_locations not implemented for this driver'
 
     def deploy_node(self, **kwargs):
+        """
+        Create a node, wait until it can be reached over SSH, and run a
+        deployment on it.
+
+        Takes the keyword arguments of L{create_node}, and:
+
+        @keyword    deploy: Deployment to run once the node is up
+                            (required)
+        @type       deploy: L{Deployment}
+
+        @keyword    ssh_port: Port sshd listens on (22)
+        @type       ssh_port: C{int}
+
+        @keyword    timeout: Seconds to wait for the node to come up (900)
+        @type       timeout: C{float}
+
+        @keyword    boot_deploy: Let the node run the deployment itself
+                                 while booting, if the driver and the
+                                 deployment allow it (C{False})
+        @type       boot_deploy: C{bool}
+
+        With C{boot_deploy}, drivers supporting C{userdata} or
+        C{personality} hand the deployment to the node with the create
+        request, and only wait for the driver's sign that it has run: there
+        is no SSH wait or connection at all.  C{node.extra['deploy_timings']}
+        then has C{api_running} and C{deployment} only.  That sign may be
+        slow to come (EC2 only captures console output now and then), so
+        it is opt-in.  If the deployment can't run at boot, the node is
+        deployed over SSH; drivers without an SSH login raise
+        C{NotImplementedError} naming the reason instead.
+
+        Readiness is checked in increasingly expensive phases: the API
+        reporting the node running, a plain TCP connect reading the sshd
+        banner, and only then SSH authentication.  The seconds spent in
+        each are stored in C{node.extra['deploy_timings']} under
+        C{api_running}, C{port_open}, C{ssh_authenticated} and
+        C{deployment}.
+
+        @return: The L{Node} returned by the deployment
+        """
+        return self._deploy(kwargs, kwargs['deploy'])
+
+    def deploy_nodes(self, specs, deploy, policy='continue',
+                     create_concurrency=None, wait_concurrency=None,
+                     deploy_concurrency=None, max_replacements=None,
+                     **kwargs):
+        """
+        Create and deploy many nodes, overlapping the phases across nodes.
+
+        Each node goes through the phases of L{deploy_node} on its own, so
+        some can be deploying while others are still being created.
+
+        @param      specs:  As for L{create_nodes}
+        @type       specs:  C{int} or C{list}
+
+        @param      deploy: Deployment to run on every node
+        @type       deploy: L{Deployment}
+
+        @keyword    policy: What to do when a node fails: C{'continue'}
+                            with the others, C{'abort'} (other nodes fail
+                            before their next phase, and are left as they
+                            are) or C{'replace'} it with a new node,
+                            destroying the failed one
+        @type       policy: C{str}
+
+        @keyword    create_concurrency: Nodes being created at once
+        @type       create_concurrency: C{int}
+
+        @keyword    wait_concurrency: Nodes being waited on at once
+        @type       wait_concurrency: C{int}
+
+        @keyword    deploy_concurrency: Deployments running at once
+        @type       deploy_concurrency: C{int}
+
+        @keyword    max_replacements: Most replacement nodes to create with
+                                      C{policy='replace'}, shared by all
+                                      nodes; defaults to the number of
+                                      nodes
+        @type       max_replacements: C{int}
+
+        Each limit defaults to C{bulk_concurrency}.
+
+        @return: C{list} holding, for each node, the deployed L{Node} (see
+                 C{extra['deploy_timings']}) or the exception it failed with
+        """
+        if policy not in DEPLOY_POLICIES:
+            raise ValueError("policy must be one of %s"
+                             % ", ".join(DEPLOY_POLICIES))
+        specs = self._expand_specs(specs, kwargs)
+        if max_replacements is None:
+            max_replacements = len(specs)
+        limits = {
+            'create': create_concurrency or self.bulk_concurrency,
+            'wait': wait_concurrency or self.bulk_concurrency,
+            'deploy': deploy_concurrency or self.bulk_concurrency,
+        }
+        phases = _DeployPhases(limits)
+        state = {'replacements': 0}
+        lock = threading.Lock()
+
+        def deploy_one(args):
+            while True:
+                created = []
+                try:
+                    return self._deploy(dict(args), deploy, phases, created)
+                except Exception:
+                    lock.acquire()
+                    try:
+                        if policy == 'abort':
+                            phases.aborted = True
+                        replace = (policy == 'replace' and
+                                   state['replacements'] < max_replacements)
+                        if replace:
+                            state['replacements'] += 1
+                    finally:
+                        lock.release()
+                    if not replace:
+                        raise
+                for node in created:
+                    try:
+                        self.destroy_node(node)
+                    except Exception:
+                        pass
+
+        return self._bulk(deploy_one, specs, sum(limits.values()))
+
+    def _deploy(self, kwargs, deploy, phases=None, created=None):
+        # Runs the phases of deploy_node for one node, through phases (a
+        # _DeployPhases) if given; created collects the node as soon as it
+        # exists.
+        boot_error = None
+        if kwargs.get('boot_deploy', False):
+            try:
+                return self._boot_deploy(kwargs, deploy, phases, created)
+            except NotImplementedError, e:
+                boot_error = e
+
         # TODO: support ssh keys
-        WAIT_PERIOD=3
         password = None
 
         if 'generates_password' not in self.features["create_node"]:
             if 'password' not in self.features["create_node"]:
+                if boot_error is not None:
+                    raise NotImplementedError, \
+                        'deploy_node can\'t deploy at boot (%s) and this ' \
+                        'driver has no SSH login' % boot_error
                 raise NotImplementedError, \
                     'deploy_node not implemented for this driver'
 
@@ -594,44 +1038,127 @@ class NodeDriver(object):
                 kwargs['auth'] = NodeAuthPassword(os.urandom(16).encode('hex'))
 
             password = kwargs['auth'].password
-        node = self.create_node(**kwargs)
+        ssh_port = kwargs.get('ssh_port', 22)
+        node = self._in_phase(phases, 'create',
+                              lambda: self.create_node(**kwargs))
+        if created is not None:
+            created.append(node)
         if 'generates_password' in self.features["create_node"]:
             password = node.extra.get('password')
-        start = time.time()
-        end = start + (60 * 15)
-        while time.time() < end:
-            # need to wait until we get a public IP address.
-            # TODO: there must be a better way of doing this
-            time.sleep(WAIT_PERIOD)
-            nodes = self.list_nodes()
-            nodes = filter(lambda n: n.uuid == node.uuid, nodes)
-            if len(nodes) == 0:
-                raise Exception("Booted node[%s] is missing form list_nodes.", node)
-            if len(nodes) > 1:
-                raise Exception("Booted single node[%s], but multiple nodes have same UUID", node)
-
-            node = nodes[0]
-
-            if node.public_ip is not None and node.public_ip != "" and node.state == NodeState.RUNNING:
-                break
 
+        timings = {}
+        end = time.time() + kwargs.get('timeout', DEPLOY_TIMEOUT)
+        node, client = self._in_phase(phases, 'wait', lambda:
+            self._wait_for_ssh(node, password, ssh_port, end, timings))
+
+        phase = time.time()
+        try:
+            n = self._in_phase(phases, 'deploy',
+                               lambda: deploy.run(node, client))
+        finally:
+            client.close()
+        timings['deployment'] = time.time() - phase
+        n.extra['deploy_timings'] = timings
+        return n
+
+    def _boot_deploy(self, kwargs, deploy, phases, created):
+        # Runs the deployment at boot; raises NotImplementedError, before
+        # creating anything, if it can't.
+        features = self.features["create_node"]
+        if 'userdata' not in features and 'personality' not in features:
+            raise NotImplementedError, \
+                'this driver takes neither userdata nor personality files'
+        if not hasattr(deploy, 'boot_actions'):
+            raise NotImplementedError, \
+                'boot_actions not implemented for this deployment'
+        actions = deploy.boot_actions()
+        token = os.urandom(8).encode('hex')
+        create_kwargs = self._boot_payload(dict(kwargs), actions, token)
+        node = self._in_phase(phases, 'create',
+                              lambda: self.create_node(**create_kwargs))
+        if created is not None:
+            created.append(node)
+
+        timings = {}
+        end = time.time() + kwargs.get('timeout', DEPLOY_TIMEOUT)
+        phase = time.time()
+        node = self._in_phase(phases, 'wait', lambda:
+            self.state_watcher.watch(node, timeout=end - phase).result())
+        now = time.time()
+        timings['api_running'] = now - phase
+        phase = now
+
+        node = self._in_phase(phases, 'deploy', lambda:
+            self._wait_boot_deploy(node, token, end))
+        timings['deployment'] = time.time() - phase
+        node.extra['deploy_timings'] = timings
+        return node
+
+    def _boot_payload(self, kwargs, actions, token):
+        """
+        Add boot actions to the keyword arguments of L{create_node}.
+
+        @param      actions: See L{Deployment.boot_actions}
+        @type       actions: C{list}
+
+        @param      token: Identifies this deployment, for
+                           L{_wait_boot_deploy}
+        @type       token: C{str}
+
+        @return: the keyword arguments
+
+        @raise NotImplementedError: this driver can't carry out C{actions}
+            at boot; the message says why
+        """
+        raise NotImplementedError, \
+            'boot deployment not implemented for this driver'
+
+    def _wait_boot_deploy(self, node, token, end):
+        """
+        Wait until a node has carried out the boot actions added by
+        L{_boot_payload}, or until C{end}.
+
+        By default, a running node is taken to be done.
+
+        @return: The deployed L{Node}
+        """
+        return node
+
+    def _in_phase(self, phases, name, func):
+        if phases is None:
+            return func()
+        return phases.run(name, func)
+
+    def _wait_for_ssh(self, node, password, ssh_port, end, timings):
+        # Waits for the node to run, sshd to answer and login to work.
+        # Returns the fresh node and a connected SSHClient.
+        start = phase = time.time()
+
+        # need to wait until we get a public IP address.
+        node = self.state_watcher.watch(node, timeout=end - start).result()
+        now = time.time()
+        timings['api_running'] = now - phase
+        phase = now
+
+        wait_for_ssh(node.public_ip[0], ssh_port, timeout=end - now)
+        now = time.time()
+        timings['port_open'] = now - phase
+        phase = now
+
+        # sshd can answer before accounts and keys are set up, so the
+        # handshake itself is still retried for a while.
         client = SSHClient(hostname=node.public_ip[0],
-                            port=22, username='root',
-                            password=password)
-        laste = None
-        while time.time() < end:
-            laste = None
+                           port=ssh_port, username='root',
+                           password=password)
+        interval = 0.5
+        while True:
             try:
                 client.connect()
                 break
-            except IOError, e:
-                laste = e
-            except socket.error, e:
-                laste = e
-            time.sleep(WAIT_PERIOD)
-        if laste is not None:
-            raise e
-
-        n = kwargs["deploy"].run(node, client)
-        client.close()
-        return n
+            except SSH_CONNECT_ERRORS:
+                if time.time() + interval > end:
+                    raise
+            time.sleep(interval)
+            interval = min(interval * 2, 10)
+        timings['ssh_authenticated'] = time.time() - phase
+        return node, client
@@ -16,32 +16,400 @@
 """
 Provides generic deployment steps for machines post boot.
 """
+from pipes import quote as pquote
+import hashlib
 import os
+import posixpath
+import struct
+import StringIO
+import tempfile
+import threading
+import time
+
+from libcloud.types import DeploymentException
+
+def remote_checksums(client, paths):
+    """
+    Fetch the SHA-256 of several remote files with a single command.
+
+    @return: C{dict} mapping each path that exists to its hex digest
+    """
+    if not paths:
+        return {}
+    cmd = 'sha256sum %s 2>/dev/null; true' % ' '.join(
+        [pquote(path) for path in paths])
+    checksums = {}
+    for line in client.run(cmd)[0].splitlines():
+        # Names sha256sum had to escape start with a backslash; those
+        # just count as unknown.
+        digest, sep, path = line.partition('  ')
+        if sep and not digest.startswith('\\'):
+            checksums[path] = digest
+    return checksums
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def _weak_checksum(data):
+    # rsync's rolling checksum of a block; SYNC_HELPER has the same.
+    a = b = 0
+    n = len(data)
+    for i in xrange(n):
+        a += data[i]
+        b += (n - i) * data[i]
+    return a & 0xffff, b & 0xffff
+
+# Bytes of unmatched data compute_delta holds before sending them on
+DELTA_LITERAL_SIZE = 1024 * 1024
+
+def compute_delta(source, signatures, block_size, write=None):
+    """
+    Encode C{source} as copies of remote blocks and literal bytes.
+
+    Blocks are found at any offset with a rolling checksum, so inserting
+    or removing bytes only costs the bytes around the change.  The source
+    is read through a window a little over L{DELTA_LITERAL_SIZE}, so files
+    of any size can be encoded.
+
+    @param      source: New content of the file
+    @type       source: C{str} or C{file}
+
+    @param      signatures: C{(weak, md5)} of each C{block_size} block of
+                            the remote file, as computed by
+                            C{SYNC_HELPER}
+    @type       signatures: C{list}
+
+    @keyword    write: Called with each piece of the delta as it is made
+    @type       write: C{callable}
+
+    @return: the delta, which C{SYNC_HELPER} applies with C{patch}, or
+             C{None} if C{write} was given
+    """
+    if isinstance(source, basestring):
+        source = StringIO.StringIO(source)
+    pieces = None
+    if write is None:
+        pieces = []
+        write = pieces.append
+    blocks = {}
+    strongs = {}
+    for index, (weak, strong) in enumerate(signatures):
+        blocks.setdefault(weak, []).append((strong, index))
+        strongs.setdefault(strong, index)
+
+    def send_literal(data):
+        if data:
+            write('L' + struct.pack('>I', len(data)) + str(data))
+
+    # buf holds unsent literal bytes from `literal` on, then the window
+    # starting at `i`.
+    buf = bytearray()
+    literal = i = 0
+    eof = False
+    rolled = False
+    read_size = max(block_size, 64 * 1024)
+    while True:
+        if i - literal >= DELTA_LITERAL_SIZE:
+            send_literal(buf[literal:i])
+            literal = i
+        if literal >= read_size:
+            del buf[:literal]
+            i -= literal
+            literal = 0
+        # One byte past the window, to roll the checksum onto
+        while not eof and len(buf) - i <= block_size:
+            chunk = source.read(read_size)
+            if not chunk:
+                eof = True
+            buf.extend(chunk)
+        if len(buf) - i < block_size:
+            break
+        match = None
+        if not rolled:
+            # Unchanged stretches match block after block, so try the
+            # (C speed) strong checksum before computing the weak one.
+            match = strongs.get(hashlib.md5(buf[i:i + block_size])
+                                .hexdigest())
+            if match is None:
+                a, b = _weak_checksum(buf[i:i + block_size])
+                rolled = True
+        candidates = match is None and blocks.get((b << 16) | a)
+        if candidates:
+            strong = hashlib.md5(buf[i:i + block_size]).hexdigest()
+            for digest, index in candidates:
+                if digest == strong:
+                    match = index
+                    break
+        if match is not None:
+            send_literal(buf[literal:i])
+            write('C' + struct.pack('>I', match))
+            i += block_size
+            literal = i
+            rolled = False
+            continue
+        if i + block_size < len(buf):
+            old, new = buf[i], buf[i + block_size]
+            a = (a - old + new) & 0xffff
+            b = (b - block_size * old + a) & 0xffff
+        i += 1
+    send_literal(buf[literal:])
+    if pieces is not None:
+        return ''.join(pieces)
+
+# Home directory of the user boot-time deployments stand in for
+BOOT_HOME = '/root'
+
+def _boot_path(path):
+    return posixpath.join(BOOT_HOME, path)
+
+def userdata_script(actions, token):
+    """
+    Compile boot actions into a shell script, for drivers taking userdata.
+
+    Script output goes to C{/var/log/libcloud-deploy.log}.  Once done, the
+    script writes C{libcloud-deploy-TOKEN STATUS} to the console, C{STATUS}
+    being the first non-zero exit status of a script, or 0.
+
+    @param      actions: As returned by L{Deployment.boot_actions}
+    @type       actions: C{list}
+
+    @param      token: Marks this deployment's line on the console
+    @type       token: C{str}
+
+    @return: C{str}
+    """
+    lines = ['#!/bin/sh', 'status=0', 'cd %s' % BOOT_HOME,
+             'exec >>/var/log/libcloud-deploy.log 2>&1']
+    for action in actions:
+        if action[0] == 'file':
+            path, contents, mode = action[1:]
+            lines.append('mkdir -p %s' % pquote(posixpath.dirname(path)))
+            lines.append("base64 -d > %s <<'LIBCLOUD_EOF'" % pquote(path))
+            lines.append(contents.encode('base64').rstrip('\n'))
+            lines.append('LIBCLOUD_EOF')
+            if mode is not None:
+                lines.append('chmod %o %s' % (mode, pquote(path)))
+        elif action[0] == 'run':
+            lines.append('%s || { s=$?; [ $status = 0 ] && status=$s; }'
+                         % pquote(action[1]))
+        elif action[0] == 'delete':
+            lines.append('rm -f %s' % pquote(action[1]))
+    lines.append('echo "libcloud-deploy-%s $status" > /dev/console' % token)
+    return '\n'.join(lines) + '\n'
+
+def personality_files(actions):
+    """
+    Compile boot actions into files to inject, for drivers that can only
+    write files at boot.
+
+    @return: C{dict} mapping path to contents, or C{None} if any action
+             has to run something
+    """
+    files = {}
+    for action in actions:
+        if action[0] != 'file' or action[3] is not None:
+            return None
+        files[action[1]] = action[2]
+    return files
+
+class ChecksummedClient(object):
+    """
+    Wraps an SSH client along with checksums already fetched for the steps
+    run through it.
+    """
+    def __init__(self, client, remote_checksums):
+        self._client = client
+        self.remote_checksums = remote_checksums
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
 
 class Deployment(object):
-    pass
+    """
+    Base class for deployment steps.
+
+    Steps that upload or run something skip it when the node already has
+    the same content, unless C{force} is set; C{unchanged} tells whether
+    the last run did.  Containers fetch the checksums of all their steps'
+    files in one command.
+    """
+    force = False
+    unchanged = False
+
+    def checksum_paths(self):
+        """
+        @return: C{list} of remote paths whose checksum this step compares
+        """
+        return []
+
+    def unchanged_steps(self):
+        """
+        @return: C{list} of the steps skipped on the last run
+        """
+        if self.unchanged:
+            return [self]
+        return []
+
+    def _unchanged(self, client, path, digest):
+        # Compare against checksums fetched by a container, or fetch ours.
+        checksums = getattr(client, 'remote_checksums', None)
+        if checksums is None and not self.force:
+            checksums = remote_checksums(client, self.checksum_paths())
+        self.unchanged = (not self.force and
+                          checksums.get(path) == digest)
+        return self.unchanged
+
+    def boot_actions(self):
+        """
+        Describe this step as actions a node can carry out by itself while
+        booting, with no SSH connection.
+
+        Actions are C{('file', path, contents, mode)}, C{('run', path)} and
+        C{('delete', path)} tuples, with absolute paths; C{mode} may be
+        C{None}.
+
+        @return: C{list} of actions
+        """
+        raise NotImplementedError, \
+            'boot_actions not implemented for this deployment'
+
+    def _with_checksums(self, client):
+        if getattr(client, 'remote_checksums', None) is not None:
+            return client
+        return ChecksummedClient(client,
+                                 remote_checksums(client,
+                                                  self.checksum_paths()))
 
 class SSHKeyDeployment(Deployment):
-    def __init__(self, key):
+    def __init__(self, key, force=False):
         self.key = key
-  
+        self.force = force
+
+    def checksum_paths(self):
+        return [".ssh/authorized_keys"]
+
+    def boot_actions(self):
+        return [('file', _boot_path(".ssh/authorized_keys"), self.key, None)]
+
     def run(self, node, client):
+        if self._unchanged(client, ".ssh/authorized_keys",
+                           hashlib.sha256(self.key).hexdigest()):
+            return node
         client.put(".ssh/authorized_keys", contents=self.key)
         return node
 
+class FileDeployment(Deployment):
+    """
+    Uploads a local file, or anything file-like, streaming it in chunks.
+
+    A local file is not uploaded again if the remote one has the same
+    content (its mode is not compared).  File-like sources are always
+    uploaded.
+
+    @ivar progress: Optional C{progress(sent, total, rate)} callback, see
+        L{libcloud.ssh.copy_stream}
+    """
+    def __init__(self, source, target, chmod=None, progress=None,
+                 force=False):
+        self.source = source
+        self.target = target
+        self.chmod = chmod
+        self.progress = progress
+        self.force = force
+
+    def checksum_paths(self):
+        if isinstance(self.source, basestring):
+            return [self.target]
+        return []
+
+    def boot_actions(self):
+        if not isinstance(self.source, basestring):
+            # Reading it here would leave nothing for a later SSH upload.
+            raise NotImplementedError, \
+                'file-like sources can only be uploaded over SSH'
+        f = open(self.source, 'rb')
+        try:
+            return [('file', _boot_path(self.target), f.read(), self.chmod)]
+        finally:
+            f.close()
+
+    def run(self, node, client):
+        if isinstance(self.source, basestring):
+            if self._unchanged(client, self.target,
+                               _sha256_file(self.source)):
+                return node
+            client.put(path=self.target, chmod=self.chmod,
+                       local_path=self.source, progress=self.progress)
+        else:
+            client.put(path=self.target, chmod=self.chmod,
+                       contents=self.source, progress=self.progress)
+        return node
+
 class ScriptDeployment(Deployment):
-    def __init__(self, script, name=None, delete=False):
+    """
+    Uploads a script and runs it.
+
+    Output is handed to C{on_stdout} and C{on_stderr} as it arrives, if
+    given.  With C{max_output}, C{stdout} and C{stderr} only keep the last
+    that many bytes, so huge logs don't pile up in memory.
+
+    Given a C{name}, a script that succeeded leaves a C{name.sha256} stamp
+    behind, and is not run again while its content stays the same.
+
+    @ivar exit_status: Exit status of the script once it has run
+    """
+    def __init__(self, script, name=None, delete=False, on_stdout=None,
+                 on_stderr=None, max_output=None, force=False):
         self.script = script
         self.stdout = None
         self.stderr = None
+        self.exit_status = None
         self.delete = delete
+        self.on_stdout = on_stdout
+        self.on_stderr = on_stderr
+        self.max_output = max_output
+        self.force = force
         self.name = name
+        self.stamp = None
         if self.name is None:
             self.name = "/root/deployment_%s.sh" % (os.urandom(4).encode('hex'))
+        else:
+            self.stamp = self.name + '.sha256'
+
+    def checksum_paths(self):
+        if self.stamp is None:
+            return []
+        return [self.stamp]
+
+    def boot_actions(self):
+        path = _boot_path(self.name)
+        actions = [('file', path, self.script, 0755), ('run', path)]
+        if self.delete:
+            actions.append(('delete', path))
+        return actions
 
     def run(self, node, client):
-        client.put(path=self.name, chmod=755, contents=self.script)
-        self.stdout, self.stderr = client.run(self.name)
+        if self.stamp is not None:
+            stamp = hashlib.sha256(self.script).hexdigest() + '\n'
+            if self._unchanged(client, self.stamp,
+                               hashlib.sha256(stamp).hexdigest()):
+                return node
+        client.put(path=self.name, chmod=0755, contents=self.script)
+        self.stdout, self.stderr, self.exit_status = client.run(
+            self.name, on_stdout=self.on_stdout, on_stderr=self.on_stderr,
+            buffer_size=self.max_output)
+        if self.stamp is not None and self.exit_status == 0:
+            client.put(path=self.stamp, contents=stamp)
         if self.delete:
             client.delete(self.name)
         return node
@@ -56,7 +424,483 @@ class MultiStepDeployment(Deployment):
             add = add if isinstance(add, (list, tuple)) else [add]
             self.steps.extend(add)
 
+    def checksum_paths(self):
+        paths = []
+        for s in self.steps:
+            paths.extend(s.checksum_paths())
+        return paths
+
+    def unchanged_steps(self):
+        steps = []
+        for s in self.steps:
+            steps.extend(s.unchanged_steps())
+        return steps
+
+    def boot_actions(self):
+        actions = []
+        for s in self.steps:
+            actions.extend(s.boot_actions())
+        return actions
+
     def run(self, node, client):
+        client = self._with_checksums(client)
         for s in self.steps:
             node = s.run(node, client)
         return node
+
+class GraphDeployment(Deployment):
+    """
+    Runs steps in dependency order, with steps that don't depend on each
+    other running side by side.
+
+    Concurrent steps share the one SSH connection, each command going over
+    its own channel, and each thread's uploads over its own SFTP session.
+
+    >>> graph = GraphDeployment()
+    >>> graph.add('keys', SSHKeyDeployment(key))  # doctest: +SKIP
+    >>> graph.add('config', FileDeployment('app.conf', 'app.conf'))  # doctest: +SKIP
+    >>> graph.add('install', ScriptDeployment(script),
+    ...           requires=['keys', 'config'])  # doctest: +SKIP
+
+    A failed step skips the steps depending on it, while the others still
+    run; L{run} then raises L{DeploymentException}.
+
+    @ivar report: After L{run}, a C{dict} mapping each step's name to a
+        C{dict} with its C{status} (C{'ok'}, C{'failed'} or C{'skipped'}),
+        C{start} (seconds after the deployment started), C{elapsed} and
+        C{error}
+    """
+    def __init__(self, concurrency=4):
+        self.concurrency = max(1, concurrency)
+        self.names = []
+        self.steps = {}
+        self.requires = {}
+        self.report = {}
+
+    def add(self, name, step, requires=()):
+        """
+        Add a step.
+
+        @param      name: Unique name of the step
+        @type       name: C{str}
+
+        @param      step: What to run
+        @type       step: L{Deployment}
+
+        @keyword    requires: Names of the steps that must succeed first
+        @type       requires: C{list}
+        """
+        if name in self.steps:
+            raise ValueError("Duplicate step %s" % name)
+        self.names.append(name)
+        self.steps[name] = step
+        self.requires[name] = list(requires)
+
+    def _check(self):
+        # Refuse unknown prerequisites and cycles before running anything.
+        # Returns the step names in an order that satisfies requirements.
+        order = []
+        remaining = dict([(name, set(self.requires[name]))
+                          for name in self.names])
+        for name, requires in remaining.items():
+            for required in requires:
+                if required not in self.steps:
+                    raise ValueError("Step %s requires unknown step %s"
+                                     % (name, required))
+        while remaining:
+            ready = [name for name in self.names
+                     if name in remaining and not remaining[name]]
+            if not ready:
+                raise ValueError("Dependency cycle between steps %s"
+                                 % ", ".join(sorted(remaining)))
+            for name in ready:
+                del remaining[name]
+            for requires in remaining.values():
+                requires.difference_update(ready)
+            order.extend(ready)
+        return order
+
+    def checksum_paths(self):
+        paths = []
+        for name in self.names:
+            paths.extend(self.steps[name].checksum_paths())
+        return paths
+
+    def unchanged_steps(self):
+        steps = []
+        for name in self.names:
+            steps.extend(self.steps[name].unchanged_steps())
+        return steps
+
+    def boot_actions(self):
+        # At boot the steps run one after the other.
+        actions = []
+        for name in self._check():
+            actions.extend(self.steps[name].boot_actions())
+        return actions
+
+    def run(self, node, client):
+        self._check()
+        client = self._with_checksums(client)
+        report = dict([(name, {'status': 'pending', 'start': None,
+                               'elapsed': None, 'error': None})
+                       for name in self.names])
+        self.report = report
+        cond = threading.Condition()
+        state = {'running': 0}
+        start = time.time()
+
+        def work(name):
+            began = time.time()
+            try:
+                self.steps[name].run(node, client)
+                status, error = 'ok', None
+            except Exception, e:
+                status, error = 'failed', e
+            cond.acquire()
+            try:
+                report[name]['status'] = status
+                report[name]['error'] = error
+                report[name]['elapsed'] = time.time() - began
+                state['running'] -= 1
+                cond.notify()
+            finally:
+                cond.release()
+
+        cond.acquire()
+        try:
+            while True:
+                launched = False
+                for name in self.names:
+                    if report[name]['status'] != 'pending':
+                        continue
+                    statuses = [report[r]['status']
+                                for r in self.requires[name]]
+                    if 'failed' in statuses or 'skipped' in statuses:
+                        report[name]['status'] = 'skipped'
+                        launched = True
+                    elif (statuses.count('ok') == len(statuses) and
+                          state['running'] < self.concurrency):
+                        report[name]['status'] = 'running'
+                        report[name]['start'] = time.time() - start
+                        state['running'] += 1
+                        launched = True
+                        thread = threading.Thread(target=work, args=(name,))
+                        thread.setDaemon(True)
+                        thread.start()
+                if launched:
+                    continue
+                if not state['running']:
+                    break
+                cond.wait()
+        finally:
+            cond.release()
+
+        failed = [name for name in self.names
+                  if report[name]['status'] == 'failed']
+        if failed:
+            raise DeploymentException("Deployment steps failed: %s"
+                                      % ", ".join(failed), report)
+        return node
+
+# Run on the node by SyncDeployment, under Python 2 or 3.
+SYNC_HELPER = """\
+import hashlib
+import os
+import struct
+import sys
+
+def weak(data):
+    a = b = 0
+    n = len(data)
+    for i, x in enumerate(bytearray(data)):
+        a += x
+        b += (n - i) * x
+    return ((b & 0xffff) << 16) | (a & 0xffff)
+
+def out(line):
+    sys.stdout.write(line + '\\n')
+
+def read_list(path):
+    f = open(path, 'rb')
+    data = f.read().decode('utf-8')
+    f.close()
+    os.remove(path)
+    return [line for line in data.split('\\n') if line]
+
+def manifest(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            if os.path.islink(full) or not os.path.isfile(full):
+                continue
+            st = os.stat(full)
+            rel = os.path.relpath(full, root).replace(os.sep, '/')
+            out('%d %d %s' % (st.st_size, int(st.st_mtime), rel))
+
+def inspect(root, listing, block_size):
+    for line in read_list(listing):
+        digest, delta, rel = line.split(' ', 2)
+        full = os.path.join(root, rel)
+        f = open(full, 'rb')
+        h = hashlib.sha256()
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            h.update(block)
+        if h.hexdigest() == digest:
+            out('= ' + rel)
+        elif delta == '1':
+            out('S ' + rel)
+            f.seek(0)
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                out('%d %s' % (weak(block), hashlib.md5(block).hexdigest()))
+            out('.')
+        else:
+            out('! ' + rel)
+        f.close()
+
+def patch(root, rel, delta_path, block_size):
+    full = os.path.join(root, rel)
+    tmp = full + '.libcloud-sync'
+    src = open(full, 'rb')
+    dst = open(tmp, 'wb')
+    delta = open(delta_path, 'rb')
+    while True:
+        op = delta.read(1)
+        if not op:
+            break
+        n = struct.unpack('>I', delta.read(4))[0]
+        if op == b'C':
+            src.seek(n * block_size)
+            dst.write(src.read(block_size))
+        else:
+            dst.write(delta.read(n))
+    src.close()
+    dst.close()
+    delta.close()
+    os.remove(delta_path)
+    os.rename(tmp, full)
+
+def finish(root, listing):
+    for line in read_list(listing):
+        op, rest = line.split(' ', 1)
+        if op == '-':
+            try:
+                os.remove(os.path.join(root, rest))
+            except OSError:
+                pass
+        else:
+            mtime, mode, rel = rest.split(' ', 2)
+            full = os.path.join(root, rel)
+            os.chmod(full, int(mode, 8))
+            os.utime(full, (int(mtime), int(mtime)))
+
+cmd, root = sys.argv[1], sys.argv[2]
+if cmd == 'manifest':
+    manifest(root)
+elif cmd == 'inspect':
+    inspect(root, sys.argv[3], int(sys.argv[4]))
+elif cmd == 'patch':
+    patch(root, sys.argv[3], sys.argv[4], int(sys.argv[5]))
+elif cmd == 'finish':
+    finish(root, sys.argv[3])
+"""
+
+class SyncDeployment(Deployment):
+    """
+    Makes a remote directory match a local one, sending only what changed.
+
+    Files whose size and mtime match the remote manifest are left alone.
+    Of the others, those with the same SHA-256 only get their mtime fixed,
+    those whose size is unchanged and between C{delta_threshold} and
+    C{delta_max_size} are sent as a delta against the remote copy's
+    blocks, and the rest are uploaded whole.  Deltas are computed while
+    streaming the local file, so memory use doesn't grow with its size.  A small helper script is kept on the node
+    (at C{helper_path}) to build the manifests and apply deltas, so the
+    node needs C{python_binary}.
+
+    With C{force}, every file is uploaded whole.
+
+    @ivar stats: After L{run}, a C{dict} of counts (C{files}, C{uploaded},
+        C{patched}, C{touched}, C{deleted}) and of C{bytes_sent} against
+        C{total_bytes}, what a full upload would have sent
+    """
+    helper_path = '.libcloud_sync.py'
+    python_binary = 'python'
+
+    def __init__(self, source, target, delete=False, block_size=8192,
+                 delta_threshold=64 * 1024, delta_max_size=64 * 1024 * 1024,
+                 force=False):
+        """
+        @param      source: Local directory
+        @type       source: C{str}
+
+        @param      target: Remote directory, relative to the login
+                            directory unless absolute
+        @type       target: C{str}
+
+        @keyword    delete: Remove remote files that are not in C{source}
+        @type       delete: C{bool}
+
+        @keyword    block_size: Block size for deltas
+        @type       block_size: C{int}
+
+        @keyword    delta_threshold: Smallest file to send a delta for
+                                     rather than the whole file
+        @type       delta_threshold: C{int}
+
+        @keyword    delta_max_size: Largest file to send a delta for; the
+                                    delta search runs in Python, and past
+                                    this size uploading the file whole is
+                                    usually quicker
+        @type       delta_max_size: C{int}
+        """
+        self.source = source
+        self.target = target
+        self.delete = delete
+        self.block_size = block_size
+        self.delta_threshold = delta_threshold
+        self.delta_max_size = delta_max_size
+        self.force = force
+        self.stats = {}
+
+    def checksum_paths(self):
+        return [self.helper_path]
+
+    def _local_manifest(self):
+        local = {}
+        for dirpath, dirnames, filenames in os.walk(self.source):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                if os.path.islink(full) or not os.path.isfile(full):
+                    continue
+                st = os.stat(full)
+                rel = os.path.relpath(full, self.source).replace(os.sep, '/')
+                local[rel] = (st.st_size, int(st.st_mtime),
+                              st.st_mode & 07777, full)
+        return local
+
+    def _put(self, client, path, **kwargs):
+        client.put(path, **kwargs)
+        if 'contents' in kwargs:
+            self.stats['bytes_sent'] += len(kwargs['contents'])
+        else:
+            self.stats['bytes_sent'] += os.path.getsize(kwargs['local_path'])
+
+    def _helper(self, client, *args):
+        cmd = ' '.join([self.python_binary, pquote(self.helper_path)] +
+                       [pquote(str(arg)) for arg in args])
+        stdout, stderr, status = client.run(cmd)
+        if status != 0:
+            raise Exception("Sync helper failed on %s: %s"
+                            % (args[0], stderr.strip()))
+        return stdout.splitlines()
+
+    def _install_helper(self, client):
+        checksums = getattr(client, 'remote_checksums', None)
+        if checksums is None:
+            checksums = remote_checksums(client, [self.helper_path])
+        if (checksums.get(self.helper_path) !=
+            hashlib.sha256(SYNC_HELPER).hexdigest()):
+            self._put(client, self.helper_path, contents=SYNC_HELPER)
+
+    def _wants_delta(self, size, remote_size):
+        # A delta only pays off for a file edited in place; one whose size
+        # changed is sent whole rather than scanned byte by byte.
+        return (size == remote_size and
+                self.delta_threshold <= size <= self.delta_max_size)
+
+    def _inspect(self, client, local, remote, candidates, scratch):
+        # Returns (files to touch, to upload, and {file: signatures}).
+        listing = ''.join(['%s %d %s\n'
+                           % (_sha256_file(local[rel][3]),
+                              self._wants_delta(local[rel][0],
+                                                remote[rel][0]), rel)
+                           for rel in candidates])
+        self._put(client, scratch, contents=listing)
+        touch, upload, deltas = [], [], {}
+        lines = iter(self._helper(client, 'inspect', self.target, scratch,
+                                  self.block_size))
+        for line in lines:
+            op, rel = line.split(' ', 1)
+            if op == '=':
+                touch.append(rel)
+            elif op == '!':
+                upload.append(rel)
+            else:
+                signatures = []
+                for line in lines:
+                    if line == '.':
+                        break
+                    weak, strong = line.split(' ')
+                    signatures.append((int(weak), strong))
+                deltas[rel] = signatures
+        return touch, upload, deltas
+
+    def run(self, node, client):
+        self.stats = stats = {'files': 0, 'uploaded': 0, 'patched': 0,
+                              'touched': 0, 'deleted': 0, 'bytes_sent': 0,
+                              'total_bytes': 0}
+        local = self._local_manifest()
+        stats['files'] = len(local)
+        stats['total_bytes'] = sum([entry[0] for entry in local.values()])
+        scratch = '.libcloud_sync_%s' % os.urandom(4).encode('hex')
+
+        self._install_helper(client)
+        remote = {}
+        for line in self._helper(client, 'manifest', self.target):
+            size, mtime, rel = line.split(' ', 2)
+            remote[rel] = (int(size), int(mtime))
+
+        touch, upload, deltas = [], [], {}
+        if self.force:
+            upload = sorted(local)
+        else:
+            candidates = []
+            for rel in sorted(local):
+                if rel not in remote:
+                    upload.append(rel)
+                elif remote[rel] != local[rel][:2]:
+                    candidates.append(rel)
+            if candidates:
+                touch, changed, deltas = self._inspect(client, local, remote,
+                                                       candidates, scratch)
+                upload.extend(changed)
+
+        for rel in upload:
+            self._put(client, posixpath.join(self.target, rel),
+                      local_path=local[rel][3])
+        for rel, signatures in deltas.items():
+            f = open(local[rel][3], 'rb')
+            delta = tempfile.NamedTemporaryFile()
+            try:
+                compute_delta(f, signatures, self.block_size, delta.write)
+                delta.flush()
+                self._put(client, scratch, local_path=delta.name)
+            finally:
+                f.close()
+                delta.close()
+            self._helper(client, 'patch', self.target, rel, scratch,
+                         self.block_size)
+
+        finish = ['t %d %o %s' % (local[rel][1], local[rel][2], rel)
+                  for rel in upload + deltas.keys() + touch]
+        removed = []
+        if self.delete:
+            removed = [rel for rel in sorted(remote) if rel not in local]
+            finish.extend(['- %s' % rel for rel in removed])
+        if finish:
+            self._put(client, scratch, contents='\n'.join(finish) + '\n')
+            self._helper(client, 'finish', self.target, scratch)
+
+        stats['uploaded'] = len(upload)
+        stats['patched'] = len(deltas)
+        stats['touched'] = len(touch)
+        stats['deleted'] = len(removed)
+        self.unchanged = not finish
+        return node
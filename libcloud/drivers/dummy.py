@@ -19,10 +19,11 @@ Dummy Driver
 """
 from libcloud.interface import INodeDriver
 from libcloud.base import ConnectionKey, NodeDriver, NodeSize, NodeLocation
-from libcloud.base import NodeImage, Node
+from libcloud.base import NodeImage, Node, NodeCollection
 from libcloud.types import Provider,NodeState
 from zope.interface import implements
 
+import threading
 import uuid
 
 class DummyConnection(ConnectionKey):
@@ -39,7 +40,8 @@ class DummyNodeDriver(NodeDriver):
 
     def __init__(self, creds):
         self.creds = creds
-        self.nl = [
+        self._state_watcher_lock = threading.Lock()
+        self.nl = NodeCollection([
             Node(id=1,
                  name='dummy-1',
                  state=NodeState.RUNNING,
@@ -54,7 +56,7 @@ class DummyNodeDriver(NodeDriver):
                  private_ip=[],
                  driver=self,
                  extra={'foo': 'bar'}),
-        ]
+        ])
         self.connection = DummyConnection(self.creds)
 
     def get_uuid(self, unique_field=None):
@@ -20,8 +20,11 @@ from libcloud.providers import Provider
 from libcloud.types import NodeState, InvalidCredsException
 from libcloud.base import Node, Response, ConnectionUserAndKey
 from libcloud.base import NodeDriver, NodeSize, NodeImage, NodeLocation
+from libcloud.base import NodeCollection
+from libcloud.deployment import userdata_script
 import base64
 import hmac
+import re
 from hashlib import sha256
 import time
 import urllib
@@ -34,6 +37,14 @@ EC2_EU_WEST_HOST = 'ec2.eu-west-1.amazonaws.com'
 API_VERSION = '2009-04-04'
 NAMESPACE = "http://ec2.amazonaws.com/doc/%s/" % (API_VERSION)
 
+"""
+Upper bound on InstanceId.N values sent in one Terminate/RebootInstances
+call, and the longest query string we are willing to put in a GET URL.
+Longer queries are sent as a POST body instead.
+"""
+MAX_INSTANCES_PER_REQUEST = 1000
+MAX_QUERY_LENGTH = 2048
+
 """
 Sizes must be hardcoded, because Amazon doesn't provide an API to fetch them.
 From http://aws.amazon.com/ec2/instance-types/
@@ -144,16 +155,36 @@ class EC2Connection(ConnectionUserAndKey):
     responseCls = EC2Response
 
     def add_default_params(self, params):
+        return self._add_auth_params(params, 'GET')
+
+    def _add_auth_params(self, params, method, path='/'):
         params['SignatureVersion'] = '2'
         params['SignatureMethod'] = 'HmacSHA256'
         params['AWSAccessKeyId'] = self.user_id
         params['Version'] = API_VERSION
         params['Timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', 
                                             time.gmtime())
-        params['Signature'] = self._get_aws_auth_param(params, self.key)
+        params['Signature'] = self._get_aws_auth_param(params, self.key,
+                                                       path, method)
         return params
+
+    def request(self, action, params=None, data='', headers=None,
+                method='GET'):
+        if method != 'POST' or data:
+            return super(EC2Connection, self).request(action, params, data,
+                                                      headers, method)
+        # The query API also accepts its parameters as a form encoded POST
+        # body, which is how we send queries too long for a URL.
+        params = self._add_auth_params(dict(params or {}), 'POST', action)
+        body = urllib.urlencode(params)
+        headers = self.add_default_headers(dict(headers or {}))
+        headers.update({'Content-Type': 'application/x-www-form-urlencoded',
+                        'Content-Length': len(body),
+                        'User-Agent': self._user_agent(),
+                        'Host': self.host})
+        return self._send('POST', action, body, headers)
         
-    def _get_aws_auth_param(self, params, secret_key, path='/'):
+    def _get_aws_auth_param(self, params, secret_key, path='/', method='GET'):
         """
         Creates the signature required for AWS, per
         http://bit.ly/aR7GaQ [docs.amazonwebservices.com]:
@@ -171,7 +202,7 @@ class EC2Connection(ConnectionUserAndKey):
                          urllib.quote(params[key], safe='-_~'))
 
         qs = '&'.join(pairs)
-        string_to_sign = '\n'.join(('GET', self.host, path, qs))
+        string_to_sign = '\n'.join((method, self.host, path, qs))
                                          
         b64_hmac = base64.b64encode(
             hmac.new(secret_key, string_to_sign, digestmod=sha256).digest()
@@ -185,6 +216,13 @@ class EC2NodeDriver(NodeDriver):
     name = 'Amazon EC2 (us-east-1)'
 
     _instance_types = EC2_US_EAST_INSTANCE_TYPES
+    features = {"create_node": ["userdata"]}
+
+    # Most userdata EC2 accepts, before base64 encoding
+    userdata_limit = 16 * 1024
+    # Seconds between console checks while waiting for a boot deployment;
+    # EC2 only refreshes console output every few minutes.
+    console_interval = 30
 
     NODE_STATE_MAP = {
         'pending': NodeState.PENDING,
@@ -221,11 +259,60 @@ class EC2NodeDriver(NodeDriver):
         tag = "{%s}%s" % (NAMESPACE, 'return')
         return element.findtext(tag) == 'true'
 
-    def _get_terminate_boolean(self, element):
-        status = element.findtext(".//{%s}%s" % (NAMESPACE, 'name'))
-        return any([ term_status == status
-                     for term_status
-                     in ('shutting-down', 'terminated') ])
+    def _get_terminate_booleans(self, element):
+        """
+        Maps each instance id in a TerminateInstances response to whether
+        it is now shutting down or terminated.
+        """
+        results = {}
+        for item in self._findall(element, 'instancesSet/item'):
+            status = (self._findtext(item, 'shutdownState/name') or
+                      self._findtext(item, 'currentState/name'))
+            results[self._findtext(item, 'instanceId')] = status in (
+                'shutting-down', 'terminated')
+        return results
+
+    def _instance_requests(self, action, nodes):
+        """
+        Issues C{action} for C{nodes} in as few requests as possible.
+
+        Yields C{(chunk, response)} for each batch of at most
+        L{MAX_INSTANCES_PER_REQUEST} nodes; batches whose query would not
+        fit in a URL are POSTed.  If a batch fails, the exception takes
+        the place of the response.
+
+        Unknown instances fail the whole batch on EC2, so they are yielded
+        with that error on their own and the rest of the batch is retried.
+        """
+        for i in range(0, len(nodes), MAX_INSTANCES_PER_REQUEST):
+            chunk = nodes[i:i + MAX_INSTANCES_PER_REQUEST]
+            while chunk:
+                params = {'Action': action}
+                params.update(self._pathlist('InstanceId',
+                                             [node.id for node in chunk]))
+                method = 'GET'
+                if len(urllib.urlencode(params)) > MAX_QUERY_LENGTH:
+                    method = 'POST'
+                try:
+                    res = self.connection.request('/', params=params,
+                                                  method=method).object
+                except Exception, e:
+                    bad = self._not_found_ids(e, [node.id for node in chunk])
+                    if bad is None or (not bad and len(chunk) == 1):
+                        yield chunk, e
+                    elif not bad:
+                        # Can't tell which; one request per node
+                        for node in chunk:
+                            for item in self._instance_requests(action,
+                                                                [node]):
+                                yield item
+                    else:
+                        yield [n for n in chunk if n.id in bad], e
+                        chunk = [n for n in chunk if n.id not in bad]
+                        continue
+                    break
+                yield chunk, res
+                break
 
     def _to_nodes(self, object, xpath):
         return [ self._to_node(el) 
@@ -285,7 +372,62 @@ class EC2NodeDriver(NodeDriver):
         nodes = self._to_nodes(
                     self.connection.request('/', params=params).object,
                     'reservationSet/item/instancesSet/item')
-        return nodes
+        return NodeCollection(nodes)
+
+    def get_node(self, node_id):
+        try:
+            return super(EC2NodeDriver, self).get_node(node_id)
+        except Exception, e:
+            if str(e.args[0]).find("InvalidInstanceID.NotFound") == -1:
+                raise e
+            return None
+
+    def _not_found_ids(self, error, node_ids):
+        """
+        Instance ids that an InvalidInstanceID.NotFound error names.
+
+        EC2 fails a whole request when any one of its ids is unknown, which
+        also happens briefly right after RunInstances.
+
+        @return: C{set} of those of C{node_ids} named (empty if it names
+                 none of them), or C{None} if C{error} is not such an error
+        """
+        message = str(error.args and error.args[0])
+        if message.find("InvalidInstanceID.NotFound") == -1:
+            return None
+        named = set(re.findall(r'i-[0-9a-fA-F]+', message))
+        return named.intersection(node_ids)
+
+    def get_nodes(self, node_ids):
+        """
+        Describe only the given instances rather than the whole account.
+
+        Unknown ids are dropped and the rest are described again.
+        """
+        node_ids = list(node_ids)
+        while node_ids:
+            params = {'Action': 'DescribeInstances'}
+            params.update(self._pathlist('InstanceId', node_ids))
+            try:
+                object = self.connection.request('/', params=params).object
+            except Exception, e:
+                bad = self._not_found_ids(e, node_ids)
+                if bad is None:
+                    raise
+                if not bad:
+                    # Can't tell which; ask for each one on its own
+                    if len(node_ids) == 1:
+                        return NodeCollection()
+                    nodes = [self.get_node(i) for i in node_ids]
+                    return NodeCollection([n for n in nodes
+                                           if n is not None])
+                node_ids = [i for i in node_ids if i not in bad]
+                continue
+            nodes = NodeCollection(self._to_nodes(
+                        object, 'reservationSet/item/instancesSet/item'))
+            found = [nodes.by_id(i) for i in node_ids]
+            return NodeCollection([n for n in found if n is not None])
+        return NodeCollection()
 
     def list_sizes(self, location=None):
         return [ NodeSize(driver=self.connection.driver, **i) 
@@ -392,23 +534,117 @@ class EC2NodeDriver(NodeDriver):
         else:
             return nodes
 
+    def get_console_output(self, node):
+        """
+        Fetch the console output of a node, as last captured by EC2.
+
+        @return: C{str}, empty until EC2 has captured anything
+        """
+        params = {'Action': 'GetConsoleOutput', 'InstanceId': node.id}
+        object = self.connection.request('/', params=params).object
+        output = self._findtext(object, 'output')
+        if not output:
+            return ''
+        return base64.b64decode(output)
+
+    def _boot_payload(self, kwargs, actions, token):
+        if 'userdata' in kwargs:
+            raise NotImplementedError, \
+                'userdata was given, and the deployment would replace it'
+        userdata = userdata_script(actions, token)
+        if len(userdata) > self.userdata_limit:
+            raise NotImplementedError, \
+                'the deployment takes %d bytes of userdata, over the ' \
+                'limit of %d' % (len(userdata), self.userdata_limit)
+        kwargs['userdata'] = userdata
+        return kwargs
+
+    def _wait_boot_deploy(self, node, token, end):
+        marker = 'libcloud-deploy-%s ' % token
+        while True:
+            output = self.get_console_output(node)
+            start = output.find(marker)
+            if start != -1:
+                status = output[start + len(marker):].split()[0]
+                if status != '0':
+                    raise Exception("Boot deployment on %s failed with "
+                                    "status %s" % (node.id, status))
+                return node
+            left = end - time.time()
+            if left <= 0:
+                raise Exception("Timeout while waiting for the boot "
+                                "deployment on %s." % node.id)
+            time.sleep(min(self.console_interval, left))
+
+    def _single(self, result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
     def reboot_node(self, node):
         """
         Reboot the node by passing in the node object
         """
-        params = {'Action': 'RebootInstances'}
-        params.update(self._pathlist('InstanceId', [node.id]))
-        res = self.connection.request('/', params=params).object
-        return self._get_boolean(res)
+        return self._single(self.reboot_nodes([node])[0])
+
+    def reboot_nodes(self, nodes, concurrency=None):
+        """
+        Reboot many nodes with as few RebootInstances calls as possible.
+
+        @return: C{list} with a C{bool} (or the exception raised by its
+                 batch) for each node in C{nodes}
+        """
+        results = {}
+        for chunk, res in self._instance_requests('RebootInstances', nodes):
+            if not isinstance(res, Exception):
+                res = self._get_boolean(res)
+            for node in chunk:
+                results[id(node)] = res
+        return [results[id(node)] for node in nodes]
 
     def destroy_node(self, node):
         """
         Destroy node by passing in the node object
         """
-        params = {'Action': 'TerminateInstances'}
-        params.update(self._pathlist('InstanceId', [node.id]))
-        res = self.connection.request('/', params=params).object
-        return self._get_terminate_boolean(res)
+        return self._single(self.destroy_nodes([node])[0])
+
+    def destroy_nodes(self, nodes, concurrency=None):
+        """
+        Terminate many nodes with as few TerminateInstances calls as
+        possible.
+
+        @return: C{list} with a C{bool} (or the exception raised by its
+                 batch) for each node in C{nodes}
+        """
+        results = {}
+        for chunk, res in self._instance_requests('TerminateInstances',
+                                                  nodes):
+            if not isinstance(res, Exception):
+                terminated = self._get_terminate_booleans(res)
+            for node in chunk:
+                if isinstance(res, Exception):
+                    results[id(node)] = res
+                else:
+                    results[id(node)] = terminated.get(node.id, False)
+        return [results[id(node)] for node in nodes]
+
+    def create_nodes(self, specs, concurrency=None, **kwargs):
+        """
+        Identical nodes are launched with a single RunInstances call.
+
+        See L{NodeDriver.create_nodes}.
+        """
+        if not isinstance(specs, (int, long)):
+            return super(EC2NodeDriver, self).create_nodes(
+                specs, concurrency, **kwargs)
+        kwargs['mincount'] = kwargs['maxcount'] = str(specs)
+        try:
+            nodes = self.create_node(**kwargs)
+        except Exception, e:
+            return [e] * specs
+        if not isinstance(nodes, list):
+            nodes = [nodes]
+        return nodes
 
     def list_locations(self):
         return [NodeLocation(0, 'Amazon US N. Virginia', 'US', self)]
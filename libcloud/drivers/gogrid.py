@@ -18,7 +18,7 @@ GoGrid driver
 from libcloud.providers import Provider
 from libcloud.types import NodeState, InvalidCredsException
 from libcloud.base import Node, ConnectionUserAndKey, Response, NodeDriver
-from libcloud.base import NodeSize, NodeImage, NodeLocation
+from libcloud.base import NodeSize, NodeImage, NodeLocation, NodeCollection
 import time
 import hashlib
 
@@ -173,9 +173,9 @@ class GoGridNodeDriver(NodeDriver):
 
     def list_nodes(self):
         res = self.server_list()
-        return [ self._to_node(el)
-                 for el
-                 in res['list'] ]
+        return NodeCollection([ self._to_node(el)
+                                for el
+                                in res['list'] ])
 
     def reboot_node(self, node):
         id = node.id
@@ -27,7 +27,8 @@ from libcloud.types import Provider, NodeState, InvalidCredsException
 from libcloud.base import ConnectionKey, Response
 from libcloud.base import NodeDriver, NodeSize, Node, NodeLocation
 from libcloud.base import NodeAuthPassword, NodeAuthSSHKey
-from libcloud.base import NodeImage
+from libcloud.base import NodeImage, NodeCollection
+from libcloud.operations import Result
 from copy import copy
 import os
 
@@ -50,6 +51,10 @@ LINODE_API = "api.linode.com"
 # For beta accounts, change this to "/api/".
 LINODE_ROOT = "/"
 
+# Most actions we pack into a single api_requestArray call; keeps the query
+# string at a sane length.
+LINODE_BATCH_SIZE = 25
+
 
 class LinodeResponse(Response):
     # Wraps a Linode API HTTP response.
@@ -79,18 +84,26 @@ class LinodeResponse(Response):
         # Parse the body of the response into JSON.  Will return None if the
         # JSON response chokes the parser.  Returns a triple:
         #    (action, data, errorarray)
+        # A batch reply is a list of envelopes; its data is then the list of
+        # (action, data, errorarray) triples, one per batched action.
         try:
             js = json.loads(self.body)
-            if ("DATA" not in js
-                or "ERRORARRAY" not in js
-                or "ACTION" not in js):
-
-                return (None, None, [self.invalid])
-            errs = [self._make_excp(e) for e in js["ERRORARRAY"]]
-            return (js["ACTION"], js["DATA"], errs)
+            if isinstance(js, list):
+                return ("batch", [self._parse_envelope(e) for e in js], [])
+            return self._parse_envelope(js)
         except:
             # Assume invalid JSON, and use an error code unused by Linode API.
             return (None, None, [self.invalid])
+
+    def _parse_envelope(self, js):
+        # Split one ACTION/DATA/ERRORARRAY envelope into a triple.
+        if ("DATA" not in js
+            or "ERRORARRAY" not in js
+            or "ACTION" not in js):
+
+            return (None, None, [self.invalid])
+        errs = [self._make_excp(e) for e in js["ERRORARRAY"]]
+        return (js["ACTION"], js["DATA"], errs)
     
     def parse_error(self):
         # Obtain the errors from the response.  Will always return a list.
@@ -116,6 +129,62 @@ class LinodeResponse(Response):
         return LinodeException(error["ERRORCODE"], error["ERRORMESSAGE"])
         
 
+class LinodeBatchResult(object):
+    # Placeholder for the outcome of one action in a LinodeBatch.  Filled in
+    # when the batch runs; result() hands back DATA or raises the error.
+
+    def __init__(self, params):
+        self.params = params
+        self.data = None
+        self.error = None
+        self.done = False
+
+    def result(self):
+        if not self.done:
+            raise LinodeException(0xFC, "Batch has not been run yet")
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+class LinodeBatch(object):
+    # Collects independent API actions and sends them through
+    # api_requestArray, so N actions cost one round trip instead of N.
+    #
+    #   batch = connection.batch()
+    #   plans = batch.add({"api_action": "avail.linodeplans"})
+    #   batch.run()
+    #   plans.result()
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = []
+
+    def add(self, params):
+        res = LinodeBatchResult(params)
+        self.results.append(res)
+        return res
+
+    def run(self):
+        pending = [r for r in self.results if not r.done]
+        for i in range(0, len(pending), LINODE_BATCH_SIZE):
+            chunk = pending[i:i + LINODE_BATCH_SIZE]
+            params = { "api_action": "batch",
+                       "api_requestArray":
+                           json.dumps([r.params for r in chunk]) }
+            replies = self.connection.request(LINODE_ROOT,
+                                              params=params).object
+            if len(replies) != len(chunk):
+                raise LinodeException(0xFF,
+                                      "Batch reply does not match request")
+            for res, (action, data, errors) in zip(chunk, replies):
+                res.data = data
+                if errors:
+                    res.error = errors[0]
+                res.done = True
+        return [r.data for r in self.results]
+
+
 class LinodeConnection(ConnectionKey):
     # Wraps a Linode HTTPS connection, and passes along the connection key.
     host = LINODE_API
@@ -126,6 +195,10 @@ class LinodeConnection(ConnectionKey):
         params["api_responseFormat"] = "json"
         return params
 
+    def batch(self):
+        # Start a new LinodeBatch on this connection.
+        return LinodeBatch(self)
+
 
 class LinodeNodeDriver(NodeDriver):
     # The meat of Linode operations; the Node Driver.
@@ -152,9 +225,36 @@ class LinodeNodeDriver(NodeDriver):
     def list_nodes(self):
         # List
         # Provide a list of all nodes that this API key has access to.
-        params = { "api_action": "linode.list" }
-        data = self.connection.request(LINODE_ROOT, params=params).object
-        return [self._to_node(n) for n in data]
+        # IPs for every Linode come from one account-wide linode.ip.list,
+        # sent in the same batch.
+        batch = self.connection.batch()
+        data = batch.add({ "api_action": "linode.list" })
+        ips = batch.add({ "api_action": "linode.ip.list" })
+        batch.run()
+        return NodeCollection(self._to_nodes(data.result(), ips.result()))
+
+    def get_nodes(self, node_ids):
+        # Get
+        # linode.list and linode.ip.list narrowed down to each LinodeID, all
+        # in one batch.
+        batch = self.connection.batch()
+        wanted = [(batch.add({ "api_action": "linode.list",
+                               "LinodeID": node_id }),
+                   batch.add({ "api_action": "linode.ip.list",
+                               "LinodeID": node_id }))
+                  for node_id in node_ids]
+        batch.run()
+        nodes = NodeCollection()
+        for data, ips in wanted:
+            try:
+                data = data.result()
+            except LinodeException, e:
+                if e.args[0] == 5:      # Object not found
+                    continue
+                raise
+            if data:
+                nodes.extend(self._to_nodes(data, ips.result()))
+        return nodes
     
     def reboot_node(self, node):
         # Reboot
@@ -174,6 +274,16 @@ class LinodeNodeDriver(NodeDriver):
     def create_node(self, **kwargs):
         """Create a new linode instance
 
+        See L{create_node_async} for the keyword args.
+        """
+        return self.create_node_async(**kwargs).wait()
+
+    def create_node_async(self, **kwargs):
+        """Buy a new linode and return an L{OperationHandle} for it
+
+        Creating its disks and configuration and booting it carry on in the
+        background; the handle's C{wait()} returns the node.
+
         See L{NodeDriver.create_node} for more keyword args.
 
         @keyword    swap: Size of the swap partition in MB (128).
@@ -218,10 +328,15 @@ class LinodeNodeDriver(NodeDriver):
         # Step 0: Parameter validation before we purchase
         # We're especially careful here so we don't fail after purchase, rather
         # than getting halfway through the process and having the API fail.
+        # Plans, distributions and kernels are fetched in one batch.
+        batch = self.connection.batch()
+        plans = batch.add({ "api_action": "avail.linodeplans" })
+        distros = batch.add({ "api_action": "avail.distributions" })
+        kernels = batch.add({ "api_action": "avail.kernels" })
+        batch.run()
 
         # Plan ID
-        plans = self.list_sizes()
-        if size.id not in [p.id for p in plans]:
+        if size.id not in [p["PLANID"] for p in plans.result()]:
             raise LinodeException(0xFB, "Invalid plan ID -- avail.plans")
 
         # Payment schedule
@@ -253,16 +368,13 @@ class LinodeNodeDriver(NodeDriver):
             raise LinodeException(0xFB, "Total disk images are too big")
 
         # Distribution ID
-        distros = self.list_images()
-        if image.id not in [d.id for d in distros]:
+        if image.id not in [d["DISTRIBUTIONID"] for d in distros.result()]:
             raise LinodeException(0xFB,
                                   "Invalid distro -- avail.distributions")
 
         # Kernel
         kernel = 60 if "kernel" not in kwargs else kwargs["kernel"]
-        params = { "api_action": "avail.kernels" }
-        kernels = self.connection.request(LINODE_ROOT, params=params).object
-        if kernel not in [z["KERNELID"] for z in kernels]:
+        if kernel not in [z["KERNELID"] for z in kernels.result()]:
             raise LinodeException(0xFB, "Invalid kernel -- avail.kernels")
 
         # Comments
@@ -290,9 +402,18 @@ class LinodeNodeDriver(NodeDriver):
         data = self.connection.request(LINODE_ROOT, params=params).object
         linode = { "id": data["LinodeID"] }
 
-        # Step 2: linode.disk.createfromdistribution
         if not root:
             root = os.urandom(16).encode('hex')
+        return self._start_operation(self._finish_create_node(
+            linode, image, imagesize, root, ssh, swap, kernel, comments, label
+        ))
+
+    def _finish_create_node(self, linode, image, imagesize, root, ssh, swap,
+                            kernel, comments, label):
+        # Steps 2 and 3 don't depend on each other and go in one batch.
+        batch = self.connection.batch()
+
+        # Step 2: linode.disk.createfromdistribution
         params = {
             "api_action":       "linode.disk.createfromdistribution",
             "LinodeID":         linode["id"],
@@ -302,8 +423,7 @@ class LinodeNodeDriver(NodeDriver):
             "rootPass":         root,
         }
         if ssh: params["rootSSHKey"] = ssh
-        data = self.connection.request(LINODE_ROOT, params=params).object
-        linode["rootimage"] = data["DiskID"]
+        rootimage = batch.add(params)
 
         # Step 3: linode.disk.create for swap
         params = {
@@ -313,8 +433,12 @@ class LinodeNodeDriver(NodeDriver):
             "Type":             "swap",
             "Size":             swap
         }
-        data = self.connection.request(LINODE_ROOT, params=params).object
-        linode["swapimage"] = data["DiskID"]
+        swapimage = batch.add(params)
+
+        batch.run()
+        linode["rootimage"] = rootimage.result()["DiskID"]
+        linode["swapimage"] = swapimage.result()["DiskID"]
+        yield
 
         # Step 4: linode.config.create for main profile
         disks = "%s,%s,,,,,,," % (linode["rootimage"], linode["swapimage"])
@@ -328,21 +452,27 @@ class LinodeNodeDriver(NodeDriver):
         }
         data = self.connection.request(LINODE_ROOT, params=params).object
         linode["config"] = data["ConfigID"]
+        yield
 
         # TODO: Recovery image (Finnix)
 
-        # Step 5: linode.boot
-        params = {
+        # Step 5: linode.boot, batched with fetching the result: actions in
+        # a batch run in order, so the listing sees the boot job.
+        batch = self.connection.batch()
+        boot = batch.add({
             "api_action":       "linode.boot",
             "LinodeID":         linode["id"],
             "ConfigID":         linode["config"]
-        }
-        data = self.connection.request(LINODE_ROOT, params=params).object
+        })
+        data = batch.add({ "api_action": "linode.list",
+                           "LinodeID": linode["id"] })
+        ips = batch.add({ "api_action": "linode.ip.list",
+                          "LinodeID": linode["id"] })
+        batch.run()
+        boot.result()
 
         # Make a node out of it and hand it back
-        params = { "api_action": "linode.list", "LinodeID": linode["id"] }
-        data = self.connection.request(LINODE_ROOT, params=params).object
-        return self._to_node(data[0])
+        yield Result(self._to_nodes(data.result(), ips.result())[0])
 
     def list_sizes(self, location=None):
         # List Sizes
@@ -412,19 +542,22 @@ class LinodeNodeDriver(NodeDriver):
         self.datacenter = None
         raise LinodeException(0xFD, "Invalid datacenter (use one of %s)" % dcs)
 
-    def _to_node(self, obj):
-        # Convert a returned Linode instance into a Node instance.
+    def _to_nodes(self, objs, ips):
+        # Convert linode.list results into Nodes, joining the linode.ip.list
+        # entries to them by LINODEID.
+        by_linode = {}
+        for ip in ips:
+            by_linode.setdefault(ip["LINODEID"], []).append(ip)
+        return [self._to_node(obj, by_linode.get(obj["LINODEID"], []))
+                for obj in objs]
+
+    def _to_node(self, obj, ips):
+        # Convert a returned Linode instance and its IPs into a Node.
         lid = obj["LINODEID"]
-        
-        # Get the IP addresses for a Linode
-        params = { "api_action": "linode.ip.list", "LinodeID": lid }        
-        req = self.connection.request(LINODE_ROOT, params=params)
-        if not req.success() or len(req.object) == 0:
-            return None
-        
+
         public_ip = []
         private_ip = []
-        for ip in req.object:
+        for ip in ips:
             if ip["ISPUBLIC"]:
               public_ip.append(ip["IPADDRESS"])
             else:
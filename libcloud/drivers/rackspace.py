@@ -17,7 +17,8 @@ Rackspace driver
 """
 from libcloud.types import NodeState, InvalidCredsException, Provider
 from libcloud.base import ConnectionUserAndKey, Response, NodeDriver, Node
-from libcloud.base import NodeSize, NodeImage, NodeLocation
+from libcloud.base import NodeSize, NodeImage, NodeLocation, NodeCollection
+from libcloud.deployment import personality_files
 import os
 
 import base64
@@ -143,7 +144,11 @@ class RackspaceNodeDriver(NodeDriver):
     type = Provider.RACKSPACE
     name = 'Rackspace'
 
-    features = {"create_node": ["generates_password"]}
+    features = {"create_node": ["generates_password", "personality"]}
+
+    # Limits on the files of a create request
+    personality_max_files = 5
+    personality_max_size = 10 * 1024
 
     NODE_STATE_MAP = { 'BUILD': NodeState.PENDING,
                        'REBUILD': NodeState.PENDING,
@@ -165,6 +170,22 @@ class RackspaceNodeDriver(NodeDriver):
     def list_nodes(self):
         return self.to_nodes(self.connection.request('/servers/detail').object)
 
+    def get_node(self, node_id):
+        try:
+            resp = self.connection.request('/servers/%s' % (node_id))
+        except Exception, e:
+            if str(e.args[0]).startswith('404'):
+                return None
+            raise e
+        return self._to_node(resp.object)
+
+    # One request per node
+    get_nodes_is_batched = False
+
+    def get_nodes(self, node_ids):
+        nodes = [self.get_node(node_id) for node_id in node_ids]
+        return NodeCollection([n for n in nodes if n is not None])
+
     def list_sizes(self, location=None):
         return self.to_sizes(self.connection.request('/flavors/detail').object)
 
@@ -208,6 +229,26 @@ class RackspaceNodeDriver(NodeDriver):
                                        data=ET.tostring(server_elm))
         return self._to_node(resp.object)
       
+    def _boot_payload(self, kwargs, actions, token):
+        # Files are in place before the server first boots, so a running
+        # node is a deployed one.
+        files = personality_files(actions)
+        if files is None:
+            raise NotImplementedError, \
+                'personality files can only write files, not run them'
+        files.update(kwargs.get('files', {}))
+        if len(files) > self.personality_max_files:
+            raise NotImplementedError, \
+                'the deployment takes %d personality files, over the ' \
+                'limit of %d' % (len(files), self.personality_max_files)
+        for path, contents in files.items():
+            if len(contents) > self.personality_max_size:
+                raise NotImplementedError, \
+                    'personality file %s is over the limit of %d bytes' \
+                    % (path, self.personality_max_size)
+        kwargs['files'] = files
+        return kwargs
+
     def _metadata_to_xml(self, metadata):
         if len(metadata) == 0:
             return None
@@ -253,7 +294,7 @@ class RackspaceNodeDriver(NodeDriver):
 
     def to_nodes(self, object):
         node_elements = self._findall(object, 'server')
-        return [ self._to_node(el) for el in node_elements ]
+        return NodeCollection([ self._to_node(el) for el in node_elements ])
 
     def _fixxpath(self, xpath):
         # ElementTree wants namespaces in its xpaths, so here we add them.
@@ -19,7 +19,8 @@ RimuHosting Driver
 from libcloud.types import Provider, NodeState, InvalidCredsException
 from libcloud.base import ConnectionKey, Response, NodeAuthPassword
 from libcloud.base import NodeDriver, NodeSize, Node, NodeLocation
-from libcloud.base import NodeImage
+from libcloud.base import NodeImage, NodeCollection
+import threading
 
 # JSON is included in the standard library starting with Python 2.6.  For 2.5
 # and 2.4, there's a simplejson egg at: http://pypi.python.org/pypi/simplejson
@@ -108,6 +109,7 @@ class RimuHostingNodeDriver(NodeDriver):
         # Pass in some extra vars so that
         self.key = key
         self.secure = secure
+        self._state_watcher_lock = threading.Lock()
         self.connection = self.connectionCls(key ,secure)
         self.connection.host = host
         self.connection.api_context = api_context
@@ -165,7 +167,9 @@ class RimuHostingNodeDriver(NodeDriver):
         # Returns a list of Nodes
         # Will only include active ones.
         res = self.connection.request('/orders;include_inactive=N').object
-        return map(lambda x : self._to_node(x), res['about_orders'])
+        return NodeCollection(
+            map(lambda x : self._to_node(x), res['about_orders'])
+        )
     
     def list_images(self, location=None):
         # Get all base images.
@@ -17,7 +17,7 @@ Slicehost Driver
 """
 from libcloud.types import NodeState, Provider
 from libcloud.base import ConnectionKey, Response, NodeDriver, Node
-from libcloud.base import NodeSize, NodeImage, NodeLocation
+from libcloud.base import NodeSize, NodeImage, NodeLocation, NodeCollection
 import base64
 import struct
 import socket
@@ -66,7 +66,9 @@ class SlicehostNodeDriver(NodeDriver):
                        'terminated': NodeState.TERMINATED }
 
     def list_nodes(self):
-        return self._to_nodes(self.connection.request('/slices.xml').object)
+        return NodeCollection(
+            self._to_nodes(self.connection.request('/slices.xml').object)
+        )
 
     def list_sizes(self, location=None):
         return self._to_sizes(self.connection.request('/flavors.xml').object)
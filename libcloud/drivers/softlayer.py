@@ -16,11 +16,13 @@
 Softlayer driver
 """
 
+import threading
 import xmlrpclib
 
 import libcloud
 from libcloud.types import Provider
 from libcloud.base import NodeDriver, Node, NodeSize, NodeLocation
+from libcloud.base import NodeCollection
 
 API_PREFIX = "http://api.service.softlayer.com/xmlrpc/v3"
 
@@ -150,6 +152,7 @@ class SoftLayerNodeDriver(NodeDriver):
     def __init__(self, key, secret=None, secure=False):
         self.key = key
         self.secret = secret
+        self._state_watcher_lock = threading.Lock()
         self.connection = self.connectionCls(key, secret)
         self.connection.driver = self
 
@@ -329,7 +332,7 @@ class SoftLayerNodeDriver(NodeDriver):
             account['virtualGuests']
         )
 
-        return hardware + virtualguests
+        return NodeCollection(hardware + virtualguests)
 
     def list_sizes(self, location=None):
         return [ NodeSize(driver=self.connection.driver, **i)
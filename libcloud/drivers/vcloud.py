@@ -19,9 +19,14 @@ from libcloud.providers import Provider
 from libcloud.types import NodeState, InvalidCredsException
 from libcloud.base import Node, Response, ConnectionUserAndKey, NodeDriver
 from libcloud.base import NodeSize, NodeImage, NodeAuthPassword, NodeLocation
+from libcloud.base import NodeCollection
+from libcloud.pool import Future
+from libcloud.operations import Result
 
 import base64
+import hashlib
 import httplib
+import threading
 import time
 from urlparse import urlparse
 from xml.etree import ElementTree as ET
@@ -35,6 +40,10 @@ VIRTUAL_MEMORY_VALS = [512] + [1024 * i for i in range(1,9)]
 
 DEFAULT_TASK_COMPLETION_TIMEOUT = 600
 
+IMAGE_CACHE_TTL = 300
+
+TOPOLOGY_CACHE_TTL = 600
+
 def get_url_path(url):
     return urlparse(url.strip()).path
 
@@ -193,6 +202,150 @@ class InstantiateVAppXML(object):
             {'href': self.net_href}
         )
 
+class VCloudTopology(object):
+    """
+    The VDCs, catalogs and networks of an org, as seen at C{fetched_at}.
+
+    @ivar vdcs: C{list} of VDC paths
+    @ivar catalogs: C{list} of catalog paths
+    @ivar networks: C{list} of C{Network} elements, in VDC order
+    """
+
+    def __init__(self, vdcs, catalogs, networks, fetched_at=None):
+        self.vdcs = vdcs
+        self.catalogs = catalogs
+        self.networks = networks
+        self.fetched_at = fetched_at or time.time()
+
+class _TaskWatch(object):
+
+    def __init__(self, href, timeout):
+        self.href = href
+        self.future = Future()
+        self.started = time.time()
+        self.deadline = self.started + timeout
+        self.due = self.started
+        self.interval = None
+
+class VCloudTaskWaiter(object):
+    """
+    Waits on many vCloud tasks from a single polling thread.
+
+    Every due task is polled in the same round, through the driver's
+    worker pool.  A task is first polled when it is handed in, then around
+    the time tasks have been taking to complete so far (an exponentially
+    weighted average), then at intervals growing by C{backoff} from
+    C{min_interval} up to C{max_interval}.
+
+    The polling thread exits when nothing is left to watch.
+    """
+
+    min_interval = 1
+    max_interval = 30
+    backoff = 1.5
+
+    # Weight of the newest task in the average task duration
+    smoothing = 0.3
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.expected_duration = None
+        self._watches = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def watch(self, task_href, timeout=DEFAULT_TASK_COMPLETION_TIMEOUT):
+        """
+        Start watching a task.
+
+        @return: L{Future} resolving to C{task_href} once the task succeeds
+        """
+        watch = _TaskWatch(task_href, timeout)
+        self._cond.acquire()
+        try:
+            self._watches.append(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        return watch.future
+
+    def _run(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while True:
+                    if not self._watches:
+                        self._thread = None
+                        return
+                    now = time.time()
+                    due = [w for w in self._watches if w.due <= now]
+                    if due:
+                        break
+                    self._cond.wait(min([w.due for w in self._watches])
+                                    - now)
+            finally:
+                self._cond.release()
+
+            statuses = self.driver._bulk(self._poll, due)
+            now = time.time()
+            finished = [w for w, status in zip(due, statuses)
+                        if self._update(w, status, now)]
+
+            self._cond.acquire()
+            try:
+                for watch in finished:
+                    self._watches.remove(watch)
+            finally:
+                self._cond.release()
+
+    def _poll(self, watch):
+        return self.driver.connection.request(watch.href).object.get('status')
+
+    def _update(self, watch, status, now):
+        # Returns True once the watch's future has been completed.
+        if isinstance(status, Exception):
+            watch.future.set_exception(status)
+        elif status == 'success':
+            self._observe(now - watch.started)
+            watch.future.set_result(watch.href)
+        elif status == 'error':
+            watch.future.set_exception(
+                Exception("Error status returned by task %s." % watch.href))
+        elif status == 'canceled':
+            watch.future.set_exception(
+                Exception("Canceled status returned by task %s."
+                          % watch.href))
+        elif now >= watch.deadline:
+            watch.future.set_exception(
+                Exception("Timeout while waiting for task %s." % watch.href))
+        else:
+            watch.due = now + self._next_interval(watch, now)
+            return False
+        return True
+
+    def _observe(self, duration):
+        if self.expected_duration is None:
+            self.expected_duration = duration
+        else:
+            self.expected_duration += (self.smoothing *
+                                       (duration - self.expected_duration))
+
+    def _next_interval(self, watch, now):
+        elapsed = now - watch.started
+        if self.expected_duration and elapsed < self.expected_duration:
+            # Come back when a typical task would be done.
+            interval = self.expected_duration - elapsed
+        elif watch.interval is None:
+            interval = watch.interval = self.min_interval
+        else:
+            interval = watch.interval = watch.interval * self.backoff
+        interval = max(self.min_interval, min(interval, self.max_interval))
+        return min(interval, max(0, watch.deadline - now))
+
 class VCloudResponse(Response):
 
     def parse_body(self):
@@ -262,7 +415,18 @@ class VCloudNodeDriver(NodeDriver):
     name = "vCloud"
     connectionCls = VCloudConnection
     org = None
-    _vdcs = None
+
+    # Seconds the org's VDCs, catalogs and networks are trusted for
+    topology_cache_ttl = TOPOLOGY_CACHE_TTL
+    _topology = None
+    _task_waiter = None
+
+    # Seconds list_images may answer from its cache without any request
+    image_cache_ttl = IMAGE_CACHE_TTL
+    _images = None
+    _images_time = 0
+    # Catalog href => (version, {catalog item href => images})
+    _catalog_items = None
 
     NODE_STATE_MAP = {'0': NodeState.PENDING,
                       '1': NodeState.PENDING,
@@ -270,33 +434,67 @@ class VCloudNodeDriver(NodeDriver):
                       '3': NodeState.PENDING,
                       '4': NodeState.RUNNING}
 
+    def __init__(self, key, secret=None, secure=True):
+        self._topology_lock = threading.Lock()
+        self._task_waiter_lock = threading.Lock()
+        super(VCloudNodeDriver, self).__init__(key, secret, secure)
+
+    @property
+    def topology(self):
+        """
+        L{VCloudTopology} of the org, fetched on first use and again once
+        it is older than C{topology_cache_ttl} seconds.
+        """
+        topology = self._topology
+        if (topology is None or
+            time.time() - topology.fetched_at >= self.topology_cache_ttl):
+            self._topology_lock.acquire()
+            try:
+                # Another thread may have refreshed it while we waited.
+                if self._topology is topology:
+                    self.refresh_topology()
+                topology = self._topology
+            finally:
+                self._topology_lock.release()
+        return topology
+
+    def refresh_topology(self):
+        """
+        Fetch the org and all of its VDCs (concurrently) again.
+
+        @return: L{VCloudTopology}
+        """
+        self.connection.check_org() # make sure the org is set.
+        res = self.connection.request(self.org)
+        links = res.object.findall(fixxpath(res.object, "Link"))
+        vdcs = [
+            get_url_path(i.get('href'))
+            for i in links
+            if i.get('type') == 'application/vnd.vmware.vcloud.vdc+xml'
+        ]
+        catalogs = [
+            get_url_path(i.get('href'))
+            for i in links
+            if i.get('type') == 'application/vnd.vmware.vcloud.catalog+xml'
+        ]
+
+        networks = []
+        for vdc in self._bulk_or_raise(
+            lambda vdc: self.connection.request(vdc).object, vdcs):
+            networks.extend(vdc.findall(
+                fixxpath(vdc, "AvailableNetworks/Network")
+            ))
+
+        self._topology = VCloudTopology(vdcs, catalogs, networks)
+        return self._topology
+
     @property
     def vdcs(self):
-        if not self._vdcs:
-            self.connection.check_org() # make sure the org is set.
-            res = self.connection.request(self.org)
-            self._vdcs = [
-                get_url_path(i.get('href'))
-                for i
-                in res.object.findall(fixxpath(res.object, "Link"))
-                if i.get('type') == 'application/vnd.vmware.vcloud.vdc+xml'
-            ]
-
-        return self._vdcs
+        return self.topology.vdcs
 
     @property
     def networks(self):
-        networks = []
-        for vdc in self.vdcs:
-            res = self.connection.request(vdc).object
-            networks.extend(
-                [network
-                 for network in res.findall(
-                     fixxpath(res, "AvailableNetworks/Network")
-                 )]
-            )
-
-        return networks
+        return self.topology.networks
 
     def _to_image(self, image):
         image = NodeImage(id=image.get('href'),
@@ -330,60 +528,72 @@ class VCloudNodeDriver(NodeDriver):
         return node
 
     def _get_catalog_hrefs(self):
-        res = self.connection.request(self.org)
-        catalogs = [
-            get_url_path(i.get('href'))
-            for i in res.object.findall(fixxpath(res.object, "Link"))
-            if i.get('type') == 'application/vnd.vmware.vcloud.catalog+xml'
-        ]
+        return self.topology.catalogs
 
-        return catalogs
+    @property
+    def task_waiter(self):
+        """
+        L{VCloudTaskWaiter} shared by everything this driver waits on.
+        """
+        if self._task_waiter is None:
+            self._task_waiter_lock.acquire()
+            try:
+                if self._task_waiter is None:
+                    self._task_waiter = VCloudTaskWaiter(self)
+            finally:
+                self._task_waiter_lock.release()
+        return self._task_waiter
 
     def _wait_for_task_completion(self, task_href,
                                   timeout=DEFAULT_TASK_COMPLETION_TIMEOUT):
-        start_time = time.time()
-        res = self.connection.request(task_href)
-        status = res.object.get('status')
-        while status != 'success':
-          if status == 'error':
-              raise Exception("Error status returned by task %s."
-                              % task_href)
-          if status == 'canceled':
-              raise Exception("Canceled status returned by task %s."
-                              % task_href)
-          if (time.time() - start_time >= timeout):
-              raise Exception("Timeout while waiting for task %s."
-                              % task_href)
-          time.sleep(5)
-          res = self.connection.request(task_href)
-          status = res.object.get('status')
+        return self.task_waiter.watch(task_href, timeout).result()
 
-    def destroy_node(self, node):
-        node_path = get_url_path(node.id)
-        # blindly poweroff node, it will throw an exception if already off
-        try:
-            res = self.connection.request('%s/power/action/poweroff'
-                                          % node_path,
-                                          method='POST')
-            self._wait_for_task_completion(res.object.get('href'))
-        except Exception, e:
-            pass
+    def _run_tasks(self, action_paths, concurrency=None):
+        """
+        POST to every action and wait for all resulting tasks together.
 
-        try:
-            res = self.connection.request('%s/action/undeploy' % node_path,
-                                          method='POST')
-            self._wait_for_task_completion(res.object.get('href'))
-        except ExpatError:
-            # The undeploy response is malformed XML atm.
-            # We can remove this whent he providers fix the problem.
-            pass
-        except Exception, e:
-            # Some vendors don't implement undeploy at all yet,
-            # so catch this and move on.
-            pass
-
-        res = self.connection.request(node_path, method='DELETE')
-        return res.status == 202
+        @return: C{list} of task hrefs or exceptions, in C{action_paths}
+                 order
+        """
+        def start(path):
+            res = self.connection.request(path, method='POST')
+            return self.task_waiter.watch(res.object.get('href'))
+
+        results = []
+        for future in self._bulk(start, action_paths, concurrency):
+            if isinstance(future, Exception):
+                results.append(future)
+            else:
+                results.append(future.exception() or future.result())
+        return results
+
+    def destroy_nodes(self, nodes, concurrency=None):
+        """
+        Destroy many vApps, powering off and undeploying them all first.
+
+        Each phase starts its tasks for every node before waiting on any,
+        so the waits overlap.
+        """
+        node_paths = [get_url_path(node.id) for node in nodes]
+
+        # blindly poweroff nodes, it will fail for those already off.
+        self._run_tasks(['%s/power/action/poweroff' % path
+                         for path in node_paths], concurrency)
+        # Some vendors don't implement undeploy at all yet, and some return
+        # malformed XML, so failures here are ignored too.
+        self._run_tasks(['%s/action/undeploy' % path
+                         for path in node_paths], concurrency)
+
+        def delete(path):
+            res = self.connection.request(path, method='DELETE')
+            return res.status == 202
+        return self._bulk(delete, node_paths, concurrency)
+
+    def destroy_node(self, node):
+        result = self.destroy_nodes([node])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
     def reboot_node(self, node):
         res = self.connection.request('%s/power/action/reset'
@@ -391,32 +601,74 @@ class VCloudNodeDriver(NodeDriver):
                                       method='POST')
         return res.status == 202 or res.status == 204
 
-    def list_nodes(self):
-        nodes = []
-        for vdc in self.vdcs:
-            res = self.connection.request(vdc)
-            elms = res.object.findall(fixxpath(
-                res.object, "ResourceEntities/ResourceEntity")
-            )
-            vapps = [
-                (i.get('name'), get_url_path(i.get('href')))
-                for i in elms
-                if i.get('type')
-                    == 'application/vnd.vmware.vcloud.vApp+xml'
-                    and i.get('name')
-            ]
-
-            for vapp_name, vapp_href in vapps:
-                res = self.connection.request(
-                    vapp_href,
-                    headers={
-                        'Content-Type':
-                            'application/vnd.vmware.vcloud.vApp+xml'
-                    }
-                )
-                nodes.append(self._to_node(vapp_name, res.object))
-
-        return nodes
+    def _get_vapp_entities(self, vdc):
+        """Given a VDC path returns (name, href) of the vApps it holds"""
+        res = self.connection.request(vdc)
+        elms = res.object.findall(fixxpath(
+            res.object, "ResourceEntities/ResourceEntity")
+        )
+        return [
+            (i.get('name'), i.get('href'))
+            for i in elms
+            if i.get('type')
+                == 'application/vnd.vmware.vcloud.vApp+xml'
+                and i.get('name')
+        ]
+
+    def _get_vapp_node(self, vapp):
+        vapp_name, vapp_href = vapp
+        res = self.connection.request(
+            get_url_path(vapp_href),
+            headers={
+                'Content-Type':
+                    'application/vnd.vmware.vcloud.vApp+xml'
+            }
+        )
+        return self._to_node(vapp_name, res.object)
+
+    def _summary_to_node(self, vapp):
+        vapp_name, vapp_href = vapp
+        return Node(id=vapp_href,
+                    name=vapp_name,
+                    state=NodeState.UNKNOWN,
+                    public_ip=[],
+                    private_ip=[],
+                    driver=self.connection.driver)
+
+    def _bulk_or_raise(self, func, items):
+        # Results come back in items order; the first failure is raised
+        # so a partial listing is never mistaken for a complete one.
+        results = self._bulk(func, items)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def list_nodes(self, detail=True):
+        """
+        List all vApps in every VDC of the org.
+
+        VDCs, and then the vApps in them, are fetched concurrently over at
+        most C{bulk_concurrency} connections.
+
+        @keyword    detail: If C{False}, skip fetching each vApp and build
+                            nodes from the VDC summary alone: one request
+                            per VDC, but state is C{NodeState.UNKNOWN} and
+                            no IPs are filled in.
+        @type       detail: C{bool}
+
+        @return: L{NodeCollection} of L{Node} objects
+        """
+        vapps = []
+        for entities in self._bulk_or_raise(self._get_vapp_entities,
+                                            self.vdcs):
+            vapps.extend(entities)
+
+        if not detail:
+            return NodeCollection([self._summary_to_node(vapp)
+                                   for vapp in vapps])
+        return NodeCollection(self._bulk_or_raise(self._get_vapp_node,
+                                                  vapps))
 
     def _to_size(self, ram):
         ns = NodeSize(
@@ -434,15 +686,25 @@ class VCloudNodeDriver(NodeDriver):
         sizes = [self._to_size(i) for i in VIRTUAL_MEMORY_VALS]
         return sizes
 
-    def _get_catalogitems_hrefs(self, catalog):
-        """Given a catalog href returns contained catalog item hrefs"""
-        res = self.connection.request(
+    def _get_catalog_listing(self, catalog):
+        """
+        Given a catalog href returns its version and contained catalog
+        item hrefs.
+
+        The version is the catalog's ETag, or a digest of its body when the
+        server doesn't send one; it changes whenever the catalog does.
+        """
+        resp = self.connection.request(
             catalog,
             headers={
                 'Content-Type':
                     'application/vnd.vmware.vcloud.catalog+xml'
             }
-        ).object
+        )
+        res = resp.object
+        version = resp.headers.get('etag')
+        if version is None:
+            version = hashlib.sha1(resp.body).hexdigest()
 
         cat_items = res.findall(fixxpath(res, "CatalogItems/CatalogItem"))
         cat_item_hrefs = [i.get('href')
@@ -450,7 +712,7 @@ class VCloudNodeDriver(NodeDriver):
                           if i.get('type') ==
                               'application/vnd.vmware.vcloud.catalogItem+xml']
 
-        return cat_item_hrefs
+        return version, cat_item_hrefs
 
     def _get_catalogitem(self, catalog_item):
         """Given a catalog item href returns elementree"""
@@ -464,36 +726,96 @@ class VCloudNodeDriver(NodeDriver):
 
         return res
 
-    def list_images(self, location=None):
+    def _get_catalogitem_images(self, catalog_item):
+        res = self._get_catalogitem(catalog_item)
+        res_ents = res.findall(fixxpath(res, 'Entity'))
+        return [
+            self._to_image(i)
+            for i in res_ents
+            if i.get('type') ==
+                'application/vnd.vmware.vcloud.vAppTemplate+xml'
+        ]
+
+    def _get_vdc_images(self, vdc):
+        res = self.connection.request(vdc).object
+        res_ents = res.findall(fixxpath(
+            res, "ResourceEntities/ResourceEntity")
+        )
+        return [
+            self._to_image(i)
+            for i in res_ents
+            if i.get('type') ==
+                'application/vnd.vmware.vcloud.vAppTemplate+xml'
+        ]
+
+    def list_images(self, location=None, refresh=False):
+        """
+        List vApp templates in every VDC and catalog of the org.
+
+        The result is cached for C{image_cache_ttl} seconds.  After that,
+        VDCs and catalog listings are fetched again concurrently, and the
+        items of a catalog are only fetched again when its version (ETag,
+        or body digest) changed, so an unchanged catalog costs a single
+        request.
+
+        @keyword    refresh: Drop the cache and fetch every catalog item
+        @type       refresh: C{bool}
+        """
+        if refresh:
+            self._images = None
+            self._catalog_items = None
+        elif (self._images is not None
+              and time.time() - self._images_time < self.image_cache_ttl):
+            return list(self._images)
+
+        fetched_at = time.time()
         images = []
-        for vdc in self.vdcs:
-            res = self.connection.request(vdc).object
-            res_ents = res.findall(fixxpath(
-                res, "ResourceEntities/ResourceEntity")
-            )
-            images += [
-                self._to_image(i)
-                for i in res_ents
-                if i.get('type') ==
-                    'application/vnd.vmware.vcloud.vAppTemplate+xml'
-            ]
-
-        for catalog in self._get_catalog_hrefs():
-            for cat_item in self._get_catalogitems_hrefs(catalog):
-                res = self._get_catalogitem(cat_item)
-                res_ents = res.findall(fixxpath(res, 'Entity'))
-                images += [
-                    self._to_image(i)
-                    for i in res_ents
-                    if i.get('type') ==
-                        'application/vnd.vmware.vcloud.vAppTemplate+xml'
-                ]
-
-        return images
+        for vdc_images in self._bulk_or_raise(self._get_vdc_images,
+                                              self.vdcs):
+            images.extend(vdc_images)
+
+        catalogs = self._get_catalog_hrefs()
+        listings = self._bulk_or_raise(self._get_catalog_listing, catalogs)
+
+        known = self._catalog_items or {}
+        missing = set()
+        for catalog, (version, item_hrefs) in zip(catalogs, listings):
+            if catalog not in known or known[catalog][0] != version:
+                missing.update(item_hrefs)
+        missing = list(missing)
+        fetched = dict(zip(
+            missing,
+            self._bulk_or_raise(self._get_catalogitem_images, missing)
+        ))
+
+        catalog_items = {}
+        for catalog, (version, item_hrefs) in zip(catalogs, listings):
+            if catalog in known and known[catalog][0] == version:
+                items = known[catalog][1]
+            else:
+                items = dict([(h, fetched[h]) for h in item_hrefs])
+            catalog_items[catalog] = (version, items)
+            for item_href in item_hrefs:
+                images += items[item_href]
+
+        self._catalog_items = catalog_items
+        self._images = images
+        self._images_time = fetched_at
+        return list(images)
 
     def create_node(self, **kwargs):
         """Creates and returns node.
 
+        See L{create_node_async} for the keyword arguments.
+        """
+        return self.create_node_async(**kwargs).wait()
+
+    def create_node_async(self, **kwargs):
+        """Instantiates a vApp and returns an L{OperationHandle} for it.
+
+        Deploying, powering on and fetching the new node carry on in the
+        background; the handle's C{wait()} returns the node.
+
         Non-standard optional keyword arguments:
         network -- link to a "Network" e.g.,
             "https://services.vcloudexpress.terremark.com/api/v0.8/network/7"
@@ -547,20 +869,23 @@ class VCloudNodeDriver(NodeDriver):
         vapp_name = res.object.get('name')
         vapp_href = get_url_path(res.object.get('href'))
 
+        return self._start_operation(
+            self._finish_create_node(vapp_name, vapp_href)
+        )
+
+    def _finish_create_node(self, vapp_name, vapp_href):
         # Deploy the VM from the identifier.
         res = self.connection.request('%s/action/deploy' % vapp_href,
                                       method='POST')
 
-        self._wait_for_task_completion(res.object.get('href'))
+        yield self.task_waiter.watch(res.object.get('href'))
 
         # Power on the VM.
         res = self.connection.request('%s/power/action/powerOn' % vapp_href,
                                       method='POST')
 
         res = self.connection.request(vapp_href)
-        node = self._to_node(vapp_name, res.object)
-
-        return node
+        yield Result(self._to_node(vapp_name, res.object))
 
     features = {"create_node": ["password"]}
 
@@ -19,7 +19,7 @@ Voxel VoxCloud driver
 from libcloud.providers import Provider
 from libcloud.types import NodeState, InvalidCredsException
 from libcloud.base import Node, Response, ConnectionUserAndKey, NodeDriver
-from libcloud.base import NodeSize, NodeImage, NodeLocation
+from libcloud.base import NodeSize, NodeImage, NodeLocation, NodeCollection
 import datetime
 import hashlib
 from xml.etree import ElementTree as ET
@@ -131,7 +131,7 @@ class VoxelNodeDriver(NodeDriver):
     def list_nodes(self):
         params = {"method": "voxel.devices.list"}
         result = self.connection.request('/', params=params).object
-        return self._to_nodes(result)
+        return NodeCollection(self._to_nodes(result))
 
     def list_sizes(self, location=None):
         return [ NodeSize(driver=self.connection.driver, **i)
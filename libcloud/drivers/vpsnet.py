@@ -18,7 +18,7 @@ VPS.net driver
 from libcloud.providers import Provider
 from libcloud.types import NodeState, InvalidCredsException
 from libcloud.base import Node, Response, ConnectionUserAndKey, NodeDriver
-from libcloud.base import NodeSize, NodeImage, NodeLocation
+from libcloud.base import NodeSize, NodeImage, NodeLocation, NodeCollection
 
 import base64
 
@@ -163,7 +163,22 @@ class VPSNetNodeDriver(NodeDriver):
 
     def list_nodes(self):
         res = self.connection.request('/virtual_machines.%s' % (API_VERSION,))
-        return [self._to_node(i['virtual_machine']) for i in res.object] 
+        return NodeCollection([self._to_node(i['virtual_machine'])
+                               for i in res.object])
+
+    def get_node(self, node_id):
+        res = self.connection.request('/virtual_machines/%s.%s'
+                                      % (node_id, API_VERSION))
+        if res.status == 404:
+            return None
+        return self._to_node(res.object['virtual_machine'])
+
+    # One request per node
+    get_nodes_is_batched = False
+
+    def get_nodes(self, node_ids):
+        nodes = [self.get_node(node_id) for node_id in node_ids]
+        return NodeCollection([n for n in nodes if n is not None])
 
     def list_images(self, location=None):
         res = self.connection.request('/available_clouds.%s' % (API_VERSION,))
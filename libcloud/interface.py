@@ -160,6 +160,16 @@ class INodeDriver(Interface):
         Returns a list of nodes for this provider
         """
 
+    def get_node(node_id):
+        """
+        Returns the node with the given provider id, or None
+        """
+
+    def get_nodes(node_ids):
+        """
+        Returns the nodes with the given provider ids
+        """
+
     def list_images(location=None):
         """
         Returns a list of images for this provider
@@ -180,6 +190,28 @@ class INodeDriver(Interface):
         Returns True if the reboot was successful, otherwise False
         """
 
+    def create_node_async(**kwargs):
+        """
+        Starts creating a node and returns an operation handle whose
+        wait() returns the node
+        """
+
+    def create_nodes(specs, concurrency=None, **kwargs):
+        """
+        Creates a number of nodes, or one node per dict of keyword
+        arguments. Returns a list with a node or exception for each.
+        """
+
+    def destroy_nodes(nodes, concurrency=None):
+        """
+        Returns a list with the destroy result or exception for each node
+        """
+
+    def reboot_nodes(nodes, concurrency=None):
+        """
+        Returns a list with the reboot result or exception for each node
+        """
+
 class IConnection(Interface):
     """
     A Connection represents an interface between a Client and a Provider's Web
@@ -0,0 +1,142 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provides change tracking between successive node listings
+"""
+
+FINGERPRINT_FIELDS = ('state', 'public_ip', 'private_ip', 'extra')
+
+
+def _freeze(value):
+    # Turn lists and dicts into something hashable, with a stable order so
+    # two equal snapshots always produce the same hash.
+    if isinstance(value, dict):
+        items = [(k, _freeze(v)) for k, v in value.items()]
+        items.sort()
+        return tuple(items)
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(v) for v in value])
+    if value is None or isinstance(value, (basestring, int, long, float,
+                                           bool)):
+        return value
+    return repr(value)
+
+
+def fingerprint(node):
+    """
+    Compact summary of the parts of a node we care about changing.
+
+    @return: C{tuple} of one hash per entry in L{FINGERPRINT_FIELDS}
+    """
+    return tuple([hash(_freeze(getattr(node, f, None)))
+                  for f in FINGERPRINT_FIELDS])
+
+
+class NodeDiff(object):
+    """
+    Difference between two node listings.
+
+    @ivar added: C{list} of L{Node} objects that are new
+    @ivar removed: C{list} of uuids that are no longer listed
+    @ivar changed: C{list} of L{Node} objects whose fields changed
+    @ivar changed_fields: C{dict} mapping uuid to the C{list} of field names
+        (from L{FINGERPRINT_FIELDS}) that changed
+    """
+
+    def __init__(self, added=None, removed=None, changed=None,
+                 changed_fields=None):
+        self.added = added or []
+        self.removed = removed or []
+        self.changed = changed or []
+        self.changed_fields = changed_fields or {}
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return ('<NodeDiff: added=%d, removed=%d, changed=%d>'
+                % (len(self.added), len(self.removed), len(self.changed)))
+
+
+def _diff(old_prints, nodes):
+    # old_prints: uuid => fingerprint.  Returns (NodeDiff, new_prints).
+    new_prints = {}
+    diff = NodeDiff()
+    for node in nodes:
+        current = fingerprint(node)
+        new_prints[node.uuid] = current
+        previous = old_prints.get(node.uuid)
+        if previous is None:
+            diff.added.append(node)
+        elif previous != current:
+            diff.changed.append(node)
+            diff.changed_fields[node.uuid] = [
+                FINGERPRINT_FIELDS[i]
+                for i in range(len(FINGERPRINT_FIELDS))
+                if previous[i] != current[i]
+            ]
+    diff.removed = [uuid for uuid in old_prints if uuid not in new_prints]
+    return diff, new_prints
+
+
+def diff_nodes(old, new):
+    """
+    Compare two snapshots returned by L{NodeDriver.list_nodes}.
+
+    Runs in linear time over both snapshots.
+
+    @return: L{NodeDiff}
+    """
+    old_prints = dict([(n.uuid, fingerprint(n)) for n in old])
+    return _diff(old_prints, new)[0]
+
+
+class InventoryTracker(object):
+    """
+    Remembers the last node listing and reports what changed since.
+
+    Only the uuid and fingerprint of each node are kept between calls, so
+    memory use does not grow with the number of polls.
+
+    >>> tracker = InventoryTracker()
+    >>> diff = tracker.update(driver.list_nodes())  # doctest: +SKIP
+    """
+
+    def __init__(self, nodes=None):
+        self.fingerprints = {}
+        if nodes is not None:
+            self.update(nodes)
+
+    def update(self, nodes):
+        """
+        Record a new snapshot.
+
+        @return: L{NodeDiff} against the previous snapshot
+        """
+        diff, self.fingerprints = _diff(self.fingerprints, nodes)
+        return diff
+
+    def poll(self, driver):
+        """
+        Shortcut for C{update(driver.list_nodes())}.
+        """
+        return self.update(driver.list_nodes())
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, uuid):
+        return uuid in self.fingerprints
@@ -0,0 +1,166 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provides a facade listing nodes, images, sizes and locations across many
+drivers at once
+"""
+import hashlib
+import threading
+import time
+
+from libcloud.base import NodeCollection
+from libcloud.pool import Future
+
+DEFAULT_MULTI_TIMEOUT = 60
+
+
+def item_uuid(item):
+    """
+    Identify a node, image, size or location across drivers.
+
+    Nodes have their own uuid; for the others it is derived the same way,
+    from the provider id and the driver type.
+
+    @return: C{str}
+    """
+    uuid = getattr(item, 'uuid', None)
+    if uuid is not None:
+        return uuid
+    return hashlib.sha1("%s:%d" % (item.id, item.driver.type)).hexdigest()
+
+
+class MultiResult(NodeCollection):
+    """
+    Items gathered from several drivers, first driver first, without
+    duplicates.
+
+    A L{NodeCollection} indexed on L{item_uuid}, so images, sizes and
+    locations can be looked up by uuid too.  Ids are only unique per
+    driver: L{by_id} returns the last item listed with that id.
+
+    @ivar errors: C{dict} mapping each driver that failed or timed out to
+        its exception; its items are simply missing
+    """
+
+    def __init__(self, items=None, errors=None):
+        NodeCollection.__init__(self, items)
+        self.errors = errors or {}
+
+    def _uuid(self, item):
+        return item_uuid(item)
+
+    def by_driver(self, driver):
+        """
+        @return: C{list} of the items listed by C{driver}
+        """
+        return [item for item in self if item.driver is driver]
+
+
+class MultiDriver(object):
+    """
+    Runs the listing calls of many drivers concurrently, so a listing only
+    takes as long as the slowest driver, or the timeout.
+
+    >>> multi = MultiDriver([ec2, rackspace], timeout=30)  # doctest: +SKIP
+    >>> nodes = multi.list_nodes()  # doctest: +SKIP
+    >>> nodes.errors  # doctest: +SKIP
+    {}
+
+    A driver that fails or runs out of time doesn't fail the whole call; it
+    shows up in the result's C{errors} instead.  A call that timed out
+    keeps running in the background, and its result is dropped.
+    """
+
+    def __init__(self, drivers, timeout=DEFAULT_MULTI_TIMEOUT, timeouts=None):
+        """
+        @param      drivers: The L{NodeDriver} objects, any number per
+                             provider (one per set of credentials)
+        @type       drivers: C{list}
+
+        @keyword    timeout: Seconds to wait for each driver, or C{None}
+                             to wait as long as it takes
+        @type       timeout: C{float}
+
+        @keyword    timeouts: Timeouts for specific drivers, overriding
+                              C{timeout}
+        @type       timeouts: C{dict}
+        """
+        self.drivers = list(drivers)
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+
+    def _call(self, method, *args):
+        futures = []
+        for driver in self.drivers:
+            future = Future()
+            thread = threading.Thread(target=self._run,
+                                      args=(future, getattr(driver, method),
+                                            args))
+            thread.setDaemon(True)
+            thread.start()
+            futures.append(future)
+
+        start = time.time()
+        merged = []
+        errors = {}
+        seen = set()
+        for driver, future in zip(self.drivers, futures):
+            timeout = self.timeouts.get(driver, self.timeout)
+            if timeout is not None:
+                timeout = max(0, start + timeout - time.time())
+            try:
+                items = future.result(timeout)
+            except Exception, e:
+                errors[driver] = e
+                continue
+            for item in items:
+                uuid = item_uuid(item)
+                if uuid not in seen:
+                    seen.add(uuid)
+                    merged.append(item)
+        return MultiResult(merged, errors)
+
+    def _run(self, future, func, args):
+        try:
+            value = func(*args)
+        except Exception, e:
+            future.set_exception(e)
+        else:
+            future.set_result(value)
+
+    def list_nodes(self):
+        """
+        @return: L{MultiResult} of L{Node} objects
+        """
+        return self._call('list_nodes')
+
+    def list_images(self):
+        """
+        @return: L{MultiResult} of L{NodeImage} objects
+        """
+        return self._call('list_images')
+
+    def list_sizes(self):
+        """
+        @return: L{MultiResult} of L{NodeSize} objects
+        """
+        return self._call('list_sizes')
+
+    def list_locations(self):
+        """
+        @return: L{MultiResult} of L{NodeLocation} objects
+        """
+        return self._call('list_locations')
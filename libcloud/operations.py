@@ -0,0 +1,256 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provides handles on long-running operations, and the scheduler that
+advances them
+
+An operation is a generator.  Each time it yields, the scheduler resumes it
+later, from any of its worker threads:
+
+  - a L{Future}: once the future completes, with its result sent in (or its
+    exception thrown in)
+  - a L{Sleep}: after that many seconds
+  - a L{Result}: never, the operation is finished with that value
+  - anything else: as soon as a worker is free
+
+So a worker is only busy while an operation runs between two yields, and
+waiting on a provider never ties one up.
+"""
+import heapq
+import threading
+import time
+import Queue
+
+from libcloud.pool import Future, DEFAULT_POOL_SIZE
+
+
+class Sleep(object):
+    """
+    Yielded by an operation to be resumed after C{seconds}.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Result(object):
+    """
+    Yielded by an operation to finish with C{value}.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class OperationHandle(object):
+    """
+    Pollable handle on an operation started by an L{OperationScheduler}.
+
+    @ivar future: L{Future} completed with the operation's result
+    @ivar steps: Number of times the operation has been resumed
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.future = Future()
+        self.steps = 0
+
+    def done(self):
+        """
+        @return: C{True} once the operation has finished or failed
+        """
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """
+        Block until the operation finishes.
+
+        @keyword    timeout: Seconds to wait, or C{None} to wait forever
+        @type       timeout: C{float}
+
+        @return: the operation's result, or raises its exception
+        """
+        return self.future.result(timeout)
+
+
+def wait_all(handles, timeout=None):
+    """
+    Wait for every handle to finish.
+
+    @keyword    timeout: Seconds to wait for all of them together
+    @type       timeout: C{float}
+
+    @return: C{list} holding, for each handle, its result or the exception
+             it failed with
+    """
+    deadline = timeout is not None and time.time() + timeout
+    results = []
+    for handle in handles:
+        remaining = None
+        if deadline:
+            remaining = max(0, deadline - time.time())
+        exception = handle.future.exception(remaining)
+        if exception is not None:
+            results.append(exception)
+        else:
+            results.append(handle.wait())
+    return results
+
+
+def wait_any(handles, timeout=None):
+    """
+    Wait for the first of C{handles} to finish.
+
+    Meant to be called in a loop: its callbacks are removed again before
+    it returns, so pending handles don't collect one per call.
+
+    @return: a finished L{OperationHandle}, or C{None} on timeout
+    """
+    for handle in handles:
+        if handle.done():
+            return handle
+    event = threading.Event()
+    def wake(future):
+        event.set()
+    for handle in handles:
+        handle.future.add_done_callback(wake)
+    try:
+        event.wait(timeout)
+    finally:
+        for handle in handles:
+            handle.future.remove_done_callback(wake)
+    for handle in handles:
+        if handle.done():
+            return handle
+    return None
+
+
+class OperationScheduler(object):
+    """
+    Runs operations on at most C{size} worker threads.
+
+    Threads are started on first use and then stay around, idle, for the
+    life of the process.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = max(1, size)
+        self._ready = Queue.Queue()
+        self._timers = []
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self, operation):
+        """
+        Start running a generator as an operation.
+
+        @return: L{OperationHandle}
+        """
+        handle = OperationHandle(operation)
+        self._start_threads()
+        self._ready.put((handle, None, None))
+        return handle
+
+    def _start_threads(self):
+        self._cond.acquire()
+        try:
+            if self._started:
+                return
+            self._started = True
+        finally:
+            self._cond.release()
+        threads = [threading.Thread(target=self._work)
+                   for i in range(self.size)]
+        threads.append(threading.Thread(target=self._time))
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+
+    def _work(self):
+        while True:
+            handle, value, exception = self._ready.get()
+            self._step(handle, value, exception)
+
+    def _time(self):
+        self._cond.acquire()
+        try:
+            while True:
+                now = time.time()
+                while self._timers and self._timers[0][0] <= now:
+                    self._ready.put((heapq.heappop(self._timers)[1],
+                                     None, None))
+                if self._timers:
+                    self._cond.wait(self._timers[0][0] - now)
+                else:
+                    self._cond.wait()
+        finally:
+            self._cond.release()
+
+    def _step(self, handle, value, exception):
+        try:
+            if exception is not None:
+                yielded = handle.operation.throw(exception)
+            else:
+                yielded = handle.operation.send(value)
+        except StopIteration:
+            handle.future.set_result(None)
+            return
+        except Exception, e:
+            handle.future.set_exception(e)
+            return
+        handle.steps += 1
+
+        if isinstance(yielded, Result):
+            handle.operation.close()
+            handle.future.set_result(yielded.value)
+        elif isinstance(yielded, Future):
+            yielded.add_done_callback(
+                lambda future: self._resume(handle, future))
+        elif isinstance(yielded, Sleep):
+            self._cond.acquire()
+            try:
+                heapq.heappush(self._timers,
+                               (time.time() + yielded.seconds, handle))
+                self._cond.notify()
+            finally:
+                self._cond.release()
+        else:
+            self._ready.put((handle, yielded, None))
+
+    def _resume(self, handle, future):
+        exception = future.exception()
+        if exception is not None:
+            self._ready.put((handle, None, exception))
+        else:
+            self._ready.put((handle, future.result(), None))
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    @return: the L{OperationScheduler} shared by all drivers
+    """
+    global _default_scheduler
+    _default_scheduler_lock.acquire()
+    try:
+        if _default_scheduler is None:
+            _default_scheduler = OperationScheduler()
+        return _default_scheduler
+    finally:
+        _default_scheduler_lock.release()
@@ -0,0 +1,215 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provides a bounded thread pool and futures for running blocking calls
+side by side
+"""
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 8
+
+
+class Future(object):
+    """
+    Result of a call that completes later, possibly on another thread.
+
+    >>> future = Future()
+    >>> future.set_result(42)
+    >>> future.result()
+    42
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        @return: C{True} once a result or exception has been set
+        """
+        return self._event.isSet()
+
+    def result(self, timeout=None):
+        """
+        Block until the call completes.
+
+        @keyword    timeout: Seconds to wait, or C{None} to wait forever
+        @type       timeout: C{float}
+
+        @return: the result, or raises the exception the call ended with
+        """
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Like L{result}, but returns the exception the call ended with
+        instead of raising it.
+
+        @return: the exception, or C{None} if the call succeeded
+        """
+        self._event.wait(timeout)
+        if not self._event.isSet():
+            raise Exception("Timed out after %s seconds" % timeout)
+        return self._exception
+
+    def add_done_callback(self, func):
+        """
+        Call C{func(future)} once the call completes, right away if it
+        already has.
+        """
+        self._lock.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        finally:
+            self._lock.release()
+        func(self)
+
+    def remove_done_callback(self, func):
+        """
+        Forget a callback added with L{add_done_callback} that hasn't run.
+        """
+        self._lock.acquire()
+        try:
+            if func in self._callbacks:
+                self._callbacks.remove(func)
+        finally:
+            self._lock.release()
+
+    def set_result(self, result):
+        self._set(result, None)
+
+    def set_exception(self, exception):
+        self._set(None, exception)
+
+    def _set(self, result, exception):
+        self._lock.acquire()
+        try:
+            if self.done():
+                raise Exception("Future already completed")
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for func in callbacks:
+            func(self)
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls so that at most one starts every C{interval} seconds,
+    across all threads sharing the limiter.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        self._lock.acquire()
+        try:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        finally:
+            self._lock.release()
+        if start > now:
+            time.sleep(start - now)
+
+
+class WorkerPool(object):
+    """
+    Runs a function over many items with at most C{size} threads.
+
+    Threads only live for the duration of one L{map} call, so an idle pool
+    costs nothing.
+
+    >>> pool = WorkerPool(size=4)
+    >>> pool.map(lambda x: x * 2, [1, 2, 3])
+    [2, 4, 6]
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, rate_limit=None):
+        """
+        @keyword    size:   Maximum number of concurrent calls
+        @type       size:   C{int}
+
+        @keyword    rate_limit: Minimum number of seconds between the start
+                                of two calls, or C{None} for no limit
+        @type       rate_limit: C{float}
+        """
+        self.size = max(1, size or 1)
+        self.limiter = RateLimiter(rate_limit)
+
+    def map(self, func, items):
+        """
+        Call C{func(item)} for every item.
+
+        An exception raised for one item does not stop the others; it is
+        put in that item's slot of the result instead.
+
+        @return: C{list} of return values or exceptions, in C{items} order
+        """
+        items = list(items)
+        results = [None] * len(items)
+        pending = iter(range(len(items)))
+        lock = threading.Lock()
+
+        def next_index():
+            lock.acquire()
+            try:
+                for i in pending:
+                    return i
+                return None
+            finally:
+                lock.release()
+
+        def work():
+            while True:
+                i = next_index()
+                if i is None:
+                    return
+                self.limiter.wait()
+                try:
+                    results[i] = func(items[i])
+                except Exception, e:
+                    results[i] = e
+
+        count = min(self.size, len(items))
+        if count <= 1:
+            work()
+            return results
+
+        threads = [threading.Thread(target=work) for i in range(count)]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        for t in threads:
+            t.join()
+        return results
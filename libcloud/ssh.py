@@ -25,28 +25,236 @@ except ImportError:
     pass
 
 from os.path import split as psplit
+from pipes import quote as pquote
+import copy
+import os
+import posixpath
+import re
+import select
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+from libcloud.pool import WorkerPool, DEFAULT_POOL_SIZE
+
+SSH_BANNER_PREFIX = 'SSH-'
+
+# Errors raised by SSHClient.connect while sshd, accounts or keys are still
+# coming up on a fresh node
+SSH_CONNECT_ERRORS = (IOError, socket.error)
+if have_paramiko:
+    SSH_CONNECT_ERRORS += (paramiko.SSHException,)
+
+# Bytes read from a local file per write when streaming an upload
+PUT_CHUNK_SIZE = 1024 * 1024
+
+def _source_size(source):
+    try:
+        return os.fstat(source.fileno()).st_size
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+# Bytes read from a command's output at a time
+RUN_READ_SIZE = 32768
+
+class OutputBuffer(object):
+    """
+    Collects output, keeping at most the last C{limit} bytes.
+
+    @ivar dropped: Number of bytes discarded to stay within C{limit}
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.dropped = 0
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self.limit is None or self._size <= self.limit:
+            return
+        value = ''.join(self._chunks)
+        excess = len(value) - self.limit
+        self.dropped += excess
+        self._chunks = [value[excess:]]
+        self._size = self.limit
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+def _output(buffer_size, callback):
+    # One write function feeding both the buffer and the callback.
+    buf = OutputBuffer(buffer_size)
+    if callback is None:
+        return buf, buf.write
+    def write(data):
+        buf.write(data)
+        callback(data)
+    return buf, write
+
+def copy_stream(source, write, total=None, progress=None,
+                chunk_size=PUT_CHUNK_SIZE):
+    """
+    Copy a file-like object to C{write} in chunks.
+
+    @keyword    total: Size of C{source}, if known, passed on to C{progress}
+    @type       total: C{int}
+
+    @keyword    progress: Called after each chunk as
+                          C{progress(sent, total, rate)}, C{rate} being the
+                          average throughput so far in bytes per second
+    @type       progress: C{callable}
+
+    @return: Number of bytes copied
+    """
+    start = time.time()
+    sent = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        write(chunk)
+        sent += len(chunk)
+        if progress is not None:
+            elapsed = time.time() - start
+            rate = None
+            if elapsed > 0:
+                rate = sent / elapsed
+            progress(sent, total, rate)
+    return sent
+
+def probe_ssh(hostname, port=22, timeout=5, banner=True):
+    """
+    Cheaply check whether an SSH server answers, without a handshake.
+
+    @keyword    timeout: Seconds allowed for connecting and for the banner
+    @type       timeout: C{float}
+
+    @keyword    banner: Also wait for the server's C{SSH-} banner, which
+                        is only sent once sshd is really serving
+    @type       banner: C{bool}
+
+    @return: the banner (or C{True} if not read), or C{None} if nothing
+             answered
+    """
+    try:
+        addresses = socket.getaddrinfo(hostname, port, 0, socket.SOCK_STREAM)
+    except socket.error:
+        return None
+    for family, socktype, proto, canonname, address in addresses:
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        try:
+            try:
+                sock.connect(address)
+                if not banner:
+                    return True
+                data = sock.recv(256)
+                if data.startswith(SSH_BANNER_PREFIX):
+                    return data.strip()
+            except socket.error:
+                pass
+        finally:
+            sock.close()
+    return None
+
+def wait_for_ssh(hostname, port=22, timeout=600, interval=0.5,
+                 max_interval=10, banner=True):
+    """
+    Probe with L{probe_ssh} until it answers, backing off exponentially
+    from C{interval} to C{max_interval} seconds between attempts.
+
+    @return: what L{probe_ssh} returned
+    """
+    end = time.time() + timeout
+    while True:
+        left = end - time.time()
+        answer = probe_ssh(hostname, port, min(5, max(left, 0.1)), banner)
+        if answer is not None:
+            return answer
+        left = end - time.time()
+        if left <= 0:
+            raise Exception("Timeout while waiting for SSH on %s:%s."
+                            % (hostname, port))
+        time.sleep(min(interval, left))
+        interval = min(interval * 2, max_interval)
 
 class BaseSSHClient(object):
-    def __init__(self, hostname, port=22, username='root', password=None, key=None):
+    def __init__(self, hostname, port=22, username='root', password=None,
+                 key=None, timeout=None):
         self.hostname = hostname
         self.port = port
         self.username = username
         self.password = password
         self.key = key
+        # Seconds allowed for connecting, or None for no limit
+        self.timeout = timeout
 
     def connect(self):
         raise NotImplementedError, \
             'connect not implemented for this ssh client'
 
-    def put(self, path, contents=None, chmod=None):
+    def put(self, path, contents=None, chmod=None, local_path=None,
+            progress=None):
+        """
+        Upload a file.
+
+        @param      path: Remote path; missing directories are created
+        @type       path: C{str}
+
+        @keyword    contents: A string, or a file-like object to stream
+        @type       contents: C{str} or C{file}
+
+        @keyword    chmod: Mode to give the remote file
+        @type       chmod: C{int}
+
+        @keyword    local_path: Local file to stream instead of C{contents}
+        @type       local_path: C{str}
+
+        @keyword    progress: See L{copy_stream}
+        @type       progress: C{callable}
+
+        One of C{contents} and C{local_path} is required.
+        """
         raise NotImplementedError, \
             'put not implemented for this ssh client'
 
+    def put_many(self, files):
+        """
+        Upload several files.
+
+        @param files: C{(path, contents)} or C{(path, contents, chmod)}
+                      tuples
+        @type files: C{list}
+        """
+        for args in files:
+            self.put(*args)
+
     def delete(self, path):
         raise NotImplementedError, \
             'delete not implemented for this ssh client'
 
-    def run(self, cmd):
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        """
+        Run a command, reading its stdout and stderr as they come.
+
+        @keyword    on_stdout: Called with each chunk of stdout
+        @type       on_stdout: C{callable}
+
+        @keyword    on_stderr: Called with each chunk of stderr
+        @type       on_stderr: C{callable}
+
+        @keyword    buffer_size: Only keep the last this many bytes of each
+                                 stream, or C{None} to keep everything
+        @type       buffer_size: C{int}
+
+        @return: C{[stdout, stderr, exit_status]}
+        """
         raise NotImplementedError, \
             'run not implemented for this ssh client'
 
@@ -55,10 +263,32 @@ class BaseSSHClient(object):
             'close not implemented for this ssh client'
 
 class ParamikoSSHClient(BaseSSHClient):
-    def __init__(self, hostname, port=22, username='root', password=None, key=None):
-        super(ParamikoSSHClient, self).__init__(hostname, port, username, password, key)
+    """
+    SSH client built on paramiko.
+
+    Each thread using the client opens an SFTP session (a channel of its
+    own) on first use and keeps it until L{close}, so threads sharing the
+    client, as L{GraphDeployment} steps do, upload side by side without
+    mixing up each other's replies.  The remote directories seen to exist
+    are shared, and created under a lock.
+
+    With C{compress=True}, the SSH transport compresses everything sent,
+    uploads included.
+    """
+    def __init__(self, hostname, port=22, username='root', password=None,
+                 key=None, timeout=None, compress=False):
+        super(ParamikoSSHClient, self).__init__(hostname, port, username,
+                                                password, key, timeout)
+        self.compress = compress
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self._sftp_lock = threading.RLock()
+        self._reset_sftp()
+
+    def _reset_sftp(self):
+        self._sftp_local = threading.local()
+        self._sftps = []
+        self._dirs = set()
 
     def connect(self):
         conninfo = {'hostname': self.hostname,
@@ -67,50 +297,535 @@ class ParamikoSSHClient(BaseSSHClient):
                     'password': self.password,
                     'allow_agent': False,
                     'look_for_keys': False}
+        if self.key is not None:
+            conninfo['key_filename'] = self.key
+        if self.compress:
+            conninfo['compress'] = True
+        if self.timeout is not None:
+            conninfo['timeout'] = self.timeout
         self.client.connect(**conninfo)
         return True
 
-    def put(self, path, contents=None, chmod=None):
-        sftp = self.client.open_sftp()
-        # less than ideal, but we need to mkdir stuff otherwise file() fails
+    def _get_sftp(self):
+        # paramiko's SFTPClient can't serve two threads at once: a reply
+        # read by one thread may belong to the other's request.
+        sftp = getattr(self._sftp_local, 'sftp', None)
+        if sftp is None:
+            sftp = self.client.open_sftp()
+            self._sftp_lock.acquire()
+            try:
+                self._sftps.append(sftp)
+            finally:
+                self._sftp_lock.release()
+            self._sftp_local.sftp = sftp
+        return sftp
+
+    def _ensure_dir(self, sftp, path):
+        self._sftp_lock.acquire()
+        try:
+            self._make_dirs(sftp, path)
+        finally:
+            self._sftp_lock.release()
+
+    def _make_dirs(self, sftp, path):
+        # Relative paths are relative to the login directory, as the
+        # session never chdirs.
+        if not path or path in self._dirs:
+            return
+        try:
+            sftp.stat(path)
+        except IOError:
+            parent = posixpath.dirname(path)
+            if parent != path:
+                self._make_dirs(sftp, parent)
+            try:
+                sftp.mkdir(path)
+            except IOError, e:
+                # so, there doens't seem to be a way to
+                # catch EEXIST consistently *sigh*
+                pass
+        self._dirs.add(path)
+
+    def put(self, path, contents=None, chmod=None, local_path=None,
+            progress=None):
+        if contents is None and local_path is None:
+            raise ValueError('put needs contents or local_path')
+        sftp = self._get_sftp()
         head, tail = psplit(path)
-        if path[0] == "/":
-            sftp.chdir("/")
-        for part in head.split("/"):
-            if part != "":
-                try:
-                    sftp.mkdir(part)
-                except IOError, e:
-                    # so, there doens't seem to be a way to 
-                    # catch EEXIST consistently *sigh*
-                    pass
-                sftp.chdir(part)
-        ak = sftp.file(tail,  mode='w')
-        ak.write(contents)
-        if chmod is not None:
-            ak.chmod(chmod)
-        ak.close()
-        sftp.close()
+        self._ensure_dir(sftp, head)
+
+        source = contents
+        if local_path is not None:
+            source = open(local_path, 'rb')
+        try:
+            ak = sftp.file(path, mode='w')
+            try:
+                if isinstance(source, basestring):
+                    ak.write(source)
+                    if progress is not None:
+                        progress(len(source), len(source), None)
+                else:
+                    # Don't wait for each write to be acknowledged
+                    ak.set_pipelined(True)
+                    copy_stream(source, ak.write, _source_size(source),
+                                progress)
+                if chmod is not None:
+                    ak.chmod(chmod)
+            finally:
+                ak.close()
+        finally:
+            if local_path is not None:
+                source.close()
 
     def delete(self, path):
-        sftp = self.client.open_sftp()
-        sftp.unlink(path)
-        sftp.close()
+        self._get_sftp().unlink(path)
 
-    def run(self, cmd):
-        stdin, stdout, stderr = self.client.exec_command(cmd)
-        stdin.close()
-        so = stdout.read()
-        se = stderr.read()
-        return [so, se]
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        stdout, write_stdout = _output(buffer_size, on_stdout)
+        stderr, write_stderr = _output(buffer_size, on_stderr)
+
+        chan = self.client.get_transport().open_session()
+        chan.exec_command(cmd)
+        chan.shutdown_write()
+        # Drain whichever stream has data, so a command filling one
+        # stream's window can't block while we wait on the other.
+        while True:
+            select.select([chan], [], [], 1)
+            while chan.recv_ready():
+                write_stdout(chan.recv(RUN_READ_SIZE))
+            while chan.recv_stderr_ready():
+                write_stderr(chan.recv_stderr(RUN_READ_SIZE))
+            if (chan.exit_status_ready() and not chan.recv_ready()
+                and not chan.recv_stderr_ready()):
+                break
+        status = chan.recv_exit_status()
+        chan.close()
+        return [stdout.getvalue(), stderr.getvalue(), status]
 
     def close(self):
+        self._sftp_lock.acquire()
+        try:
+            for sftp in self._sftps:
+                sftp.close()
+            self._reset_sftp()
+        finally:
+            self._sftp_lock.release()
         self.client.close()
 
 class ShellOutSSHClient(BaseSSHClient):
-    # TODO: write this one
-    pass
+    """
+    SSH client that shells out to the system C{ssh} binary.
+
+    L{connect} starts an OpenSSH ControlMaster in the background; every
+    later command goes through its socket, so a whole deployment costs a
+    single SSH handshake.  Files are streamed over a plain C{ssh} command
+    (C{cat > path}), which reuses the same socket, rather than C{scp}.
+
+    Authentication uses C{key} (a private key file) or the user's
+    ssh-agent, and C{password} if given: ssh can't read a password from a
+    pipe, so the master is started without a terminal and reads it from an
+    C{SSH_ASKPASS} helper.  That needs C{SSH_ASKPASS_REQUIRE}, from
+    OpenSSH 8.4 on; older versions raise C{IOError} for passwords.  The
+    password is only on disk, readable by its owner alone, until the master
+    has logged in.  Later commands never authenticate themselves.
+    """
+    ssh_binary = 'ssh'
+
+    # Seconds the master outlives its last use, should close() never run
+    control_persist = 60
+
+    def __init__(self, hostname, port=22, username='root', password=None,
+                 key=None, timeout=None):
+        super(ShellOutSSHClient, self).__init__(hostname, port, username,
+                                                password, key, timeout)
+        self.control_dir = None
+
+    def _ssh_args(self, *options):
+        # ssh keeps the first value given for each -o option, so options
+        # come first and override the defaults.
+        args = [self.ssh_binary] + list(options)
+        args.extend(['-p', str(self.port),
+                '-o', 'BatchMode=yes',
+                '-o', 'StrictHostKeyChecking=no',
+                '-o', 'UserKnownHostsFile=/dev/null',
+                '-o', 'ControlPath=%s'
+                    % os.path.join(self.control_dir, 'master')])
+        if self.key:
+            args.extend(['-i', self.key])
+        if self.timeout is not None:
+            args.extend(['-o', 'ConnectTimeout=%d' % max(1, self.timeout)])
+        args.append('%s@%s' % (self.username, self.hostname))
+        return args
+
+    def _ssh(self, cmd):
+        if self.control_dir is None:
+            raise IOError('Not connected')
+        return subprocess.Popen(self._ssh_args() + [cmd],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+    def _check_askpass(self):
+        # SSH_ASKPASS_REQUIRE=force is what makes ssh use the helper even
+        # where it could prompt on a terminal.
+        proc = subprocess.Popen([self.ssh_binary, '-V'],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        banner = proc.communicate()[0].strip()
+        match = re.match(r'OpenSSH_(\d+)\.(\d+)', banner)
+        if match is None or (int(match.group(1)),
+                             int(match.group(2))) < (8, 4):
+            raise IOError('ssh password logins need OpenSSH 8.4 or later, '
+                          'not %s' % (banner or self.ssh_binary))
+
+    def _askpass(self):
+        # Returns the environment and options making the master answer
+        # ssh's password prompt from SSH_ASKPASS, which reads the password
+        # from a file only its owner can read.
+        self._check_askpass()
+        password = os.path.join(self.control_dir, 'password')
+        fd = os.open(password, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        os.write(fd, self.password + '\n')
+        os.close(fd)
+        askpass = os.path.join(self.control_dir, 'askpass')
+        fp = open(askpass, 'w')
+        fp.write('#!/bin/sh\ncat %s\n' % pquote(password))
+        fp.close()
+        os.chmod(askpass, 0700)
+        env = dict(os.environ)
+        env.update({'SSH_ASKPASS': askpass,
+                    'SSH_ASKPASS_REQUIRE': 'force',
+                    'DISPLAY': env.get('DISPLAY', ':0')})
+        return env, ['-o', 'BatchMode=no', '-o', 'NumberOfPasswordPrompts=1']
+
+    def connect(self):
+        self.control_dir = tempfile.mkdtemp(prefix='libcloud-ssh-')
+        try:
+            env, options, preexec_fn = None, [], None
+            if self.password is not None:
+                env, options = self._askpass()
+                # Without a controlling terminal, ssh turns to SSH_ASKPASS
+                preexec_fn = os.setsid
+            options.extend(['-M', '-N', '-f',
+                            '-o', 'ControlPersist=%d' % self.control_persist])
+            # The master forks into the background once logged in, and
+            # the child may keep its output open, so that goes to a file
+            # rather than a pipe we'd wait on forever.
+            log = open(os.path.join(self.control_dir, 'master.log'), 'w+')
+            devnull = open(os.devnull)
+            try:
+                status = subprocess.Popen(
+                    self._ssh_args(*options),
+                    stdin=devnull, stdout=log, stderr=log,
+                    env=env, preexec_fn=preexec_fn).wait()
+                log.seek(0)
+                se = log.read()
+            finally:
+                devnull.close()
+                log.close()
+        except:
+            shutil.rmtree(self.control_dir, True)
+            self.control_dir = None
+            raise
+        for name in ('password', 'askpass'):
+            path = os.path.join(self.control_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        if status != 0:
+            shutil.rmtree(self.control_dir, True)
+            self.control_dir = None
+            raise IOError('ssh to %s failed: %s' % (self.hostname, se.strip()))
+        return True
+
+    def put(self, path, contents=None, chmod=None, local_path=None,
+            progress=None):
+        if contents is None and local_path is None:
+            raise ValueError('put needs contents or local_path')
+        head, tail = psplit(path)
+        cmd = 'cat > %s' % pquote(path)
+        if head:
+            cmd = 'mkdir -p %s && %s' % (pquote(head), cmd)
+        if chmod is not None:
+            cmd = '%s && chmod %o %s' % (cmd, chmod, pquote(path))
+
+        source = contents
+        if local_path is not None:
+            source = open(local_path, 'rb')
+        try:
+            proc = self._ssh(cmd)
+            if isinstance(source, basestring):
+                proc.stdin.write(source)
+            else:
+                copy_stream(source, proc.stdin.write, _source_size(source),
+                            progress)
+            proc.stdin.close()
+            se = proc.stderr.read()
+            proc.stdout.read()
+            if proc.wait() != 0:
+                raise IOError('put %s failed: %s' % (path, se.strip()))
+        finally:
+            if local_path is not None:
+                source.close()
+
+    def delete(self, path):
+        self.run('rm -f %s' % pquote(path))
+
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        stdout, write_stdout = _output(buffer_size, on_stdout)
+        stderr, write_stderr = _output(buffer_size, on_stderr)
+
+        proc = self._ssh(cmd)
+        proc.stdin.close()
+        writers = {proc.stdout.fileno(): write_stdout,
+                   proc.stderr.fileno(): write_stderr}
+        while writers:
+            ready = select.select(writers.keys(), [], [])[0]
+            for fd in ready:
+                data = os.read(fd, RUN_READ_SIZE)
+                if data:
+                    writers[fd](data)
+                else:
+                    del writers[fd]
+        status = proc.wait()
+        return [stdout.getvalue(), stderr.getvalue(), status]
+
+    def close(self):
+        if self.control_dir is None:
+            return
+        subprocess.Popen(self._ssh_args('-O', 'exit'),
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE).communicate()
+        shutil.rmtree(self.control_dir, True)
+        self.control_dir = None
 
 SSHClient = ParamikoSSHClient
 if not have_paramiko:
     SSHClient = ShellOutSSHClient
+
+class HostResult(object):
+    """
+    Outcome of running something on one host with L{ParallelSSHExecutor}.
+
+    @ivar node: The L{Node}
+    @ivar hostname: Address connected to, C{None} if the node had none
+    @ivar value: What the deployment returned, or C{[stdout, stderr,
+        exit_status]} for a command
+    @ivar deployment: This host's copy of the deployment, holding e.g. a
+        L{ScriptDeployment}'s output
+    @ivar error: The exception it failed with, or C{None}
+    @ivar elapsed: Seconds taken, connecting included
+    """
+
+    def __init__(self, node, hostname):
+        self.node = node
+        self.hostname = hostname
+        self.value = None
+        self.deployment = None
+        self.error = None
+        self.elapsed = None
+
+    def succeeded(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is not None:
+            return '<HostResult: %s failed: %s>' % (self.hostname, self.error)
+        return '<HostResult: %s ok in %.1fs>' % (self.hostname,
+                                                 self.elapsed or 0)
+
+class _StreamingClient(object):
+    # Wraps an SSH client so every command's output is also handed to
+    # on_output(hostname, stream, data).
+
+    def __init__(self, client, on_output):
+        self._client = client
+        self._on_output = on_output
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _tee(self, stream, callback):
+        hostname = self._client.hostname
+        on_output = self._on_output
+        def write(data):
+            on_output(hostname, stream, data)
+            if callback is not None:
+                callback(data)
+        return write
+
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        return self._client.run(cmd,
+                                on_stdout=self._tee('stdout', on_stdout),
+                                on_stderr=self._tee('stderr', on_stderr),
+                                buffer_size=buffer_size)
+
+class ParallelSSHExecutor(object):
+    """
+    Runs commands and deployments on many nodes at once, over SSH.
+
+    Each node is reached on its first public IP.  Connections are opened
+    on first use and kept for later calls until L{close}, so a series of
+    commands only connects to each host once.
+
+    >>> executor = ParallelSSHExecutor(nodes, key='id_rsa')  # doctest: +SKIP
+    >>> results = executor.run_command('uptime')  # doctest: +SKIP
+    >>> executor.close()  # doctest: +SKIP
+
+    Every call returns one L{HostResult} per node, in C{nodes} order; a host
+    failing, or timing out, does not affect the others.
+    """
+
+    def __init__(self, nodes, username='root', password=None, key=None,
+                 port=22, concurrency=DEFAULT_POOL_SIZE, connect_timeout=30,
+                 command_timeout=None, on_output=None, client_class=None):
+        """
+        @keyword    concurrency: Hosts worked on at once
+        @type       concurrency: C{int}
+
+        @keyword    connect_timeout: Seconds allowed to connect to a host
+        @type       connect_timeout: C{float}
+
+        @keyword    command_timeout: Seconds allowed for one call on one
+                                     host, or C{None} for no limit; the
+                                     host's connection is dropped when it
+                                     runs out
+        @type       command_timeout: C{float}
+
+        @keyword    on_output: Called as C{on_output(hostname, stream,
+                               data)}, C{stream} being C{'stdout'} or
+                               C{'stderr'}, as output arrives from any
+                               host
+        @type       on_output: C{callable}
+
+        @keyword    client_class: SSH client to use (default: L{SSHClient})
+        @type       client_class: C{class}
+        """
+        self.nodes = list(nodes)
+        self.username = username
+        self.password = password
+        self.key = key
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.on_output = on_output
+        self.client_class = client_class
+        self.pool = WorkerPool(concurrency)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, hostname):
+        self._lock.acquire()
+        try:
+            client = self._clients.get(hostname)
+        finally:
+            self._lock.release()
+        if client is not None:
+            return client
+        client_class = self.client_class or SSHClient
+        client = client_class(hostname=hostname, port=self.port,
+                              username=self.username,
+                              password=self.password, key=self.key,
+                              timeout=self.connect_timeout)
+        client.connect()
+        self._lock.acquire()
+        try:
+            self._clients[hostname] = client
+        finally:
+            self._lock.release()
+        return client
+
+    def _drop(self, hostname):
+        self._lock.acquire()
+        try:
+            client = self._clients.pop(hostname, None)
+        finally:
+            self._lock.release()
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _run_on(self, node, func):
+        hostname = None
+        if node.public_ip:
+            hostname = node.public_ip[0]
+        result = HostResult(node, hostname)
+        start = time.time()
+        timer = None
+        timed_out = []
+        try:
+            if hostname is None:
+                raise Exception("Node %s has no public IP" % node.id)
+            client = self._client(hostname)
+            if self.command_timeout is not None:
+                # A blocked read can't be interrupted; closing the
+                # connection under it makes it return.
+                def expire():
+                    timed_out.append(True)
+                    self._drop(hostname)
+                timer = threading.Timer(self.command_timeout, expire)
+                timer.setDaemon(True)
+                timer.start()
+            if self.on_output is not None:
+                client = _StreamingClient(client, self.on_output)
+            result.value = func(node, client, result)
+        except Exception, e:
+            result.error = e
+        if timer is not None:
+            timer.cancel()
+        if timed_out:
+            result.value = None
+            result.error = Exception("Timed out after %s seconds on %s"
+                                     % (self.command_timeout, hostname))
+        if result.error is not None and hostname is not None:
+            # Whatever state the connection is in, don't reuse it.
+            self._drop(hostname)
+        result.elapsed = time.time() - start
+        return result
+
+    def _map(self, func):
+        return self.pool.map(lambda node: self._run_on(node, func),
+                             self.nodes)
+
+    def run(self, deployment):
+        """
+        Run a L{Deployment} on every node.
+
+        Each host runs its own copy of C{deployment}, found in
+        L{HostResult.deployment} afterwards.
+
+        @return: C{list} of L{HostResult}
+        """
+        def deploy(node, client, result):
+            result.deployment = copy.deepcopy(deployment)
+            return result.deployment.run(node, client)
+        return self._map(deploy)
+
+    def run_command(self, cmd, buffer_size=None):
+        """
+        Run a shell command on every node.
+
+        A non-zero exit status is not an error; check C{value[2]}.
+
+        @keyword    buffer_size: See L{BaseSSHClient.run}
+        @type       buffer_size: C{int}
+
+        @return: C{list} of L{HostResult}, with C{[stdout, stderr,
+                 exit_status]} as each one's C{value}
+        """
+        def command(node, client, result):
+            return client.run(cmd, buffer_size=buffer_size)
+        return self._map(command)
+
+    def close(self):
+        """
+        Close every connection held.
+        """
+        self._lock.acquire()
+        try:
+            hostnames = self._clients.keys()
+        finally:
+            self._lock.release()
+        for hostname in hostnames:
+            self._drop(hostname)
@@ -70,3 +70,15 @@ class InvalidCredsException(Exception):
         self.value = value
     def __str__(self):
         return repr(self.value)
+
+class DeploymentException(Exception):
+    """
+    Exception used when steps of a deployment failed.
+
+    @ivar report: C{dict} describing each step, see L{GraphDeployment}
+    """
+    def __init__(self, value, report=None):
+        self.value = value
+        self.report = report or {}
+    def __str__(self):
+        return repr(self.value)
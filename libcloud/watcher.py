@@ -0,0 +1,235 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provides a watcher that waits on the state of many nodes at once
+"""
+import httplib
+import socket
+import threading
+import time
+
+from libcloud.types import NodeState
+from libcloud.pool import Future
+from libcloud.inventory import fingerprint
+
+DEFAULT_WATCH_TIMEOUT = 60 * 15
+
+# Request errors worth trying again on the next tick; any other error fails
+# the watches it was fetching for.
+TRANSIENT_ERRORS = (IOError, socket.error, httplib.HTTPException)
+
+
+def is_running(node):
+    """
+    Default L{StateWatcher} predicate: running, with a public IP.
+    """
+    return node.state == NodeState.RUNNING and bool(node.public_ip)
+
+
+class _Watch(object):
+
+    def __init__(self, node_id, predicate, timeout):
+        self.node_id = node_id
+        self.predicate = predicate
+        self.deadline = time.time() + timeout
+        self.future = Future()
+        self.fingerprint = None
+
+
+class StateWatcher(object):
+    """
+    Waits for nodes of one driver to reach a state, with a single request
+    per tick however many nodes are watched.
+
+    Each tick fetches every watched node with one C{get_nodes} call, or
+    one C{list_nodes} call if the driver's C{get_nodes} is not batched.
+    Ticks start C{min_interval} apart, and back off by C{backoff} up to
+    C{max_interval} while none of the watched nodes change.
+
+    A tick failing with one of L{TRANSIENT_ERRORS} is retried on the next
+    one, and the last such error is named if a watch times out; any other
+    error, such as bad credentials, fails the watches at once.
+
+    The polling thread exits when nothing is left to watch.
+    """
+
+    min_interval = 1
+    max_interval = 30
+    backoff = 1.5
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.interval = self.min_interval
+        self.ticks = 0
+        self._watches = []
+        self._next_tick = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._last_error = None
+
+    def watch(self, node, predicate=is_running,
+              timeout=DEFAULT_WATCH_TIMEOUT):
+        """
+        Start watching a node.
+
+        Ticks where the node is not listed at all are not an error, as
+        new nodes can take a while to show up; it is waited for until
+        C{timeout}.
+
+        @param      node: The L{Node} to watch
+        @type       node: L{Node}
+
+        @keyword    predicate: Called with each fresh copy of the node,
+                               returns C{True} once it is in the wanted
+                               state (default: L{is_running})
+        @type       predicate: C{callable}
+
+        @keyword    timeout: Seconds to wait before giving up
+        @type       timeout: C{float}
+
+        @return: L{Future} resolving to the fresh L{Node} that satisfied
+                 C{predicate}
+        """
+        return self.watch_all([node], predicate, timeout)[0]
+
+    def watch_all(self, nodes, predicate=is_running,
+                  timeout=DEFAULT_WATCH_TIMEOUT):
+        """
+        Start watching several nodes at once, as with L{watch}.
+
+        All of them are registered together, so the next tick already
+        fetches every one of them.
+
+        @return: C{list} of L{Future}, one per node
+        """
+        watches = [_Watch(node.id, predicate, timeout) for node in nodes]
+        self._cond.acquire()
+        try:
+            self._watches.extend(watches)
+            self.interval = self.min_interval
+            self._next_tick = min(self._next_tick,
+                                  time.time() + self.min_interval)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        return [watch.future for watch in watches]
+
+    def _run(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while True:
+                    if not self._watches:
+                        self._thread = None
+                        self._next_tick = 0
+                        return
+                    now = time.time()
+                    if now >= self._next_tick:
+                        watches = list(self._watches)
+                        break
+                    self._cond.wait(self._next_tick - now)
+            finally:
+                self._cond.release()
+
+            try:
+                found = self._fetch(watches)
+                self._last_error = None
+            except TRANSIENT_ERRORS, e:
+                # Treat it like a tick where nothing changed, and let the
+                # deadlines decide when to give up.
+                found = {}
+                self._last_error = e
+            except Exception, e:
+                found = None
+                self._last_error = e
+            self.ticks += 1
+
+            if found is None:
+                changed, finished = False, watches
+                for watch in watches:
+                    watch.future.set_exception(self._last_error)
+            else:
+                changed, finished = self._update(watches, found,
+                                                 time.time())
+
+            self._cond.acquire()
+            try:
+                for watch in finished:
+                    self._watches.remove(watch)
+                if changed:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * self.backoff,
+                                        self.max_interval)
+                self._next_tick = time.time() + self.interval
+            finally:
+                self._cond.release()
+
+    def _fetch(self, watches):
+        ids = []
+        for watch in watches:
+            if watch.node_id not in ids:
+                ids.append(watch.node_id)
+        if len(ids) == 1 or self.driver.get_nodes_is_batched:
+            nodes = self.driver.get_nodes(ids)
+        else:
+            nodes = self.driver.list_nodes()
+        found = {}
+        for node in nodes:
+            found.setdefault(node.id, []).append(node)
+        return found
+
+    def _update(self, watches, found, now):
+        # Returns (whether any node changed, watches that are finished).
+        changed = False
+        finished = []
+        for watch in watches:
+            matches = found.get(watch.node_id, [])
+            if len(matches) > 1:
+                watch.future.set_exception(
+                    Exception("Watched single node[%s], but multiple nodes "
+                              "have same id" % watch.node_id))
+                finished.append(watch)
+                continue
+            node = None
+            if matches:
+                node = matches[0]
+            if node is not None:
+                current = fingerprint(node)
+                if current != watch.fingerprint:
+                    watch.fingerprint = current
+                    changed = True
+                try:
+                    ready = watch.predicate(node)
+                except Exception, e:
+                    watch.future.set_exception(e)
+                    finished.append(watch)
+                    continue
+                if ready:
+                    watch.future.set_result(node)
+                    finished.append(watch)
+                    continue
+            if now >= watch.deadline:
+                message = "Timeout while waiting for node %s." % watch.node_id
+                if self._last_error is not None:
+                    message = "%s Last error: %s" % (message, self._last_error)
+                watch.future.set_exception(Exception(message))
+                finished.append(watch)
+        return changed, finished
@@ -113,6 +113,9 @@ class MockHttp(object):
         parsed = urlparse.urlparse(url)
         scheme, netloc, path, params, query, fragment = parsed
         qs = parse_qs(query)
+        if method == 'POST' and body and not qs:
+            # form encoded POST bodies carry the query instead of the URL
+            qs = parse_qs(body)
         if path.endswith('/'):
             path = path[:-1]
         meth_name = path.replace('/','_').replace('.', '_').replace('-','_')
@@ -13,8 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import sys
+import socket
+import threading
+import time
 import unittest
 
+import libcloud.base
 from libcloud.providers import DRIVERS, get_driver
 from libcloud.types import InvalidCredsException, Provider
 from libcloud.interface import INodeDriver
@@ -24,13 +28,97 @@ from zope.interface.exceptions import BrokenImplementation
 from libcloud.interface import IResponse, INode, INodeSize, INodeImage, INodeDriver
 from libcloud.interface import IConnectionKey, IConnectionUserAndKey
 from libcloud.base import Response, Node, NodeSize, NodeImage, NodeDriver
-from libcloud.base import ConnectionKey, ConnectionUserAndKey
+from libcloud.base import ConnectionKey, ConnectionUserAndKey, NodeCollection
+from libcloud.types import NodeState
+from libcloud.pool import WorkerPool, Future
 
 from test import MockResponse
+from test.test_ssh import BannerServer
 
 class FakeDriver(object):
     type = 0 
 
+class FakeSSHClient(object):
+    """
+    Refuses the connection for each 'refused' placeholder in C{connects}.
+    """
+    connects = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def connect(self):
+        refused = 'refused' in FakeSSHClient.connects
+        if refused:
+            FakeSSHClient.connects.remove('refused')
+        FakeSSHClient.connects.append(self.kwargs)
+        if refused:
+            raise socket.error('not yet')
+        return True
+
+    def close(self):
+        pass
+
+class BootingDriver(NodeDriver):
+    """
+    Nodes boot straight away, at 127.0.0.1.
+    """
+    type = 0
+    features = {'create_node': ['password']}
+
+    def __init__(self, *args, **kwargs):
+        NodeDriver.__init__(self, *args, **kwargs)
+        self.created = []
+        self.destroyed = []
+        self.hold = {}
+
+    def create_node(self, **kwargs):
+        # Creating a node named in hold waits for that event first
+        if kwargs['name'] in self.hold:
+            self.hold[kwargs['name']].wait(5)
+        self.created.append(kwargs['name'])
+        return Node(id=kwargs['name'], name=kwargs['name'],
+                    state=NodeState.PENDING, public_ip=[], private_ip=[],
+                    driver=self)
+
+    def get_nodes(self, node_ids):
+        return [Node(id=i, name=i, state=NodeState.RUNNING,
+                     public_ip=['127.0.0.1'], private_ip=[], driver=self)
+                for i in node_ids]
+
+    def destroy_node(self, node):
+        self.destroyed.append(node.id)
+        return True
+
+class RecordingDeployment(object):
+    """
+    Fails the first C{times} runs (all, if negative) on nodes named in
+    C{fail}; tracks how many run at once.
+    """
+
+    def __init__(self, fail=(), times=-1):
+        self.fail = dict([(name, times) for name in fail])
+        self.failed = threading.Event()
+        self.lock = threading.Lock()
+        self.running = self.peak = 0
+
+    def run(self, node, client):
+        self.lock.acquire()
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        fail = self.fail.get(node.name, 0)
+        if fail:
+            self.fail[node.name] = fail - 1
+        self.lock.release()
+        time.sleep(0.01)
+        self.lock.acquire()
+        self.running -= 1
+        self.lock.release()
+        if fail:
+            self.failed.set()
+            raise Exception('deployment failed on %s' % node.name)
+        return node
+
 class BaseTests(unittest.TestCase):
 
     def test_base_node(self):
@@ -63,6 +151,164 @@ class BaseTests(unittest.TestCase):
         conn = ConnectionUserAndKey('foo', 'bar')
         verifyObject(IConnectionUserAndKey, conn)
 
+    def test_node_collection_lookups(self):
+        driver = FakeDriver()
+        a = Node(id='a', name='web', state=NodeState.RUNNING,
+                 public_ip=['1.2.3.4'], private_ip=['10.0.0.1'], driver=driver)
+        b = Node(id='b', name='web', state=NodeState.PENDING,
+                 public_ip=['1.2.3.5'], private_ip=[], driver=driver)
+        nodes = NodeCollection([a, b])
+        self.assertTrue(isinstance(nodes, list))
+        self.assertEqual(nodes.by_uuid(b.uuid), b)
+        self.assertEqual(nodes.by_id('a'), a)
+        self.assertEqual(nodes.by_ip('10.0.0.1'), a)
+        self.assertEqual(nodes.by_ip('9.9.9.9'), None)
+        self.assertEqual(nodes.by_name('web'), [a, b])
+        self.assertEqual(nodes.where(state=NodeState.PENDING), [b])
+
+    def test_get_nodes_falls_back_to_list_nodes(self):
+        class ListOnlyDriver(NodeDriver):
+            type = 0
+            def list_nodes(self):
+                return [Node(id=i, name=i, state=0, public_ip=[],
+                             private_ip=[], driver=self)
+                        for i in ('a', 'b', 'c')]
+        driver = ListOnlyDriver('foo')
+        self.assertEqual([n.id for n in driver.get_nodes(['c', 'x', 'a'])],
+                         ['c', 'a'])
+        self.assertEqual(driver.get_node('b').id, 'b')
+        self.assertEqual(driver.get_node('x'), None)
+
+    def test_bulk_operations(self):
+        class FlakyDriver(NodeDriver):
+            type = 0
+            def destroy_node(self, node):
+                if node.id == 'bad':
+                    raise Exception('cannot destroy %s' % node.id)
+                return True
+            def create_node(self, **kwargs):
+                return Node(id=kwargs['name'], name=kwargs['name'], state=0,
+                            public_ip=[], private_ip=[], driver=self,
+                            extra={'size': kwargs.get('size')})
+        driver = FlakyDriver('foo')
+        nodes = [Node(id=i, name=i, state=0, public_ip=[], private_ip=[],
+                      driver=driver) for i in ('a', 'bad', 'c')]
+        ret = driver.destroy_nodes(nodes, concurrency=2)
+        self.assertEqual(ret[0], True)
+        self.assertTrue(isinstance(ret[1], Exception))
+        self.assertEqual(ret[2], True)
+
+        created = driver.create_nodes(3, name='web', size=1)
+        self.assertEqual([n.name for n in created], ['web-1', 'web-2', 'web-3'])
+        created = driver.create_nodes([{'name': 'x'}, {'name': 'y', 'size': 2}],
+                                      size=1)
+        self.assertEqual([n.extra['size'] for n in created], [1, 2])
+
+    def setUp(self):
+        self.server = BannerServer()
+        self.server.start()
+        FakeSSHClient.connects = []
+        self.original_client = libcloud.base.SSHClient
+        libcloud.base.SSHClient = FakeSSHClient
+
+    def tearDown(self):
+        libcloud.base.SSHClient = self.original_client
+        self.server.close()
+
+    def test_deploy_node(self):
+        FakeSSHClient.connects = ['refused']
+        node = BootingDriver('foo').deploy_node(name='a',
+                                                deploy=RecordingDeployment(),
+                                                ssh_port=self.server.port)
+        self.assertEqual(len(FakeSSHClient.connects), 2)
+        self.assertEqual(FakeSSHClient.connects[1]['port'], self.server.port)
+        self.assertEqual(sorted(node.extra['deploy_timings'].keys()),
+                         ['api_running', 'deployment', 'port_open',
+                          'ssh_authenticated'])
+
+    def test_deploy_nodes(self):
+        driver = BootingDriver('foo')
+        deploy = RecordingDeployment(fail=['web-2'])
+        ret = driver.deploy_nodes(4, deploy, name='web', deploy_concurrency=1,
+                                  ssh_port=self.server.port)
+        self.assertEqual([getattr(n, 'name', None) for n in ret],
+                         ['web-1', None, 'web-3', 'web-4'])
+        self.assertTrue(isinstance(ret[1], Exception))
+        self.assertEqual(deploy.peak, 1)
+        self.assertTrue('deploy_timings' in ret[0].extra)
+
+    def test_deploy_nodes_replace(self):
+        driver = BootingDriver('foo')
+        deploy = RecordingDeployment(fail=['web-2'], times=1)
+        ret = driver.deploy_nodes(3, deploy, name='web', policy='replace',
+                                  ssh_port=self.server.port)
+        self.assertEqual([n.name for n in ret], ['web-1', 'web-2', 'web-3'])
+        self.assertEqual(len(driver.created), 4)
+        self.assertEqual(driver.destroyed, ['web-2'])
+
+    def test_deploy_nodes_abort(self):
+        driver = BootingDriver('foo')
+        deploy = RecordingDeployment(fail=['web-1'])
+        driver.hold['web-2'] = deploy.failed
+        ret = driver.deploy_nodes(2, deploy, name='web', policy='abort',
+                                  ssh_port=self.server.port)
+        self.assertTrue(isinstance(ret[0], Exception))
+        self.assertTrue('aborted' in str(ret[1]))
+        self.assertEqual(driver.created, ['web-1', 'web-2'])
+        self.assertRaises(ValueError, driver.deploy_nodes, 1, deploy,
+                          policy='retry')
+
+    def test_worker_pool_limits(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+        def work(i):
+            lock.acquire()
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            lock.release()
+            time.sleep(0.01)
+            lock.acquire()
+            state['running'] -= 1
+            lock.release()
+            return i
+        self.assertEqual(WorkerPool(size=3).map(work, range(10)), range(10))
+        self.assertTrue(state['peak'] <= 3)
+        start = time.time()
+        WorkerPool(size=4, rate_limit=0.02).map(lambda i: i, range(4))
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_future(self):
+        future = Future()
+        seen = []
+        future.add_done_callback(seen.append)
+        self.assertFalse(future.done())
+        self.assertRaises(Exception, future.result, 0.01)
+        threading.Timer(0.01, future.set_result, [5]).start()
+        self.assertEqual(future.result(1), 5)
+        self.assertEqual(seen, [future])
+        self.assertRaises(Exception, future.set_result, 6)
+
+        failed = Future()
+        failed.set_exception(ValueError('boom'))
+        self.assertRaises(ValueError, failed.result)
+        self.assertTrue(isinstance(failed.exception(), ValueError))
+        failed.add_done_callback(seen.append)
+        self.assertEqual(seen, [future, failed])
+
+    def test_node_collection_reindexes_on_change(self):
+        driver = FakeDriver()
+        a = Node(id='a', name='a', state=0, public_ip=None, private_ip=None,
+                 driver=driver)
+        b = Node(id='b', name='b', state=0, public_ip='1.2.3.4',
+                 private_ip=None, driver=driver)
+        nodes = NodeCollection([a])
+        self.assertEqual(nodes.by_id('b'), None)
+        nodes.append(b)
+        self.assertEqual(nodes.by_id('b'), b)
+        self.assertEqual(nodes.by_ip('1.2.3.4'), b)
+        nodes.remove(a)
+        self.assertEqual(nodes.by_uuid(a.uuid), None)
+
 #    def test_drivers_interface(self):
 #        failures = []
 #        for driver in DRIVERS:
@@ -0,0 +1,358 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import StringIO
+import hashlib
+import os
+import random
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from libcloud.deployment import Deployment, FileDeployment, ScriptDeployment
+from libcloud.deployment import GraphDeployment, MultiStepDeployment
+from libcloud.deployment import SSHKeyDeployment, remote_checksums
+from libcloud.deployment import SyncDeployment, compute_delta
+from libcloud.deployment import userdata_script, personality_files
+from libcloud import deployment
+from libcloud.types import DeploymentException
+
+class RecordingSSHClient(object):
+    """
+    Records the keyword arguments of every put and the commands run,
+    keeping string contents as remote C{files} for C{sha256sum}.
+    """
+
+    def __init__(self, status=2):
+        self.puts = []
+        self.commands = []
+        self.files = {}
+        self.status = status
+
+    def put(self, path, **kwargs):
+        kwargs['path'] = path
+        self.puts.append(kwargs)
+        contents = kwargs.get('contents')
+        if kwargs.get('local_path'):
+            contents = open(kwargs['local_path'], 'rb').read()
+        if isinstance(contents, str):
+            self.files[path] = contents
+
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        self.commands.append(cmd)
+        if cmd.startswith('sha256sum '):
+            lines = ['%s  %s' % (hashlib.sha256(self.files[p]).hexdigest(), p)
+                     for p in cmd.split()[1:-2] if p in self.files]
+            return [''.join([l + '\n' for l in lines]), '', 0]
+        if on_stdout is not None:
+            on_stdout('building\n')
+        return ['building\n'[-(buffer_size or 9):], '', self.status]
+
+class LocalSSHClient(object):
+    """
+    Client acting on a local directory standing in for the node's home.
+    """
+
+    def __init__(self, home):
+        self.home = home
+
+    def put(self, path, contents=None, chmod=None, local_path=None,
+            progress=None):
+        path = os.path.join(self.home, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if local_path is not None:
+            contents = open(local_path, 'rb').read()
+        f = open(path, 'wb')
+        f.write(contents)
+        f.close()
+
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        proc = subprocess.Popen(['sh', '-c', cmd], cwd=self.home,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        return [stdout, stderr, proc.returncode]
+
+def _tree(root):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            files[os.path.relpath(full, root)] = open(full, 'rb').read()
+    return files
+
+class TimedStep(Deployment):
+    """
+    Step sleeping for C{seconds}, recording the order steps ran in and how
+    many ran at once.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, log, seconds=0.1, fail=False):
+        self.log = log
+        self.seconds = seconds
+        self.fail = fail
+
+    def run(self, node, client):
+        TimedStep.lock.acquire()
+        self.log['running'] += 1
+        self.log['peak'] = max(self.log['peak'], self.log['running'])
+        self.log['order'].append(self)
+        TimedStep.lock.release()
+        time.sleep(self.seconds)
+        TimedStep.lock.acquire()
+        self.log['running'] -= 1
+        TimedStep.lock.release()
+        if self.fail:
+            raise IOError('step failed')
+        return node
+
+def _log():
+    return {'running': 0, 'peak': 0, 'order': []}
+
+class DeploymentTests(unittest.TestCase):
+
+    def test_file_deployment(self):
+        client = RecordingSSHClient()
+        local = tempfile.NamedTemporaryFile()
+        FileDeployment(local.name, '/opt/app.tar.gz').run(None, client)
+        source = StringIO.StringIO('data')
+        FileDeployment(source, '/opt/data', chmod=0600).run(None, client)
+        self.assertEqual(client.puts[0]['local_path'], local.name)
+        self.assertEqual(client.puts[0]['path'], '/opt/app.tar.gz')
+        self.assertEqual(client.puts[1]['contents'], source)
+        self.assertEqual(client.puts[1]['chmod'], 0600)
+
+    def test_script_deployment(self):
+        client = RecordingSSHClient()
+        seen = []
+        script = ScriptDeployment('make', name='/root/build.sh',
+                                  on_stdout=seen.append, max_output=4)
+        script.run(None, client)
+        self.assertEqual(client.puts[0]['chmod'], 0755)
+        self.assertEqual(client.commands[-1], '/root/build.sh')
+        self.assertEqual(seen, ['building\n'])
+        self.assertEqual(script.stdout, 'ing\n')
+        self.assertEqual(script.exit_status, 2)
+
+    def test_remote_checksums(self):
+        client = RecordingSSHClient()
+        client.files['a'] = 'x'
+        self.assertEqual(remote_checksums(client, []), {})
+        self.assertEqual(remote_checksums(client, ['a', 'b']),
+                         {'a': hashlib.sha256('x').hexdigest()})
+        self.assertEqual(client.commands, ['sha256sum a b 2>/dev/null; true'])
+
+    def test_unchanged_steps_skipped(self):
+        local = tempfile.NamedTemporaryFile()
+        local.write('conf')
+        local.flush()
+        client = RecordingSSHClient(status=0)
+
+        def deployment(force=False):
+            return MultiStepDeployment([
+                SSHKeyDeployment('ssh-rsa AAA'),
+                FileDeployment(local.name, 'app.conf', force=force),
+                ScriptDeployment('make', name='build.sh')])
+
+        first = deployment()
+        first.run(None, client)
+        self.assertEqual(first.unchanged_steps(), [])
+        self.assertEqual(client.files['build.sh.sha256'],
+                         hashlib.sha256('make').hexdigest() + '\n')
+
+        client.puts, client.commands = [], []
+        second = deployment(force=True)
+        second.run(None, client)
+        # One checksum command for all the steps; only the forced one runs
+        self.assertEqual(len(client.commands), 1)
+        self.assertEqual([p['path'] for p in client.puts], ['app.conf'])
+        self.assertEqual(second.unchanged_steps(),
+                         [second.steps[0], second.steps[2]])
+
+        # A changed script runs again
+        client.puts, client.commands = [], []
+        third = ScriptDeployment('make install', name='build.sh')
+        third.run(None, client)
+        self.assertFalse(third.unchanged)
+        self.assertEqual(client.commands[1], 'build.sh')
+
+    def test_compute_delta(self):
+        rand = random.Random(1)
+        old = ''.join([chr(rand.randrange(256)) for i in range(4096)])
+        new = old[:1000] + 'inserted' + old[1000:3000] + old[3100:]
+        # Signatures as SYNC_HELPER computes them
+        signatures = []
+        for i in range(0, len(old), 256):
+            block = bytearray(old[i:i + 256])
+            a = sum(block) & 0xffff
+            b = sum([(256 - j) * x for j, x in enumerate(block)]) & 0xffff
+            signatures.append(((b << 16) | a,
+                               hashlib.md5(old[i:i + 256]).hexdigest()))
+        delta = compute_delta(new, signatures, 256)
+        self.assertTrue(len(delta) < 1000)
+        self.assertEqual(compute_delta(old, [], 256)[5:], old)
+
+        # Streamed, with literals sent on in pieces
+        pieces = []
+        old_literal_size = deployment.DELTA_LITERAL_SIZE
+        deployment.DELTA_LITERAL_SIZE = 1000
+        try:
+            self.assertEqual(compute_delta(StringIO.StringIO(new), signatures,
+                                           256, pieces.append), None)
+            literal = compute_delta(StringIO.StringIO(old), [], 256)
+        finally:
+            deployment.DELTA_LITERAL_SIZE = old_literal_size
+        self.assertEqual(''.join(pieces), delta)
+        self.assertEqual(literal[:5], 'L' + struct.pack('>I', 1000))
+        # The last piece takes the window along with it
+        self.assertEqual(len(literal), len(old) + 4 * 5)
+
+    def test_sync_deployment(self):
+        source = tempfile.mkdtemp()
+        home = tempfile.mkdtemp()
+        try:
+            rand = random.Random(2)
+            os.makedirs(os.path.join(source, 'lib', 'pkg'))
+            for i in range(30):
+                open(os.path.join(source, 'lib', 'pkg', 'm%d.py' % i),
+                     'wb').write('x = %d\n' % i)
+            big = ''.join([chr(rand.randrange(256))
+                           for i in range(200 * 1024)])
+            open(os.path.join(source, 'big.bin'), 'wb').write(big)
+            open(os.path.join(source, 'old.txt'), 'wb').write('old')
+
+            client = LocalSSHClient(home)
+            target = os.path.join(home, 'app')
+            sync = SyncDeployment(source, 'app', delete=True)
+            sync.python_binary = sys.executable
+            sync.run(None, client)
+            self.assertEqual(_tree(target), _tree(source))
+            self.assertEqual(sync.stats['uploaded'], 32)
+            full = sync.stats['total_bytes']
+
+            # Small edit to the big file, one changed and one removed file
+            big = big[:5000] + 'patched' + big[5007:]
+            open(os.path.join(source, 'big.bin'), 'wb').write(big)
+            open(os.path.join(source, 'lib', 'pkg', 'm3.py'),
+                 'wb').write('x = 333\n')
+            os.remove(os.path.join(source, 'old.txt'))
+            os.utime(os.path.join(source, 'big.bin'), (1, 1))
+            os.utime(os.path.join(source, 'lib', 'pkg', 'm3.py'), (1, 1))
+            sync.run(None, client)
+            self.assertEqual(_tree(target), _tree(source))
+            self.assertEqual((sync.stats['patched'], sync.stats['uploaded'],
+                              sync.stats['deleted']), (1, 1, 1))
+            self.assertTrue(sync.stats['bytes_sent'] < full / 10)
+
+            # A size change sends the file whole
+            big = big[:5000] + 'inserted' + big[5000:]
+            open(os.path.join(source, 'big.bin'), 'wb').write(big)
+            sync.run(None, client)
+            self.assertEqual(_tree(target), _tree(source))
+            self.assertEqual((sync.stats['patched'], sync.stats['uploaded']),
+                             (0, 1))
+
+            # Touched but identical content only fixes the mtime
+            os.utime(os.path.join(source, 'lib', 'pkg', 'm4.py'), (2, 2))
+            sync.run(None, client)
+            self.assertEqual(sync.stats['touched'], 1)
+            sync.run(None, client)
+            self.assertTrue(sync.unchanged)
+            self.assertEqual(sync.stats['bytes_sent'], 0)
+        finally:
+            shutil.rmtree(source)
+            shutil.rmtree(home)
+
+    def test_userdata_script(self):
+        home = tempfile.mkdtemp()
+        old_home = deployment.BOOT_HOME
+        deployment.BOOT_HOME = home
+        try:
+            steps = MultiStepDeployment([
+                SSHKeyDeployment('ssh-rsa AAA'),
+                ScriptDeployment('#!/bin/sh\necho built > out; exit 4',
+                                 name='build.sh', delete=True),
+                ScriptDeployment('#!/bin/sh\nexit 5', name='b.sh')])
+            actions = steps.boot_actions()
+            self.assertEqual(personality_files(actions), None)
+            self.assertEqual(personality_files(actions[:1]),
+                             {home + '/.ssh/authorized_keys': 'ssh-rsa AAA'})
+            script = userdata_script(actions, 'abc')
+            # Run it, with the console and log redirected
+            console = os.path.join(home, 'console')
+            script = script.replace('/dev/console', console)
+            script = script.replace('/var/log/libcloud-deploy.log',
+                                    os.path.join(home, 'log'))
+            subprocess.call(['sh', '-c', script])
+            self.assertEqual(open(console).read(), 'libcloud-deploy-abc 4\n')
+            self.assertEqual(_tree(home)['out'], 'built\n')
+            self.assertEqual(_tree(home)['.ssh/authorized_keys'],
+                             'ssh-rsa AAA')
+            self.assertFalse(os.path.exists(os.path.join(home, 'build.sh')))
+        finally:
+            deployment.BOOT_HOME = old_home
+            shutil.rmtree(home)
+
+    def test_graph_deployment(self):
+        log = _log()
+        keys, config, install = (TimedStep(log), TimedStep(log),
+                                 TimedStep(log, 0))
+        graph = GraphDeployment()
+        graph.add('install', install, requires=['keys', 'config'])
+        graph.add('keys', keys)
+        graph.add('config', config)
+        self.assertEqual(graph.run('node', None), 'node')
+        self.assertEqual(log['peak'], 2)
+        self.assertEqual(log['order'][-1], install)
+        report = graph.report
+        self.assertEqual(report['install']['status'], 'ok')
+        self.assertTrue(report['install']['start'] >=
+                        report['keys']['elapsed'])
+
+    def test_graph_deployment_failure(self):
+        log = _log()
+        graph = GraphDeployment(concurrency=1)
+        graph.add('keys', TimedStep(log, 0, fail=True))
+        graph.add('config', TimedStep(log, 0))
+        graph.add('install', TimedStep(log, 0), requires=['keys'])
+        graph.add('start', TimedStep(log, 0), requires=['install'])
+        try:
+            graph.run(None, None)
+        except DeploymentException, e:
+            self.assertEqual(e.report['keys']['status'], 'failed')
+            self.assertTrue(isinstance(e.report['keys']['error'], IOError))
+            self.assertEqual(e.report['config']['status'], 'ok')
+            self.assertEqual(e.report['install']['status'], 'skipped')
+            self.assertEqual(e.report['start']['status'], 'skipped')
+        else:
+            self.fail('DeploymentException not raised')
+        self.assertEqual(log['peak'], 1)
+
+    def test_graph_deployment_invalid(self):
+        graph = GraphDeployment()
+        graph.add('a', TimedStep(_log()), requires=['b'])
+        self.assertRaises(ValueError, graph.run, None, None)
+        graph.add('b', TimedStep(_log()), requires=['a'])
+        self.assertRaises(ValueError, graph.run, None, None)
+        self.assertRaises(ValueError, graph.add, 'a', None)
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
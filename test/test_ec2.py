@@ -15,13 +15,18 @@
 import sys
 import unittest
 
-from libcloud.drivers.ec2 import EC2NodeDriver
+from libcloud.drivers.ec2 import EC2NodeDriver, NAMESPACE
 from libcloud.base import Node, NodeImage, NodeSize
+from libcloud.deployment import ScriptDeployment
 
 from test import MockHttp, TestCaseMixin
 from test.file_fixtures import FileFixtures
 
+import base64
 import httplib
+import re
+from urllib2 import urlparse
+from cgi import parse_qs
 
 from secrets import EC2_ACCESS_ID, EC2_SECRET
 
@@ -40,10 +45,79 @@ class EC2Tests(unittest.TestCase, TestCaseMixin):
         node = self.driver.create_node(name='foo', image=image, size=size)
         self.assertEqual(node.id, 'i-2ba64342')
 
+    def test_create_nodes(self):
+        image = NodeImage(id='ami-be3adfd7', name=None, driver=self.driver)
+        size = NodeSize('m1.small', 'Small Instance', None, None, None, None,
+                        driver=self.driver)
+        nodes = self.driver.create_nodes(1, name='foo', image=image,
+                                         size=size)
+        self.assertEqual([n.id for n in nodes], ['i-2ba64342'])
+
+    def test_deploy_node_userdata(self):
+        image = NodeImage(id='ami-be3adfd7', name=None, driver=self.driver)
+        size = NodeSize('m1.small', 'Small Instance', None, None, None, None,
+                        driver=self.driver)
+        self.driver.console_interval = 0.1
+        EC2MockHttp.userdata = None
+        EC2MockHttp.console_polls = 0
+        node = self.driver.deploy_node(name='foo', image=image, size=size,
+                                       deploy=ScriptDeployment('make'),
+                                       boot_deploy=True)
+        self.assertEqual(node.id, 'i-2ba64342')
+        self.assertTrue('#!/bin/sh' in EC2MockHttp.userdata)
+        self.assertEqual(EC2MockHttp.console_polls, 2)
+        self.assertEqual(sorted(node.extra['deploy_timings']),
+                         ['api_running', 'deployment'])
+
+    def test_deploy_node_userdata_impossible(self):
+        image = NodeImage(id='ami-be3adfd7', name=None, driver=self.driver)
+        size = NodeSize('m1.small', 'Small Instance', None, None, None, None,
+                        driver=self.driver)
+        EC2MockHttp.userdata = None
+        try:
+            self.driver.deploy_node(name='foo', image=image, size=size,
+                                    deploy=ScriptDeployment('make'),
+                                    userdata='#cloud-config', boot_deploy=True)
+        except NotImplementedError, e:
+            self.assertTrue('userdata was given' in str(e))
+        else:
+            self.fail('test should have thrown')
+        # Nothing was created
+        self.assertEqual(EC2MockHttp.userdata, None)
+
+        self.driver.userdata_limit = 10
+        try:
+            self.driver.deploy_node(name='foo', image=image, size=size,
+                                    deploy=ScriptDeployment('make'),
+                                    boot_deploy=True)
+        except NotImplementedError, e:
+            self.assertTrue('over the limit of 10' in str(e))
+        else:
+            self.fail('test should have thrown')
+
     def test_list_nodes(self):
         node = self.driver.list_nodes()[0]
         self.assertEqual(node.id, 'i-4382922a')
 
+    def test_get_node(self):
+        node = self.driver.get_node('i-4382922a')
+        self.assertEqual(node.id, 'i-4382922a')
+        self.assertEqual(self.driver.get_node('i-deadbeef'), None)
+
+    def test_get_nodes(self):
+        nodes = self.driver.get_nodes(['i-4382922a'])
+        self.assertEqual([n.id for n in nodes], ['i-4382922a'])
+        self.assertEqual(len(self.driver.get_nodes([])), 0)
+
+    def test_get_nodes_unknown_ids(self):
+        EC2MockHttp.describes = []
+        nodes = self.driver.get_nodes(['i-deadbeef', 'i-4382922a',
+                                       'i-0badf00d'])
+        self.assertEqual([n.id for n in nodes], ['i-4382922a'])
+        # The unknown ids are dropped after the first request
+        self.assertEqual(len(EC2MockHttp.describes), 2)
+        self.assertEqual(len(self.driver.get_nodes(['i-deadbeef'])), 0)
+
     def test_reboot_node(self):
         node = Node('i-4382922a', None, None, None, None, self.driver)
         ret = self.driver.reboot_node(node)
@@ -54,6 +128,35 @@ class EC2Tests(unittest.TestCase, TestCaseMixin):
         ret = self.driver.destroy_node(node)
         self.assertTrue(ret)
 
+    def test_destroy_nodes(self):
+        nodes = [Node(id, None, None, None, None, self.driver)
+                 for id in ('i-4382922a', 'i-deadbeef', 'i-4382922b')]
+        ret = self.driver.destroy_nodes(nodes)
+        self.assertEqual([ret[0], ret[2]], [True, True])
+        self.assertTrue('InvalidInstanceID.NotFound' in str(ret[1]))
+
+    def test_destroy_nodes_posts_long_queries(self):
+        nodes = [Node('i-%08x' % i, None, None, None, None, self.driver)
+                 for i in range(300)]
+        EC2MockHttp.methods = []
+        ret = self.driver.destroy_nodes(nodes)
+        self.assertEqual(ret, [True] * 300)
+        self.assertEqual(EC2MockHttp.methods, ['POST'])
+
+    def test_reboot_nodes(self):
+        nodes = [Node(id, None, None, None, None, self.driver)
+                 for id in ('i-4382922a', 'i-4382922b')]
+        self.assertEqual(self.driver.reboot_nodes(nodes), [True, True])
+
+    def test_reboot_nodes_unknown_ids(self):
+        nodes = [Node(id, None, None, None, None, self.driver)
+                 for id in ('i-deadbeef', 'i-4382922a', 'i-0badf00d',
+                            'i-4382922b')]
+        ret = self.driver.reboot_nodes(nodes)
+        self.assertEqual([ret[1], ret[3]], [True, True])
+        self.assertTrue(isinstance(ret[0], Exception))
+        self.assertTrue(isinstance(ret[2], Exception))
+
     def test_list_sizes(self):
         sizes = self.driver.list_sizes()
         self.assertEqual(len(sizes), 7)
@@ -72,12 +175,60 @@ class EC2Tests(unittest.TestCase, TestCaseMixin):
 class EC2MockHttp(MockHttp):
 
     fixtures = FileFixtures('ec2')
+    methods = []
+    describes = []
+    known_ids = ('i-4382922a', 'i-2ba64342')
+    missing_ids = ('i-deadbeef', 'i-0badf00d')
+
+    def _not_found(self, ids):
+        # EC2 fails the whole request, naming every unknown id
+        if len(ids) == 1:
+            body = self.fixtures.load('describe_instances_not_found.xml')
+            body = body.replace('i-deadbeef', ids[0])
+        else:
+            body = ('<Response><Errors><Error><Code>InvalidInstanceID.NotFound'
+                    '</Code><Message>The instance IDs \'%s\' do not exist'
+                    '</Message></Error></Errors><RequestID>4bd1c39e</RequestID>'
+                    '</Response>' % ', '.join(ids))
+        return (httplib.BAD_REQUEST, body, {},
+                httplib.responses[httplib.BAD_REQUEST])
 
     def _DescribeInstances(self, method, url, body, headers):
+        qs = parse_qs(urlparse.urlparse(url).query)
+        EC2MockHttp.describes.append(qs)
+        ids = [v[0] for k, v in sorted(qs.items())
+               if k.startswith('InstanceId.')]
+        unknown = [i for i in ids if i not in EC2MockHttp.known_ids]
+        if unknown:
+            return self._not_found(unknown)
         body = self.fixtures.load('describe_instances.xml')
+        if qs.get('InstanceId.1') == ['i-2ba64342']:
+            # The node created by RunInstances, up and running
+            body = body.replace('i-4382922a', 'i-2ba64342')
+            body = body.replace('<code>0</code>', '<code>16</code>')
+            body = body.replace('<name>pending</name>', '<name>running</name>')
+        return (httplib.OK, body, {}, httplib.responses[httplib.OK])
+
+    def _GetConsoleOutput(self, method, url, body, headers):
+        # Empty at first, then the line written by the userdata script
+        EC2MockHttp.console_polls += 1
+        output = ''
+        if EC2MockHttp.console_polls > 1:
+            token = re.search('libcloud-deploy-([0-9a-f]+)',
+                              EC2MockHttp.userdata).group(1)
+            output = base64.b64encode('booting\nlibcloud-deploy-%s 0\n'
+                                      % token)
+        body = ('<GetConsoleOutputResponse xmlns="%s"><instanceId>i-2ba64342'
+                '</instanceId><output>%s</output></GetConsoleOutputResponse>'
+                % (NAMESPACE, output))
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
     def _RebootInstances(self, method, url, body, headers):
+        qs = parse_qs(urlparse.urlparse(url).query)
+        unknown = [v[0] for k, v in sorted(qs.items())
+                   if k.startswith('InstanceId.') and v[0] in self.missing_ids]
+        if unknown:
+            return self._not_found(unknown)
         body = self.fixtures.load('reboot_instances.xml')
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
@@ -86,11 +237,35 @@ class EC2MockHttp(MockHttp):
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
     def _RunInstances(self, method, url, body, headers):
+        qs = parse_qs(urlparse.urlparse(url).query)
+        if 'UserData' in qs:
+            EC2MockHttp.userdata = base64.b64decode(qs['UserData'][0])
         body = self.fixtures.load('run_instances.xml')
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
     def _TerminateInstances(self, method, url, body, headers):
-        body = self.fixtures.load('terminate_instances.xml')
+        EC2MockHttp.methods.append(method)
+        if method == 'POST':
+            qs = parse_qs(body)
+        else:
+            qs = parse_qs(urlparse.urlparse(url).query)
+        ids = [v[0] for k, v in sorted(qs.items())
+               if k.startswith('InstanceId.')]
+        unknown = [i for i in ids if i in self.missing_ids]
+        if unknown:
+            return self._not_found(unknown)
+        if len(ids) == 1:
+            body = self.fixtures.load('terminate_instances.xml')
+            return (httplib.OK, body, {}, httplib.responses[httplib.OK])
+        items = ''.join([
+            '<item><instanceId>%s</instanceId>'
+            '<shutdownState><code>32</code><name>shutting-down</name>'
+            '</shutdownState><previousState><code>16</code>'
+            '<name>running</name></previousState></item>' % id
+            for id in ids])
+        body = ('<TerminateInstancesResponse xmlns="%s"><instancesSet>%s'
+                '</instancesSet></TerminateInstancesResponse>'
+                % (NAMESPACE, items))
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
 if __name__ == '__main__':
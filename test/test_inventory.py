@@ -0,0 +1,57 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import unittest
+
+from libcloud.base import Node
+from libcloud.inventory import diff_nodes, InventoryTracker
+from libcloud.types import NodeState
+
+class FakeDriver(object):
+    type = 0
+
+def make_node(id, state=NodeState.RUNNING, ip='1.2.3.4', extra=None):
+    return Node(id=id, name=id, state=state, public_ip=[ip], private_ip=[],
+                driver=FakeDriver(), extra=extra)
+
+class InventoryTests(unittest.TestCase):
+
+    def test_diff_nodes(self):
+        old = [make_node('a'), make_node('b'), make_node('c')]
+        new = [make_node('a'),
+               make_node('b', state=NodeState.REBOOTING),
+               make_node('d')]
+        diff = diff_nodes(old, new)
+        self.assertEqual([n.id for n in diff.added], ['d'])
+        self.assertEqual(diff.removed, [old[2].uuid])
+        self.assertEqual([n.id for n in diff.changed], ['b'])
+        self.assertEqual(diff.changed_fields[new[1].uuid], ['state'])
+
+    def test_extra_order_is_ignored(self):
+        old = [make_node('a', extra={'x': 1, 'y': [1, 2], 'z': {'k': 'v'}})]
+        new = [make_node('a', extra={'z': {'k': 'v'}, 'y': [1, 2], 'x': 1})]
+        self.assertFalse(diff_nodes(old, new))
+
+    def test_tracker(self):
+        tracker = InventoryTracker([make_node('a'), make_node('b')])
+        self.assertEqual(len(tracker), 2)
+        diff = tracker.update([make_node('a', ip='5.6.7.8')])
+        self.assertEqual(diff.changed_fields.values(), [['public_ip']])
+        self.assertEqual(len(diff.removed), 1)
+        self.assertEqual(len(tracker), 1)
+        self.assertFalse(tracker.update([make_node('a', ip='5.6.7.8')]))
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
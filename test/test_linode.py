@@ -18,12 +18,17 @@
 #
 
 import sys
-from libcloud.drivers.linode import LinodeNodeDriver
+from libcloud.drivers.linode import LinodeNodeDriver, LinodeException
 from libcloud.base import Node, NodeAuthPassword
 from test import MockHttp, TestCaseMixin
 
 import unittest
 import httplib
+import urllib
+from urllib2 import urlparse
+try: import json
+except: import simplejson as json
+from cgi import parse_qs
 
 class LinodeTest(unittest.TestCase, TestCaseMixin):
     # The Linode test suite
@@ -42,6 +47,75 @@ class LinodeTest(unittest.TestCase, TestCaseMixin):
         self.assertTrue('75.127.96.245' in node.public_ip)
         self.assertEqual(node.private_ip, [])
     
+    def test_get_node(self):
+        node = self.driver.get_node(8098)
+        self.assertEqual(node.name, 'api-node3')
+        self.assertEqual(self.driver.get_node(1), None)
+        nodes = self.driver.get_nodes([8098, 1])
+        self.assertEqual([n.id for n in nodes], [8098])
+
+    def test_list_nodes_request_count_is_constant(self):
+        LinodeNodeDriver.connectionCls.conn_classes = (None,
+                                                       LinodeScalingMockHttp)
+        for count in (1, 10, 300):
+            LinodeScalingMockHttp.linodes = count
+            LinodeScalingMockHttp.requests = 0
+            nodes = self.driver.list_nodes()
+            self.assertEqual(len(nodes), count)
+            self.assertEqual(LinodeScalingMockHttp.requests, 1)
+            node = nodes.by_id(count)
+            self.assertEqual(node.public_ip, ['10.0.%d.%d' % divmod(count, 256)])
+            self.assertEqual(node.private_ip, ['192.168.%d.%d' % divmod(count, 256)])
+
+    def test_create_node_round_trips(self):
+        LinodeNodeDriver.connectionCls.conn_classes = (None,
+                                                       LinodeScalingMockHttp)
+        LinodeScalingMockHttp.linodes = 8098
+        location = self.driver.list_locations()[0]
+        size = self.driver.list_sizes()[0]
+        image = self.driver.list_images()[6]
+        LinodeScalingMockHttp.requests = 0
+        node = self.driver.create_node(name="Test", location=location,
+                                       size=size, image=image,
+                                       auth=NodeAuthPassword("test123"))
+        self.assertEqual(node.id, 8098)
+        self.assertEqual(node.public_ip, ['10.0.31.162'])
+        # validation batch, create, disks batch, config, boot batch
+        self.assertEqual(LinodeScalingMockHttp.requests, 5)
+
+    def test_create_node_async(self):
+        LinodeNodeDriver.connectionCls.conn_classes = (None,
+                                                       LinodeScalingMockHttp)
+        LinodeScalingMockHttp.linodes = 8098
+        location = self.driver.list_locations()[0]
+        size = self.driver.list_sizes()[0]
+        image = self.driver.list_images()[6]
+        LinodeScalingMockHttp.requests = 0
+        handle = self.driver.create_node_async(
+            name="Test", location=location, size=size, image=image,
+            auth=NodeAuthPassword("test123"))
+        node = handle.wait(5)
+        self.assertEqual(node.id, 8098)
+        self.assertTrue(handle.done())
+        self.assertEqual(LinodeScalingMockHttp.requests, 5)
+
+    def test_get_nodes_is_one_request(self):
+        LinodeNodeDriver.connectionCls.conn_classes = (None,
+                                                       LinodeScalingMockHttp)
+        LinodeScalingMockHttp.linodes = 10
+        LinodeScalingMockHttp.requests = 0
+        nodes = self.driver.get_nodes([3, 1, 7])
+        self.assertEqual([n.id for n in nodes], [3, 1, 7])
+        self.assertEqual(LinodeScalingMockHttp.requests, 1)
+
+    def test_batch_maps_errors_to_actions(self):
+        batch = self.driver.connection.batch()
+        found = batch.add({"api_action": "linode.list", "LinodeID": 8098})
+        missing = batch.add({"api_action": "linode.list", "LinodeID": 1})
+        batch.run()
+        self.assertEqual(found.result()[0]["LINODEID"], 8098)
+        self.assertRaises(LinodeException, missing.result)
+
     def test_reboot_node(self):
         # An exception would indicate failure
         node = self.driver.list_nodes()[0]
@@ -81,6 +155,19 @@ class LinodeTest(unittest.TestCase, TestCaseMixin):
 
         
 class LinodeMockHttp(MockHttp):
+    def _batch(self, method, url, body, headers):
+        # Run every action of api_requestArray through its own mock method
+        qs = parse_qs(urlparse.urlparse(url).query)
+        replies = []
+        for params in json.loads(qs['api_requestArray'][0]):
+            action = params['api_action'].replace('.', '_')
+            sub_url = '/?%s' % urllib.urlencode(params)
+            status, sub_body, sub_headers, reason = getattr(
+                self, '_%s' % action)(method, sub_url, None, {})
+            replies.append(json.loads(sub_body))
+        return (httplib.OK, json.dumps(replies), {},
+                httplib.responses[httplib.OK])
+
     def _avail_datacenters(self, method, url, body, headers):
         body = '{"ERRORARRAY":[],"ACTION":"avail.datacenters","DATA":[{"DATACENTERID":2,"LOCATION":"Dallas, TX, USA"},{"DATACENTERID":3,"LOCATION":"Fremont, CA, USA"},{"DATACENTERID":4,"LOCATION":"Atlanta, GA, USA"},{"DATACENTERID":6,"LOCATION":"Newark, NJ, USA"}]}'
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
@@ -126,6 +213,10 @@ class LinodeMockHttp(MockHttp):
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
     def _linode_list(self, method, url, body, headers):
+        qs = parse_qs(urlparse.urlparse(url).query)
+        if qs.get('LinodeID') == ['1']:
+            body = '{"ERRORARRAY":[{"ERRORCODE":5,"ERRORMESSAGE":"Object not found"}],"ACTION":"linode.list","DATA":{}}'
+            return (httplib.OK, body, {}, httplib.responses[httplib.OK])
         body = '{"ACTION": "linode.list", "DATA": [{"ALERT_DISKIO_ENABLED": 1, "BACKUPWEEKLYDAY": 0, "LABEL": "api-node3", "DATACENTERID": 5, "ALERT_BWOUT_ENABLED": 1, "ALERT_CPU_THRESHOLD": 10, "TOTALHD": 100, "ALERT_BWQUOTA_THRESHOLD": 81, "ALERT_BWQUOTA_ENABLED": 1, "TOTALXFER": 200, "STATUS": 2, "ALERT_BWIN_ENABLED": 1, "ALERT_BWIN_THRESHOLD": 5, "ALERT_DISKIO_THRESHOLD": 200, "WATCHDOG": 1, "LINODEID": 8098, "BACKUPWINDOW": 1, "TOTALRAM": 540, "LPM_DISPLAYGROUP": "", "ALERT_BWOUT_THRESHOLD": 5, "BACKUPSENABLED": 1, "ALERT_CPU_ENABLED": 1}], "ERRORARRAY": []}'
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
@@ -133,5 +224,40 @@ class LinodeMockHttp(MockHttp):
         body = '{"ACTION": "linode.ip.list", "DATA": [{"RDNS_NAME": "li22-54.members.linode.com", "ISPUBLIC": 1, "IPADDRESS": "75.127.96.54", "IPADDRESSID": 5384, "LINODEID": 8098}, {"RDNS_NAME": "li22-245.members.linode.com", "ISPUBLIC": 1, "IPADDRESS": "75.127.96.245", "IPADDRESSID": 5575, "LINODEID": 8098}], "ERRORARRAY": []}'
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
+class LinodeScalingMockHttp(LinodeMockHttp):
+    """
+    Serves an account with C{linodes} Linodes and counts requests.
+    """
+    linodes = 1
+    requests = 0
+
+    def request(self, method, url, body=None, headers=None):
+        LinodeScalingMockHttp.requests += 1
+        return LinodeMockHttp.request(self, method, url, body, headers)
+
+    def _ids(self, url):
+        qs = parse_qs(urlparse.urlparse(url).query)
+        if 'LinodeID' in qs:
+            return [int(qs['LinodeID'][0])]
+        return range(1, self.linodes + 1)
+
+    def _linode_list(self, method, url, body, headers):
+        data = [{"LINODEID": i, "LABEL": "node-%d" % i, "STATUS": 1}
+                for i in self._ids(url)]
+        body = json.dumps({"ACTION": "linode.list", "DATA": data,
+                           "ERRORARRAY": []})
+        return (httplib.OK, body, {}, httplib.responses[httplib.OK])
+
+    def _linode_ip_list(self, method, url, body, headers):
+        data = []
+        for i in self._ids(url):
+            data.append({"LINODEID": i, "ISPUBLIC": 1,
+                         "IPADDRESS": "10.0.%d.%d" % divmod(i, 256)})
+            data.append({"LINODEID": i, "ISPUBLIC": 0,
+                         "IPADDRESS": "192.168.%d.%d" % divmod(i, 256)})
+        body = json.dumps({"ACTION": "linode.ip.list", "DATA": data,
+                           "ERRORARRAY": []})
+        return (httplib.OK, body, {}, httplib.responses[httplib.OK])
+
 if __name__ == '__main__':
     sys.exit(unittest.main())
@@ -0,0 +1,101 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import time
+import unittest
+
+from libcloud.base import Node, NodeImage
+from libcloud.multi import MultiDriver, item_uuid
+from libcloud.types import NodeState
+
+class SlowDriver(object):
+    """
+    Driver whose listings take C{delay} seconds, or fail with C{error}.
+    """
+
+    def __init__(self, type, delay=0, error=None, nodes=('a',)):
+        self.type = type
+        self.name = 'slow%d' % type
+        self.delay = delay
+        self.error = error
+        self.nodes = nodes
+
+    def _wait(self):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+
+    def list_nodes(self):
+        self._wait()
+        return [Node(id, id, NodeState.RUNNING, [], [], self)
+                for id in self.nodes]
+
+    def list_images(self):
+        self._wait()
+        return [NodeImage('ami-1', 'base', self)]
+
+class MultiDriverTests(unittest.TestCase):
+
+    def test_list_nodes(self):
+        drivers = [SlowDriver(1, 0.3, nodes=('a', 'b')), SlowDriver(2, 0.3),
+                   SlowDriver(3, 0.3, nodes=())]
+        start = time.time()
+        nodes = MultiDriver(drivers).list_nodes()
+        # Concurrent: about as long as one driver, not the sum
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEqual([(n.driver.type, n.id) for n in nodes],
+                         [(1, 'a'), (1, 'b'), (2, 'a')])
+        self.assertEqual(nodes.errors, {})
+        self.assertEqual(nodes.by_uuid(nodes[2].uuid), nodes[2])
+        self.assertEqual(len(nodes.by_driver(drivers[0])), 2)
+        self.assertEqual(nodes.by_name('b'), [nodes[1]])
+        self.assertEqual(len(nodes.by_name('a')), 2)
+
+        # The indexes follow changes to the result
+        extra = Node('c', 'c', NodeState.RUNNING, ['10.0.0.3'], [],
+                     drivers[2])
+        nodes.append(extra)
+        self.assertEqual(nodes.by_uuid(extra.uuid), extra)
+        self.assertEqual(nodes.by_ip('10.0.0.3'), extra)
+        nodes.remove(extra)
+        self.assertEqual(nodes.by_uuid(extra.uuid), None)
+
+    def test_partial_results(self):
+        slow = SlowDriver(2, 5)
+        broken = SlowDriver(3, error=IOError('no route'))
+        fast = SlowDriver(1)
+        multi = MultiDriver([fast, slow, broken], timeout=0.2)
+        start = time.time()
+        nodes = multi.list_nodes()
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual([n.driver for n in nodes], [fast])
+        self.assertTrue(isinstance(nodes.errors[broken], IOError))
+        self.assertTrue('Timed out' in str(nodes.errors[slow]))
+
+        # A longer timeout for one driver
+        slow.delay = 0.3
+        multi.timeouts[slow] = 1
+        self.assertEqual(len(multi.list_nodes()), 2)
+
+    def test_list_images_merged(self):
+        # Two sets of credentials for the same provider list the same image
+        drivers = [SlowDriver(1), SlowDriver(1), SlowDriver(2)]
+        images = MultiDriver(drivers).list_images()
+        self.assertEqual([i.driver for i in images], [drivers[0], drivers[2]])
+        self.assertEqual(images.by_uuid(item_uuid(images[1])), images[1])
+        self.assertEqual(images.by_name('base'), list(images))
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
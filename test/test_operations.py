@@ -0,0 +1,90 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import threading
+import time
+import unittest
+
+from libcloud.pool import Future
+from libcloud.operations import OperationScheduler, Result, Sleep
+from libcloud.operations import wait_all, wait_any
+
+class OperationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = OperationScheduler(size=2)
+
+    def test_steps(self):
+        future = Future()
+        def operation():
+            yield Sleep(0.01)
+            value = yield future
+            yield
+            yield Result(value * 2)
+        handle = self.scheduler.start(operation())
+        self.assertFalse(handle.done())
+        self.assertRaises(Exception, handle.wait, 0.05)
+        future.set_result(21)
+        self.assertEqual(handle.wait(1), 42)
+        self.assertEqual(handle.steps, 4)
+
+    def test_exceptions_are_thrown_in(self):
+        future = Future()
+        def operation():
+            try:
+                yield future
+            except ValueError:
+                yield Result('recovered')
+        handle = self.scheduler.start(operation())
+        future.set_exception(ValueError())
+        self.assertEqual(handle.wait(1), 'recovered')
+
+        def failing():
+            yield
+            raise KeyError('boom')
+        self.assertRaises(KeyError, self.scheduler.start(failing()).wait, 1)
+
+    def test_waits_do_not_hold_workers(self):
+        futures = [Future() for i in range(10)]
+        def operation(future):
+            yield Result((yield future))
+        handles = [self.scheduler.start(operation(f)) for f in futures]
+        # Ten operations waiting on two workers; the last can still finish.
+        futures[-1].set_result('last')
+        self.assertEqual(wait_any(handles, 1), handles[-1])
+        for i, future in enumerate(futures[:-1]):
+            if i == 3:
+                future.set_exception(ValueError())
+            else:
+                future.set_result(i)
+        results = wait_all(handles, 1)
+        self.assertEqual(results[:3], [0, 1, 2])
+        self.assertTrue(isinstance(results[3], ValueError))
+        self.assertEqual(results[-1], 'last')
+
+    def test_wait_any_timeout(self):
+        future = Future()
+        def operation():
+            yield future
+        handle = self.scheduler.start(operation())
+        for i in range(5):
+            self.assertEqual(wait_any([handle], 0.01), None)
+        # Polling leaves no callbacks behind
+        self.assertEqual(handle.future._callbacks, [])
+        future.set_result(None)
+        self.assertEqual(wait_any([handle], 1), handle)
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
@@ -17,7 +17,9 @@ import unittest
 
 from libcloud.types import InvalidCredsException
 from libcloud.drivers.rackspace import RackspaceNodeDriver as Rackspace
+from libcloud.drivers.rackspace import NAMESPACE
 from libcloud.base import Node, NodeImage, NodeSize
+from libcloud.deployment import SSHKeyDeployment, ScriptDeployment
 
 from test import MockHttp, TestCaseMixin
 from test.file_fixtures import FileFixtures
@@ -41,6 +43,18 @@ class RackspaceTests(unittest.TestCase, TestCaseMixin):
         else:
             self.fail('test should have thrown')
 
+    def test_boot_payload(self):
+        key = SSHKeyDeployment('ssh-rsa AAA')
+        kwargs = self.driver._boot_payload({'files': {'/etc/motd': 'hi'}},
+                                           key.boot_actions(), 'token')
+        self.assertEqual(kwargs['files'],
+                         {'/etc/motd': 'hi',
+                          '/root/.ssh/authorized_keys': 'ssh-rsa AAA'})
+        # Personality files can't run anything
+        script = ScriptDeployment('make')
+        self.assertRaises(NotImplementedError, self.driver._boot_payload,
+                          {}, script.boot_actions(), 'token')
+
     def test_list_nodes(self):
         RackspaceMockHttp.type = 'EMPTY'
         ret = self.driver.list_nodes()
@@ -97,6 +111,14 @@ class RackspaceTests(unittest.TestCase, TestCaseMixin):
         ret = node.reboot()
         self.assertTrue(ret is True)
 
+    def test_get_node(self):
+        node = self.driver.get_node('72258')
+        self.assertEqual(node.name, 'racktest')
+        self.assertEqual(node.public_ip, ['67.23.21.33'])
+        self.assertEqual(self.driver.get_node('1'), None)
+        nodes = self.driver.get_nodes(['72258', '1'])
+        self.assertEqual([n.id for n in nodes], ['72258'])
+
     def test_destroy_node(self):
         node = Node(id=72258, name=None, state=None, public_ip=None, private_ip=None,
                     driver=self.driver)
@@ -154,11 +176,18 @@ class RackspaceMockHttp(MockHttp):
         return (httplib.ACCEPTED, "", {}, httplib.responses[httplib.ACCEPTED])
 
     def _v1_0_slug_servers_72258(self, method, url, body, headers):
+        if method == "GET":
+            body = self.fixtures.load('v1_slug_servers_72258.xml')
+            return (httplib.OK, body, {}, httplib.responses[httplib.OK])
         if method != "DELETE":
             raise NotImplemented
         # only used by destroy node()
         return (httplib.ACCEPTED, "", {}, httplib.responses[httplib.ACCEPTED])
 
+    def _v1_0_slug_servers_1(self, method, url, body, headers):
+        body = '<itemNotFound xmlns="%s" code="404"><message>The resource could not be found.</message></itemNotFound>' % NAMESPACE
+        return (httplib.NOT_FOUND, body, {}, httplib.responses[httplib.NOT_FOUND])
+
 
 if __name__ == '__main__':
     sys.exit(unittest.main())
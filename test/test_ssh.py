@@ -0,0 +1,625 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+import shutil
+import socket
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+
+import libcloud.ssh
+from libcloud.ssh import probe_ssh, wait_for_ssh
+from libcloud.ssh import BaseSSHClient, ParamikoSSHClient, PUT_CHUNK_SIZE
+from libcloud.ssh import ShellOutSSHClient, OutputBuffer
+from libcloud.ssh import ParallelSSHExecutor
+from libcloud.base import Node
+from libcloud.types import NodeState
+from libcloud.deployment import ScriptDeployment
+
+class BannerServer(object):
+    """
+    Listens on a free local port and greets every connection with
+    C{banner}.
+    """
+
+    def __init__(self, banner='SSH-2.0-OpenSSH_5.1\r\n'):
+        self.banner = banner
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+
+    def start(self):
+        self.sock.listen(5)
+        thread = threading.Thread(target=self._serve)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, address = self.sock.accept()
+            except socket.error:
+                return
+            conn.sendall(self.banner)
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+class FakeSFTPFile(object):
+
+    def __init__(self, sftp, path):
+        self.sftp = sftp
+        self.path = path
+
+    def write(self, data):
+        self.sftp.files[self.path] += data
+        self.sftp.writes.append(len(data))
+
+    def set_pipelined(self, pipelined=True):
+        self.sftp.pipelined = pipelined
+
+    def chmod(self, mode):
+        self.sftp.modes[self.path] = mode
+
+    def close(self):
+        pass
+
+class FakeSFTP(object):
+    """
+    In-memory stand-in for paramiko's SFTPClient, logging every call.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.dirs = set(['/', '/root'])
+        self.files = {}
+        self.modes = {}
+        self.writes = []
+        self.pipelined = False
+
+    def stat(self, path):
+        self.calls.append(('stat', path))
+        if path not in self.dirs:
+            raise IOError(2, 'No such file')
+
+    def mkdir(self, path):
+        self.calls.append(('mkdir', path))
+        if path in self.dirs:
+            raise IOError('Failure')
+        self.dirs.add(path)
+
+    def file(self, path, mode='r'):
+        self.calls.append(('file', path))
+        if path in self.dirs:
+            raise IOError(21, 'Is a directory')
+        self.files[path] = ''
+        return FakeSFTPFile(self, path)
+
+    def unlink(self, path):
+        self.calls.append(('unlink', path))
+        del self.files[path]
+
+    def close(self):
+        self.calls.append(('close', None))
+
+class SingleThreadSFTP(FakeSFTP):
+    """
+    Fails, like paramiko mixing up replies, when two threads use it at once.
+    """
+
+    def __init__(self):
+        FakeSFTP.__init__(self)
+        self.busy = threading.Lock()
+
+    def _call(self, method, *args):
+        if not self.busy.acquire(False):
+            raise IOError('SFTP session used by two threads at once')
+        try:
+            time.sleep(0.01)
+            return method(self, *args)
+        finally:
+            self.busy.release()
+
+    def stat(self, path):
+        return self._call(FakeSFTP.stat, path)
+
+    def mkdir(self, path):
+        return self._call(FakeSFTP.mkdir, path)
+
+    def file(self, path, mode='r'):
+        return self._call(FakeSFTP.file, path, mode)
+
+    def unlink(self, path):
+        return self._call(FakeSFTP.unlink, path)
+
+class FakeParamikoClient(object):
+
+    def __init__(self):
+        self.sessions = []
+        self.connects = []
+
+    def connect(self, **kwargs):
+        self.connects.append(kwargs)
+
+    def open_sftp(self):
+        self.sessions.append(FakeSFTP())
+        return self.sessions[-1]
+
+    def close(self):
+        pass
+
+class FakeParamikoSSHClient(ParamikoSSHClient):
+
+    def __init__(self, hostname, **kwargs):
+        BaseSSHClient.__init__(self, hostname, **kwargs)
+        self.compress = False
+        self.client = FakeParamikoClient()
+        self._sftp_lock = threading.RLock()
+        self._reset_sftp()
+
+class ParamikoSSHClientTests(unittest.TestCase):
+
+    def test_connect_key(self):
+        client = FakeParamikoSSHClient('localhost', key='/root/.ssh/id_rsa')
+        client.connect()
+        self.assertEqual(client.client.connects[0]['key_filename'],
+                         '/root/.ssh/id_rsa')
+
+        client = FakeParamikoSSHClient('localhost', password='secret')
+        client.connect()
+        self.assertFalse('key_filename' in client.client.connects[0])
+        self.assertEqual(client.client.connects[0]['password'], 'secret')
+
+    def test_put_reuses_session(self):
+        client = FakeParamikoSSHClient('localhost')
+        client.put_many([('/root/app/conf/a.conf', 'a'),
+                         ('/root/app/conf/b.conf', 'b', 0644),
+                         ('/root/app/run.sh', 'run', 0755)])
+        client.put('.ssh/authorized_keys', 'key')
+        client.delete('/root/app/conf/a.conf')
+        self.assertEqual(len(client.client.sessions), 1)
+        sftp = client.client.sessions[0]
+        self.assertEqual(sftp.files, {'/root/app/conf/b.conf': 'b',
+                                      '/root/app/run.sh': 'run',
+                                      '.ssh/authorized_keys': 'key'})
+        self.assertEqual(sftp.modes['/root/app/run.sh'], 0755)
+        self.assertEqual([c for c in sftp.calls if c[0] == 'mkdir'],
+                         [('mkdir', '/root/app'), ('mkdir', '/root/app/conf'),
+                          ('mkdir', '.ssh')])
+        # Directories are only looked up the first time
+        self.assertEqual(sftp.calls.count(('stat', '/root/app/conf')), 1)
+        self.assertEqual(sftp.calls.count(('stat', '/root/app')), 1)
+
+        client.close()
+        self.assertEqual(sftp.calls[-1], ('close', None))
+        client.put('/root/x', 'x')
+        self.assertEqual(len(client.client.sessions), 2)
+
+    def test_put_streams(self):
+        client = FakeParamikoSSHClient('localhost')
+        data = 'x' * (PUT_CHUNK_SIZE * 2 + 10)
+        local = tempfile.NamedTemporaryFile()
+        local.write(data)
+        local.flush()
+        seen = []
+        client.put('/root/big', local_path=local.name,
+                   progress=lambda *args: seen.append(args))
+        sftp = client.client.sessions[0]
+        self.assertEqual(sftp.files['/root/big'], data)
+        self.assertEqual(sftp.writes, [PUT_CHUNK_SIZE, PUT_CHUNK_SIZE, 10])
+        self.assertTrue(sftp.pipelined)
+        self.assertEqual([args[:2] for args in seen],
+                         [(PUT_CHUNK_SIZE, len(data)),
+                          (PUT_CHUNK_SIZE * 2, len(data)),
+                          (len(data), len(data))])
+
+        client.put('/root/small', contents=StringIO.StringIO('abc'))
+        self.assertEqual(sftp.files['/root/small'], 'abc')
+
+    def test_put_from_threads(self):
+        client = FakeParamikoSSHClient('localhost')
+        client.client.open_sftp = lambda: SingleThreadSFTP()
+        client.client.sessions = []
+        errors = []
+        def put(i):
+            try:
+                client.put('/root/app/%d' % i, 'x')
+                client.delete('/root/app/%d' % i)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=put, args=(i,))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(client._sftps), 5)
+        mkdirs = sum([s.calls.count(('mkdir', '/root/app'))
+                      for s in client._sftps])
+        self.assertEqual(mkdirs, 1)
+
+        sessions = list(client._sftps)
+        client.close()
+        self.assertEqual([s.calls[-1] for s in sessions],
+                         [('close', None)] * 5)
+        self.assertEqual(client._sftps, [])
+
+    def test_put_closes_local_file(self):
+        client = FakeParamikoSSHClient('localhost')
+        opened = []
+        real_open = open
+        def tracking_open(*args):
+            opened.append(real_open(*args))
+            return opened[-1]
+        local = tempfile.NamedTemporaryFile()
+        libcloud.ssh.open = tracking_open
+        try:
+            self.assertRaises(IOError, client.put, '/root',
+                              local_path=local.name)
+        finally:
+            del libcloud.ssh.open
+        self.assertTrue(opened[0].closed)
+
+        self.assertRaises(ValueError, client.put, '/root/x')
+
+# Stands in for ssh and the remote sshd: runs commands locally in the
+# "remote" home directory and logs whether each came through a master.
+FAKE_SSH = """#!%(python)s
+import os, subprocess, sys
+args = sys.argv[1:]
+if args == ['-V']:
+    sys.stderr.write('OpenSSH_9.6p1, OpenSSL 3.0.13\\n')
+    sys.exit(0)
+options = []
+while args[0].startswith('-'):
+    flag = args.pop(0)
+    if flag in ('-p', '-o', '-i', '-O'):
+        options.append((flag, args.pop(0)))
+    else:
+        options.append((flag, None))
+control = [v for f, v in options if f == '-o' and v.startswith('ControlPath=')]
+control = control[0].split('=', 1)[1]
+log = open(%(log)r, 'a')
+if ('-M', None) in options:
+    log.write('master\\n')
+    batch = [v for f, v in options if f == '-o' and v.startswith('BatchMode=')]
+    if 'SSH_ASKPASS' in os.environ and batch[0] == 'BatchMode=no':
+        log.write('askpass:' + subprocess.Popen(
+            [os.environ['SSH_ASKPASS']],
+            stdout=subprocess.PIPE).communicate()[0])
+        log.write('files:%%s\\n' %% sorted(os.listdir(os.path.dirname(control))))
+    open(control, 'w').close()
+    log.close()
+    # The backgrounded master keeps its output open for a while
+    if os.fork():
+        os._exit(0)
+    import time
+    time.sleep(0.5)
+elif ('-O', 'exit') in options:
+    log.write('exit\\n')
+    os.remove(control)
+else:
+    log.write(os.path.exists(control) and 'reuse\\n' or 'handshake\\n')
+    log.close()
+    os.chdir(%(home)r)
+    sys.exit(subprocess.call(['sh', '-c', args[1]]))
+"""
+
+class ShellOutSSHClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.home = os.path.join(self.tmp, 'home')
+        os.mkdir(self.home)
+        self.log = os.path.join(self.tmp, 'log')
+        self.ssh = os.path.join(self.tmp, 'ssh')
+        script = open(self.ssh, 'w')
+        script.write(FAKE_SSH % {'python': sys.executable, 'log': self.log,
+                                 'home': self.home})
+        script.close()
+        os.chmod(self.ssh, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_commands_share_one_master(self):
+        client = ShellOutSSHClient('example.com', key='/tmp/id_rsa')
+        client.ssh_binary = self.ssh
+        self.assertRaises(IOError, client.run, 'true')
+        client.connect()
+        client.put('app/conf/a.conf', 'hello', chmod=0600)
+        client.put('b.txt', contents=StringIO.StringIO('streamed'))
+        self.assertEqual(client.run('cat app/conf/a.conf'),
+                         ['hello', '', 0])
+        client.delete('b.txt')
+        client.close()
+
+        self.assertEqual(open(self.log).read().split(),
+                         ['master', 'reuse', 'reuse', 'reuse', 'reuse',
+                          'exit'])
+        path = os.path.join(self.home, 'app', 'conf', 'a.conf')
+        self.assertEqual(os.stat(path).st_mode & 0777, 0600)
+        self.assertFalse(os.path.exists(os.path.join(self.home, 'b.txt')))
+        self.assertEqual(client.control_dir, None)
+
+    def test_password(self):
+        client = ShellOutSSHClient('example.com', password="it's secret")
+        client.ssh_binary = self.ssh
+        start = time.time()
+        client.connect()
+        # Not held up by the forked master
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(sorted(os.listdir(client.control_dir)),
+                         ['master', 'master.log'])
+        client.run('true')
+        client.close()
+        log = open(self.log).read().splitlines()
+        self.assertEqual(log[:2], ['master', "askpass:it's secret"])
+        self.assertTrue(log[2].startswith('files:'))
+        self.assertTrue("'password'" in log[2])
+        self.assertEqual(log[3:], ['reuse', 'exit'])
+
+    def test_password_needs_recent_ssh(self):
+        old_ssh = os.path.join(self.tmp, 'old_ssh')
+        script = open(old_ssh, 'w')
+        script.write('#!/bin/sh\necho "OpenSSH_7.4p1, OpenSSL 1.0.2k" >&2\n')
+        script.close()
+        os.chmod(old_ssh, 0755)
+        client = ShellOutSSHClient('example.com', password='secret')
+        client.ssh_binary = old_ssh
+        self.assertRaises(IOError, client.connect)
+        self.assertEqual(client.control_dir, None)
+
+    def test_run_streams(self):
+        client = ShellOutSSHClient('example.com')
+        client.ssh_binary = self.ssh
+        client.connect()
+        try:
+            # Much more stderr than a pipe holds, written before any stdout
+            cmd = ('i=0; while [ $i -lt 2000 ]; do '
+                   'echo 0123456789012345678901234567890123456789 >&2; '
+                   'i=$((i+1)); done; echo done; exit 3')
+            chunks = []
+            so, se, status = client.run(cmd, on_stderr=chunks.append,
+                                        buffer_size=41)
+        finally:
+            client.close()
+        self.assertEqual(so, 'done\n')
+        self.assertEqual(se, '0123456789012345678901234567890123456789\n')
+        self.assertEqual(status, 3)
+        self.assertEqual(len(''.join(chunks)), 2000 * 41)
+
+class FakeChannel(object):
+    """
+    Paramiko channel replaying C{output}, a list of (stream, data) pairs.
+    """
+
+    def __init__(self, output, status):
+        self.output = list(output)
+        self.status = status
+        self.commands = []
+        # select() needs a real descriptor; keep one always readable
+        self.sock, self.other = socket.socketpair()
+        self.other.send('x')
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def exec_command(self, cmd):
+        self.commands.append(cmd)
+
+    def shutdown_write(self):
+        pass
+
+    def _ready(self, stream):
+        return bool(self.output) and self.output[0][0] == stream
+
+    def recv_ready(self):
+        return self._ready('stdout')
+
+    def recv_stderr_ready(self):
+        return self._ready('stderr')
+
+    def recv(self, size):
+        return self.output.pop(0)[1]
+
+    recv_stderr = recv
+
+    def exit_status_ready(self):
+        return not self.output
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        self.sock.close()
+        self.other.close()
+
+class FakeTransport(object):
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def open_session(self):
+        return self.channel
+
+class ParamikoRunTests(unittest.TestCase):
+
+    def test_run(self):
+        client = FakeParamikoSSHClient('localhost')
+        channel = FakeChannel([('stderr', 'warn\n'), ('stdout', 'a'),
+                               ('stderr', 'more\n'), ('stdout', 'b')], 1)
+        client.client.get_transport = lambda: FakeTransport(channel)
+        seen = []
+        ret = client.run('make', on_stdout=seen.append)
+        self.assertEqual(ret, ['ab', 'warn\nmore\n', 1])
+        self.assertEqual(seen, ['a', 'b'])
+        self.assertEqual(channel.commands, ['make'])
+
+class OutputBufferTests(unittest.TestCase):
+
+    def test_limit(self):
+        buf = OutputBuffer(limit=5)
+        buf.write('abc')
+        buf.write('defg')
+        self.assertEqual(buf.getvalue(), 'cdefg')
+        self.assertEqual(buf.dropped, 2)
+        unbounded = OutputBuffer()
+        unbounded.write('x' * 100)
+        self.assertEqual(len(unbounded.getvalue()), 100)
+
+class FakeHostClient(BaseSSHClient):
+    """
+    Client for L{ParallelSSHExecutor} tests: host C{10.0.0.9} refuses
+    connections and commands on C{10.0.0.8} block until closed.
+    """
+    connects = []
+
+    def connect(self):
+        FakeHostClient.connects.append(self.hostname)
+        if self.hostname == '10.0.0.9':
+            raise IOError('Connection refused')
+        self.closed = threading.Event()
+        return True
+
+    def put(self, path, contents=None, chmod=None, local_path=None,
+            progress=None):
+        pass
+
+    def run(self, cmd, on_stdout=None, on_stderr=None, buffer_size=None):
+        if self.hostname == '10.0.0.8':
+            self.closed.wait()
+            return ['', '', -1]
+        out = '%s on %s\n' % (cmd, self.hostname)
+        if on_stdout is not None:
+            on_stdout(out)
+        return [out, '', 0]
+
+    def close(self):
+        self.closed.set()
+
+class _NodeDriver(object):
+    type = 0
+
+def _nodes(*ips):
+    return [Node(id=str(i), name='node%d' % i, state=NodeState.RUNNING,
+                 public_ip=[ip], private_ip=[], driver=_NodeDriver())
+            for i, ip in enumerate(ips)]
+
+class ParallelSSHExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        FakeHostClient.connects = []
+
+    def test_run_command(self):
+        output = []
+        executor = ParallelSSHExecutor(
+            _nodes('10.0.0.1', '10.0.0.2', '10.0.0.9'),
+            client_class=FakeHostClient,
+            on_output=lambda host, stream, data:
+                output.append((host, stream, data)))
+        results = executor.run_command('uptime')
+        results += executor.run_command('df')
+        executor.close()
+
+        self.assertEqual(results[0].value,
+                         ['uptime on 10.0.0.1\n', '', 0])
+        self.assertEqual(results[4].value, ['df on 10.0.0.2\n', '', 0])
+        self.assertTrue(isinstance(results[2].error, IOError))
+        self.assertFalse(results[5].succeeded())
+        # One connection per reachable host, reused by the second command
+        self.assertEqual(sorted(FakeHostClient.connects),
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.9', '10.0.0.9'])
+        self.assertTrue(('10.0.0.2', 'stdout', 'df on 10.0.0.2\n')
+                        in output)
+
+    def test_run_deployment(self):
+        executor = ParallelSSHExecutor(_nodes('10.0.0.1', '10.0.0.2'),
+                                       client_class=FakeHostClient)
+        script = ScriptDeployment('hostname', name='/root/h.sh')
+        results = executor.run(script)
+        self.assertEqual([r.deployment.stdout for r in results],
+                         ['/root/h.sh on 10.0.0.1\n',
+                          '/root/h.sh on 10.0.0.2\n'])
+        self.assertEqual(results[0].value, results[0].node)
+        self.assertEqual(script.stdout, None)
+
+    def test_command_timeout(self):
+        nodes = _nodes('10.0.0.1', '10.0.0.8')
+        nodes.append(Node(id='x', name='noip', state=NodeState.PENDING,
+                          public_ip=[], private_ip=[],
+                          driver=_NodeDriver()))
+        executor = ParallelSSHExecutor(nodes, client_class=FakeHostClient,
+                                       command_timeout=0.2)
+        results = executor.run_command('sleep')
+        self.assertTrue(results[0].succeeded())
+        self.assertTrue('Timed out' in str(results[1].error))
+        self.assertEqual(results[2].hostname, None)
+        self.assertFalse(results[2].succeeded())
+        # The timed out connection is not reused
+        executor.run_command('uptime')
+        self.assertEqual(FakeHostClient.connects.count('10.0.0.8'), 2)
+        self.assertEqual(FakeHostClient.connects.count('10.0.0.1'), 1)
+        executor.close()
+
+class SSHProbeTests(unittest.TestCase):
+
+    def test_probe_ssh(self):
+        server = BannerServer()
+        server.start()
+        try:
+            self.assertEqual(probe_ssh('127.0.0.1', server.port, 1),
+                             'SSH-2.0-OpenSSH_5.1')
+            self.assertEqual(probe_ssh('127.0.0.1', server.port, 1,
+                                       banner=False), True)
+        finally:
+            server.close()
+
+    def test_probe_ssh_not_ssh(self):
+        server = BannerServer(banner='220 smtp ready\r\n')
+        server.start()
+        try:
+            self.assertEqual(probe_ssh('127.0.0.1', server.port, 1), None)
+        finally:
+            server.close()
+
+    def test_wait_for_ssh(self):
+        # Bound but not yet listening: connections are refused at first.
+        server = BannerServer()
+        timer = threading.Timer(0.1, server.start)
+        timer.start()
+        try:
+            self.assertEqual(wait_for_ssh('127.0.0.1', server.port,
+                                          timeout=5, interval=0.05),
+                             'SSH-2.0-OpenSSH_5.1')
+        finally:
+            timer.join()
+            server.close()
+
+    def test_wait_for_ssh_timeout(self):
+        server = BannerServer()
+        try:
+            self.assertRaises(Exception, wait_for_ssh, '127.0.0.1',
+                              server.port, timeout=0.1, interval=0.05)
+        finally:
+            server.close()
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
@@ -13,13 +13,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import sys
+import re
+import time
+import random
 import unittest
+import urlparse
 import exceptions
 
 from libcloud.drivers.vcloud import TerremarkDriver
-from libcloud.drivers.vcloud import VCloudNodeDriver
+from libcloud.drivers.vcloud import VCloudNodeDriver, _TaskWatch
 from libcloud.base import Node, NodeImage, NodeSize
 from libcloud.types import NodeState
+from libcloud.operations import wait_all
 
 from test import MockHttp, TestCaseMixin
 from test.file_fixtures import FileFixtures
@@ -40,6 +45,49 @@ class TerremarkTests(unittest.TestCase, TestCaseMixin):
         ret = self.driver.list_images()
         self.assertEqual(ret[0].id,'https://services.vcloudexpress.terremark.com/api/v0.8/vAppTemplate/5')
 
+    def test_list_images_cached(self):
+        VCloudNodeDriver.connectionCls.conn_classes = (None,
+                                                       TerremarkCountingMockHttp)
+        TerremarkCountingMockHttp.paths = []
+        TerremarkCountingMockHttp.etag = None
+        self.driver = TerremarkDriver(TERREMARK_USER, TERREMARK_SECRET)
+        first = self.driver.list_images()
+        paths = list(TerremarkCountingMockHttp.paths)
+        self.assertTrue('/api/v0.8/catalogItem/5' in paths)
+
+        TerremarkCountingMockHttp.paths = []
+        second = self.driver.list_images()
+        self.assertEqual([i.id for i in first], [i.id for i in second])
+        self.assertEqual(TerremarkCountingMockHttp.paths, [])
+
+        # Once expired, unchanged catalogs don't refetch their items
+        self.driver._images_time = 0
+        third = self.driver.list_images()
+        self.assertEqual([i.id for i in first], [i.id for i in third])
+        self.assertTrue('/api/v0.8/vdc/224/catalog'
+                        in TerremarkCountingMockHttp.paths)
+        self.assertFalse('/api/v0.8/catalogItem/5'
+                         in TerremarkCountingMockHttp.paths)
+
+        # A changed catalog version refetches that catalog's items
+        TerremarkCountingMockHttp.paths = []
+        TerremarkCountingMockHttp.etag = '"2"'
+        self.driver._images_time = 0
+        self.driver.list_images()
+        self.assertTrue('/api/v0.8/catalogItem/5'
+                        in TerremarkCountingMockHttp.paths)
+
+        TerremarkCountingMockHttp.paths = []
+        self.driver._images_time = 0
+        self.driver.list_images()
+        self.assertFalse('/api/v0.8/catalogItem/5'
+                         in TerremarkCountingMockHttp.paths)
+
+        TerremarkCountingMockHttp.paths = []
+        self.driver.list_images(refresh=True)
+        self.assertTrue('/api/v0.8/catalogItem/5'
+                        in TerremarkCountingMockHttp.paths)
+
     def test_list_sizes(self):
         ret = self.driver.list_sizes()
         self.assertEqual(ret[0].ram, 512)
@@ -59,6 +107,73 @@ class TerremarkTests(unittest.TestCase, TestCaseMixin):
         self.assertEqual(node.id, 'https://services.vcloudexpress.terremark.com/api/v0.8/vapp/14031')
         self.assertEqual(node.name, 'testerpart2')
         
+    def test_topology_cached(self):
+        VCloudNodeDriver.connectionCls.conn_classes = (None,
+                                                       TerremarkCountingMockHttp)
+        TerremarkCountingMockHttp.paths = []
+        self.driver = TerremarkDriver(TERREMARK_USER, TERREMARK_SECRET)
+        image = self.driver.list_images()[0]
+        size = self.driver.list_sizes()[0]
+        for i in range(3):
+            self.driver.create_node(name='testerpart2', image=image,
+                                    size=size)
+        paths = TerremarkCountingMockHttp.paths
+        self.assertEqual(paths.count('/api/v0.8/org/240'), 1)
+        self.assertEqual(self.driver.networks[0].get('href'),
+                         'https://services.vcloudexpress.terremark.com/api/v0.8/network/725')
+
+        self.driver.refresh_topology()
+        self.assertEqual(paths.count('/api/v0.8/org/240'), 2)
+
+        self.driver._topology.fetched_at = 0
+        self.assertEqual(self.driver.vdcs, ['/api/v0.8/vdc/224'])
+        self.assertEqual(paths.count('/api/v0.8/org/240'), 3)
+
+    def test_task_waiter(self):
+        VCloudNodeDriver.connectionCls.conn_classes = (None,
+                                                       TerremarkTaskMockHttp)
+        TerremarkTaskMockHttp.polls = {}
+        self.driver = TerremarkDriver(TERREMARK_USER, TERREMARK_SECRET)
+        waiter = self.driver.task_waiter
+        waiter.min_interval = 0.01
+        futures = [waiter.watch('/api/v0.8/task/%d' % i)
+                   for i in range(1, 6)]
+        self.assertEqual([f.result(5) for f in futures],
+                         ['/api/v0.8/task/%d' % i for i in range(1, 6)])
+        # task/N reports running for its first N polls
+        self.assertEqual(TerremarkTaskMockHttp.polls,
+                         dict([(str(i), i + 1) for i in range(1, 6)]))
+        self.assertTrue(waiter.expected_duration > 0)
+
+        failed = waiter.watch('/api/v0.8/task/error')
+        self.assertRaises(Exception, failed.result, 5)
+        slow = waiter.watch('/api/v0.8/task/1000', timeout=0.05)
+        self.assertRaises(Exception, slow.result, 5)
+
+    def test_next_interval(self):
+        waiter = self.driver.task_waiter
+        watch = _TaskWatch('/api/v0.8/task/1', 100)
+        now = watch.started
+        self.assertEqual(waiter._next_interval(watch, now), 1)
+        self.assertEqual(waiter._next_interval(watch, now), 1.5)
+        waiter.expected_duration = 20
+        self.assertEqual(waiter._next_interval(watch, now + 5), 15)
+        self.assertEqual(waiter._next_interval(watch, now + 99.5), 0.5)
+
+    def test_destroy_nodes(self):
+        nodes = self.driver.list_nodes() * 3
+        self.assertEqual(self.driver.destroy_nodes(nodes), [True] * 3)
+
+    def test_create_node_async(self):
+        image = self.driver.list_images()[0]
+        size = self.driver.list_sizes()[0]
+        handles = [self.driver.create_node_async(name='testerpart2',
+                                                 image=image, size=size)
+                   for i in range(3)]
+        nodes = wait_all(handles, 5)
+        self.assertEqual([n.name for n in nodes], ['testerpart2'] * 3)
+        self.assertTrue(handles[0].done())
+
     def test_list_nodes(self):
         ret = self.driver.list_nodes()
         node = ret[0]
@@ -68,6 +183,24 @@ class TerremarkTests(unittest.TestCase, TestCaseMixin):
         self.assertEqual(node.public_ip, [])
         self.assertEqual(node.private_ip, ['10.112.78.69'])
         
+    def test_list_nodes_summary(self):
+        ret = self.driver.list_nodes(detail=False)
+        node = ret[0]
+        self.assertEqual(node.id, 'https://services.vcloudexpress.terremark.com/api/v0.8/vapp/14031')
+        self.assertEqual(node.name, 'testerpart2')
+        self.assertEqual(node.state, NodeState.UNKNOWN)
+        self.assertEqual(node.private_ip, [])
+
+    def test_list_nodes_keeps_order(self):
+        VCloudNodeDriver.connectionCls.conn_classes = (None,
+                                                       TerremarkManyMockHttp)
+        self.driver = TerremarkDriver(TERREMARK_USER, TERREMARK_SECRET)
+        ret = self.driver.list_nodes()
+        self.assertEqual([n.name for n in ret],
+                         ['vapp-%d' % i for i in range(20)])
+        self.assertEqual(ret[7].id, 'https://services.vcloudexpress.terremark.com/api/v0.8/vapp/7')
+        self.assertEqual(ret[7].state, NodeState.RUNNING)
+
     def test_reboot_node(self):
         node = self.driver.list_nodes()[0]
         ret = self.driver.reboot_node(node)
@@ -139,5 +272,75 @@ class TerremarkMockHttp(MockHttp):
         body = self.fixtures.load('api_v0_8_task_11001.xml')
         return (httplib.ACCEPTED, body, headers, httplib.responses[httplib.ACCEPTED])
 
+class TerremarkTaskMockHttp(TerremarkMockHttp):
+    """
+    task/N reports running for its first N polls, then success.
+    """
+    polls = {}
+
+    def request(self, method, url, body=None, headers=None):
+        path = urlparse.urlparse(url)[2]
+        match = re.match(r'^/api/v0.8/task/(\w+)$', path)
+        if match is None:
+            return TerremarkMockHttp.request(self, method, url, body, headers)
+        task = match.group(1)
+        polls = self.polls[task] = self.polls.get(task, 0) + 1
+        if task == 'error':
+            status = 'error'
+        elif polls > int(task):
+            status = 'success'
+        else:
+            status = 'running'
+        body = '<Task xmlns="http://www.vmware.com/vcloud/v0.8" status="%s"/>'
+        self.response = self.responseCls(httplib.OK, body % status, {},
+                                         httplib.responses[httplib.OK])
+
+class TerremarkCountingMockHttp(TerremarkMockHttp):
+    """
+    Records the path of every request made; the catalog carries C{etag}.
+    """
+    paths = []
+    etag = None
+
+    def request(self, method, url, body=None, headers=None):
+        TerremarkCountingMockHttp.paths.append(urlparse.urlparse(url)[2])
+        return TerremarkMockHttp.request(self, method, url, body, headers)
+
+    def _api_v0_8_vdc_224_catalog(self, method, url, body, headers):
+        status, body, headers, reason = \
+            TerremarkMockHttp._api_v0_8_vdc_224_catalog(self, method, url,
+                                                        body, headers)
+        headers = {}
+        if self.etag is not None:
+            headers['etag'] = self.etag
+        return (status, body, headers, reason)
+
+class TerremarkManyMockHttp(TerremarkMockHttp):
+    """
+    VDC holding 20 vApps, answered in a shuffled order.
+    """
+    vapps = 20
+
+    def request(self, method, url, body=None, headers=None):
+        path = urlparse.urlparse(url)[2]
+        match = re.match(r'^/api/v0.8/vapp/(\d+)$', path)
+        if match is None:
+            return TerremarkMockHttp.request(self, method, url, body, headers)
+        time.sleep(random.random() / 100)
+        body = self.fixtures.load('api_v0_8_vapp_14031_get.xml')
+        body = body.replace('/vapp/14031', '/vapp/%s' % match.group(1))
+        self.response = self.responseCls(httplib.OK, body, {},
+                                        httplib.responses[httplib.OK])
+
+    def _api_v0_8_vdc_224(self, method, url, body, headers):
+        entity = ('<ResourceEntity href="https://services.vcloudexpress.terremark.com/api/v0.8/vapp/%d" '
+                  'type="application/vnd.vmware.vcloud.vApp+xml" name="vapp-%d"/>')
+        entities = ''.join([entity % (i, i) for i in range(self.vapps)])
+        body = self.fixtures.load('api_v0_8_vdc_224.xml')
+        body = re.sub(r'(?s)<ResourceEntities>.*</ResourceEntities>',
+                      '<ResourceEntities>%s</ResourceEntities>' % entities,
+                      body)
+        return (httplib.OK, body, headers, httplib.responses[httplib.OK])
+
 if __name__ == '__main__':
     sys.exit(unittest.main())
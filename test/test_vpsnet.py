@@ -45,6 +45,13 @@ class VPSNetTests(unittest.TestCase, TestCaseMixin):
         self.assertEqual(node.id, 1384)
         self.assertEqual(node.state, NodeState.RUNNING)
 
+    def test_get_node(self):
+        VPSNetMockHttp.type = 'get'
+        node = self.driver.get_node(1384)
+        self.assertEqual(node.id, 1384)
+        self.assertEqual(node.name, 'Web Server 01')
+        self.assertEqual(self.driver.get_node(1), None)
+
     def test_reboot_node(self):
         VPSNetMockHttp.type = 'virtual_machines'
         node = self.driver.list_nodes()[0]
@@ -135,6 +142,32 @@ class VPSNetMockHttp(MockHttp):
               }"""
         return (httplib.OK, body, {}, httplib.responses[httplib.OK])
 
+    def _virtual_machines_1384_api10json_get(self, method, url, body, headers):
+        body = """{
+              "virtual_machine":
+                {
+                  "running": true,
+                  "updated_at": "2009-05-15T06:55:02-04:00",
+                  "power_action_pending": false,
+                  "system_template_id": 41,
+                  "id": 1384,
+                  "cloud_id": 3,
+                  "domain_name": "demodomain.com",
+                  "hostname": "web01",
+                  "consumer_id": 0,
+                  "backups_enabled": false,
+                  "password": "a8hjsjnbs91",
+                  "label": "Web Server 01",
+                  "slices_count": null,
+                  "created_at": "2009-04-16T08:17:39-04:00"
+                }
+              }"""
+        return (httplib.OK, body, {}, httplib.responses[httplib.OK])
+
+    def _virtual_machines_1_api10json_get(self, method, url, body, headers):
+        body = """{"errors": ["Virtual machine not found"]}"""
+        return (httplib.NOT_FOUND, body, {}, httplib.responses[httplib.NOT_FOUND])
+
     def _virtual_machines_api10json_create(self, method, url, body, headers):
         body = """{
               "virtual_machine": 
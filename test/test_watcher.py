@@ -0,0 +1,131 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# libcloud.org licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import socket
+import sys
+import unittest
+
+from libcloud.base import Node, NodeCollection
+from libcloud.types import NodeState, InvalidCredsException
+from libcloud.watcher import StateWatcher
+
+class BootingDriver(object):
+    """
+    Node N turns running on the Nth request; records every request.
+    """
+    type = 0
+    get_nodes_is_batched = True
+
+    def __init__(self, count):
+        self.count = count
+        self.calls = []
+
+    def _nodes(self, ids):
+        tick = len(self.calls)
+        nodes = NodeCollection()
+        for i in ids:
+            if tick >= i:
+                state, ips = NodeState.RUNNING, ['10.0.0.%d' % i]
+            else:
+                state, ips = NodeState.PENDING, []
+            nodes.append(Node(id=i, name='node-%d' % i, state=state,
+                              public_ip=ips, private_ip=[], driver=self))
+        return nodes
+
+    def get_nodes(self, node_ids):
+        self.calls.append(('get_nodes', list(node_ids)))
+        return self._nodes(node_ids)
+
+    def list_nodes(self):
+        self.calls.append(('list_nodes', None))
+        return self._nodes(range(1, self.count + 1))
+
+class StateWatcherTests(unittest.TestCase):
+
+    def watcher(self, driver):
+        watcher = StateWatcher(driver)
+        watcher.min_interval = 0.01
+        return watcher
+
+    def test_one_request_per_tick(self):
+        driver = BootingDriver(5)
+        watcher = self.watcher(driver)
+        futures = watcher.watch_all(driver._nodes(range(1, 6)))
+        nodes = [f.result(5) for f in futures]
+        self.assertEqual([n.public_ip for n in nodes],
+                         [['10.0.0.%d' % i] for i in range(1, 6)])
+        self.assertEqual(watcher.ticks, len(driver.calls))
+        self.assertTrue(len(driver.calls) <= 6)
+        self.assertEqual(driver.calls[0], ('get_nodes', [1, 2, 3, 4, 5]))
+
+    def test_lists_when_get_nodes_is_not_batched(self):
+        driver = BootingDriver(3)
+        driver.get_nodes_is_batched = False
+        watcher = self.watcher(driver)
+        futures = watcher.watch_all(driver._nodes([2, 3]))
+        [f.result(5) for f in futures]
+        # A lone node is still fetched on its own
+        self.assertTrue(('list_nodes', None) in driver.calls)
+        for name, ids in driver.calls:
+            self.assertTrue(ids is None or len(ids) == 1)
+
+    def test_backoff_and_timeout(self):
+        driver = BootingDriver(1)
+        watcher = self.watcher(driver)
+        node = driver._nodes([1])[0]
+        future = watcher.watch(node, predicate=lambda n: False, timeout=0.2)
+        self.assertRaises(Exception, future.result, 5)
+        self.assertTrue(watcher.interval > watcher.min_interval)
+        # The state change on the first tick and no changes afterwards
+        self.assertTrue(len(driver.calls) < 20)
+
+    def test_predicate_errors(self):
+        driver = BootingDriver(1)
+        watcher = self.watcher(driver)
+        def predicate(node):
+            raise ValueError()
+        future = watcher.watch(driver._nodes([1])[0], predicate=predicate)
+        self.assertRaises(ValueError, future.result, 5)
+
+    def test_duplicate_nodes(self):
+        driver = BootingDriver(1)
+        driver.get_nodes = lambda ids: driver._nodes(list(ids) * 2)
+        watcher = self.watcher(driver)
+        future = watcher.watch(driver._nodes([1])[0])
+        self.assertRaises(Exception, future.result, 5)
+        self.assertTrue('same id' in str(future.exception()))
+
+    def test_request_errors(self):
+        driver = BootingDriver(1)
+        def get_nodes(ids):
+            driver.calls.append(('get_nodes', list(ids)))
+            raise InvalidCredsException('bad key')
+        driver.get_nodes = get_nodes
+        watcher = self.watcher(driver)
+        future = watcher.watch(driver._nodes([1])[0])
+        self.assertRaises(InvalidCredsException, future.result, 5)
+        self.assertEqual(len(driver.calls), 1)
+
+        # Network errors are retried until the deadline, then named
+        def get_nodes(ids):
+            driver.calls.append(('get_nodes', list(ids)))
+            raise socket.error('connection refused')
+        driver.get_nodes = get_nodes
+        future = watcher.watch(driver._nodes([1])[0], timeout=0.2)
+        self.assertRaises(Exception, future.result, 5)
+        self.assertTrue(len(driver.calls) > 2)
+        self.assertTrue('connection refused' in str(future.exception()))
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())